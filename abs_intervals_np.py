@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+#
+# abs_intervals_np.py
+#
+# Interval abstract memories stored as NumPy arrays. It requires NumPy.
+#
+# An IntervalArray keeps the lower and upper bounds of all variables in
+# two int64 arrays, so that joins, widening, narrowing, inclusion and
+# equality of whole memories are a few array operations rather than a
+# call into IntervalsDomain per variable. INT64_MIN and INT64_MAX stand
+# for -inf and +inf, and a variable that is BOT has the bounds
+# (INT64_MAX, INT64_MIN), which min and max then handle without any
+# special casing. Finite bounds that do not fit between these go to
+# the infinity they are closest to, which only loses precision.
+#
+# IntervalArrayAbstraction plugs these into sem_abs.evaluate_Cmd_abs.
+# The interpreter reads and sets variables of an IntervalArray as
+# Intervals, as it does for a PersistentMemory, and the whole-memory
+# operations are the abstraction's.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to abs_intervals_np.py.
+# This work is published from: United States.
+
+from typing import List, Mapping as MappingType, Optional, Tuple
+from collections.abc import Mapping
+from abs_memory import BOTTOM, Layout, layout_names
+from dom_intervals import IntervalsDomain, Interval, BOT, PINF, NINF, make
+import abs_trace
+import abstractions
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MIN = np.iinfo(np.int64).min
+MAX = np.iinfo(np.int64).max
+
+def _lo(v) -> int:
+    if v == NINF or v <= MIN: return MIN
+    return int(v) if v < MAX else MAX - 1
+
+def _hi(v) -> int:
+    if v == PINF or v >= MAX: return MAX
+    return int(v) if v > MIN else MIN + 1
+
+class IntervalArray(Mapping):
+    """An immutable memory of intervals over the variables of a Layout.
+
+    The arrays may be shorter than the layout, the variables past their
+    end are BOT, as for a SignsVector. So unlike a PersistentMemory,
+    which keeps a variable that only one memory has as it is when
+    narrowing, narrowing with an array without it gives BOT.
+    """
+    __slots__ = ('layout', 'lo', 'hi', '_hash')
+
+    def __init__(self, layout: Layout, lo: np.ndarray, hi: np.ndarray):
+        lo.flags.writeable = False
+        hi.flags.writeable = False
+        self.layout = layout
+        self.lo = lo
+        self.hi = hi
+        self._hash = None
+
+    @classmethod
+    def from_memory(cls, m: MappingType[str, Interval], layout: Layout = None) -> 'IntervalArray':
+        """Returns m, a mapping of variables to Intervals, as an array"""
+        if layout is None: layout = Layout(tuple(sorted(m)))
+        for x in m:
+            if x not in layout.index: layout = layout.extend(x)
+
+        n = len(layout.names)
+        lo, hi = np.full(n, MAX, dtype = np.int64), np.full(n, MIN, dtype = np.int64)
+        for x, v in m.items():
+            if v is not BOT:
+                i = layout.index[x]
+                lo[i], hi[i] = _lo(v.lo), _hi(v.hi)
+
+        return cls(layout, lo, hi)
+
+    def __getitem__(self, x) -> Interval:
+        i = self.layout.index[x]
+        if i >= len(self.lo): return BOT
+
+        lo, hi = self.lo[i], self.hi[i]
+        if lo > hi: return BOT
+        return make(NINF if lo == MIN else int(lo), PINF if hi == MAX else int(hi))
+
+    def __len__(self):
+        return len(self.layout.names)
+
+    def __iter__(self):
+        return iter(self.layout.names)
+
+    def set(self, x: str, v: Interval) -> 'IntervalArray':
+        layout = self.layout
+        i = layout.index.get(x)
+        if i is None:
+            layout = layout.extend(x)
+            i = len(layout.names) - 1
+
+        lo, hi = self._padded(max(len(self.lo), i + 1))
+        lo, hi = lo.copy(), hi.copy()
+        if v is BOT:
+            lo[i], hi[i] = MAX, MIN
+        else:
+            lo[i], hi[i] = _lo(v.lo), _hi(v.hi)
+
+        return IntervalArray(layout, lo, hi)
+
+    def _padded(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(self.lo) == n: return self.lo, self.hi
+
+        lo, hi = np.full(n, MAX, dtype = np.int64), np.full(n, MIN, dtype = np.int64)
+        lo[:len(self.lo)] = self.lo
+        hi[:len(self.hi)] = self.hi
+        return lo, hi
+
+    def align(self, other: 'IntervalArray') -> Tuple[Layout, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Returns a layout covering both, and the bounds of self and of
+        other over it"""
+        if self.layout.covers(other.layout):
+            layout = self.layout
+        elif other.layout.covers(self.layout):
+            layout = other.layout
+        else:
+            layout = self.layout.union(other.layout)
+            a, b = IntervalArray.from_memory(self, layout), IntervalArray.from_memory(other, layout)
+            return (layout,) + a._padded(len(layout.names)) + b._padded(len(layout.names))
+
+        n = max(len(self.lo), len(other.lo))
+        return (layout,) + self._padded(n) + other._padded(n)
+
+    def diff(self, other: 'IntervalArray') -> List[str]:
+        """Returns the variables whose bounds differ"""
+        layout, lo0, hi0, lo1, hi1 = self.align(other)
+        return [layout.names[i] for i in np.flatnonzero((lo0 != lo1) | (hi0 != hi1))]
+
+    def __eq__(self, other):
+        if self is other: return True
+        if isinstance(other, IntervalArray):
+            _, lo0, hi0, lo1, hi1 = self.align(other)
+            return bool(np.array_equal(lo0, lo1) and np.array_equal(hi0, hi1))
+        elif isinstance(other, Mapping):
+            return dict(self.items()) == dict(other.items())
+
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        if self._hash is None:
+            # trailing BOTs, which a longer layout adds, don't change it
+            used = np.flatnonzero(self.lo != MAX)
+            n = used[-1] + 1 if len(used) else 0
+            self._hash = hash((self.lo[:n].tobytes(), self.hi[:n].tobytes()))
+
+        return self._hash
+
+    def __repr__(self):
+        return "{" + ", ".join([f"{x!r}: {v}" for x, v in self.items()]) + "}"
+
+class IntervalArrayAbstraction(abstractions.NonRelationalAbstraction):
+    """A NonRelationalAbstraction over an IntervalsDomain whose memories
+    are IntervalArrays. Widening uses the thresholds of the domain.
+
+    With a SymbolTable, phi() lays memories out by it, so the bounds of
+    a variable interned in it are at its slot."""
+    def __init__(self, domain = None, strategy = None, cache = None, profiler = None, symbols = None):
+        super().__init__(domain or IntervalsDomain(), strategy, cache, profiler)
+        self.thresholds = np.array([_lo(t) for t in self.dom.thresholds], dtype = np.int64)
+        self.symbols = symbols
+        # one layout per set of variables, so that aligning memories
+        # from different phi() calls is an identity check
+        self.layouts: dict = {}
+
+    def phi(self, M):
+        names = tuple(layout_names(M, self.symbols))
+        self.BOT = dict([(x, self.dom.BOT) for x in names])
+        if len(M) == 0: return BOTTOM
+
+        layout = self.layouts.get(names)
+        if layout is None:
+            layout = self.layouts[names] = Layout(names)
+
+        lo, hi = np.full(len(names), MAX, dtype = np.int64), np.full(len(names), MIN, dtype = np.int64)
+        for i, x in enumerate(names):
+            vs = [m[x] for m in M if x in m]
+            if len(vs): lo[i], hi[i] = _lo(min(vs)), _hi(max(vs))
+
+        return IntervalArray(layout, lo, hi)
+
+    def _array(self, M_abs) -> IntervalArray:
+        return M_abs if isinstance(M_abs, IntervalArray) else IntervalArray.from_memory(M_abs)
+
+    def lte(self, M0_abs, M1_abs):
+        if M0_abs is BOTTOM: return True
+        if M1_abs is BOTTOM: return False
+
+        _, lo0, hi0, lo1, hi1 = self._array(M0_abs).align(self._array(M1_abs))
+        # a BOT variable has lo = MAX and hi = MIN, so it is included
+        # in everything, and only includes BOT
+        return bool(np.all(lo0 >= lo1) and np.all(hi0 <= hi1))
+
+    def union(self, m0, m1):
+        if m0 is BOTTOM: return m1
+        if m1 is BOTTOM: return m0
+
+        layout, lo0, hi0, lo1, hi1 = self._array(m0).align(self._array(m1))
+        out = IntervalArray(layout, np.minimum(lo0, lo1), np.maximum(hi0, hi1))
+        if abs_trace.enabled: abs_trace.emit('join', left = m0, right = m1, result = out)
+        return out
+
+    def widen(self, m0, m1):
+        if m0 is BOTTOM: return m1
+        if m1 is BOTTOM: return m0
+
+        layout, lo0, hi0, lo1, hi1 = self._array(m0).align(self._array(m1))
+
+        # as IntervalsDomain.widen, a bound that moved goes to the next
+        # threshold past it
+        t = self.thresholds
+        if len(t):
+            below = np.searchsorted(t, lo1, 'right') - 1
+            below = np.where(below >= 0, t[np.maximum(below, 0)], MIN)
+            above = np.searchsorted(t, hi1, 'left')
+            above = np.where(above < len(t), t[np.minimum(above, len(t) - 1)], MAX)
+        else:
+            below, above = MIN, MAX
+
+        lo = np.where(lo1 < lo0, below, lo0)
+        hi = np.where(hi1 > hi0, above, hi0)
+
+        # widen(BOT, y) is y
+        bot = lo0 > hi0
+        out = IntervalArray(layout, np.where(bot, lo1, lo), np.where(bot, hi1, hi))
+        if abs_trace.enabled: abs_trace.emit('widen', left = m0, right = m1, result = out)
+        return out
+
+    def narrow(self, m0, m1):
+        if m0 is BOTTOM or m1 is BOTTOM: return BOTTOM
+
+        layout, lo0, hi0, lo1, hi1 = self._array(m0).align(self._array(m1))
+        lo, hi = np.maximum(lo0, lo1), np.minimum(hi0, hi1)
+        empty = lo > hi
+        return IntervalArray(layout, np.where(empty, MAX, lo), np.where(empty, MIN, hi))
+
+def test_IntervalArray():
+    d = IntervalsDomain([0, 10])
+    nra = abstractions.NonRelationalAbstraction(d)
+    iaa = IntervalArrayAbstraction(d)
+
+    M0 = [{'x': 25, 'y': 7, 'z': -12}, {'x': 28, 'y': -7, 'z': -11}]
+    M1 = [{'x': 20, 'y': 0, 'z': -10}, {'x': 35, 'y': 8, 'z': -9}]
+    A0, A1 = iaa.phi(M0), iaa.phi(M1)
+    P0, P1 = nra.phi(M0), nra.phi(M1)
+    assert A0 == P0 and A0['x'] == make(25, 28) and A0.layout is A1.layout
+
+    # the same results as a NonRelationalAbstraction, for every
+    # operation. Variables an array does not have are BOT, which the
+    # memories need to be told.
+    for a, b, p, q in [(A0, A1, P0, P1), (A1, A0, P1, P0), (A0, A0.set('w', make(1, 2)), P0.set('w', BOT), P0.set('w', make(1, 2))),
+                       (A0.set('y', BOT), A1, P0.set('y', BOT), P1),
+                       (A0.set('x', make(NINF, 3)), A1.set('x', make(-5, PINF)), P0.set('x', make(NINF, 3)), P1.set('x', make(-5, PINF)))]:
+        for op in ['union', 'widen', 'narrow']:
+            out = getattr(iaa, op)(a, b)
+            assert out == getattr(nra, op)(p, q), (op, a, b, out, getattr(nra, op)(p, q))
+
+        assert iaa.lte(a, b) == nra.lte(p, q) and iaa.lte(a, iaa.union(a, b))
+
+    assert iaa.union(BOTTOM, A0) is A0 and iaa.lte(BOTTOM, A0) and not iaa.lte(A0, BOTTOM)
+    assert iaa.included(M0, A0) and not iaa.included(M1, A0)
+    assert A0.diff(A0.set('y', make(0, 0))) == ['y'] and A0.diff(A1.set('w', BOT)) == ['x', 'y', 'z']
+    assert hash(A0) == hash(A0.set('w', BOT)) and A0 == A0.set('w', BOT)
+
+    # layouts that don't cover each other are aligned by name
+    B = IntervalArray.from_memory({'w': make(0, 1), 'x': make(0, 0)})
+    assert iaa.union(A0, B) == {'w': make(0, 1), 'x': make(0, 28), 'y': make(-7, 7), 'z': make(-12, -11)}
+
+    # bounds that don't fit in int64 become infinite
+    big = A0.set('x', make(-2 ** 70, 2 ** 70))
+    assert big['x'] == make(NINF, PINF)
+
+def test_IntervalArray_programs():
+    from tinyast import Var, BinOp, BoolExpr, Assign, While, IfThenElse, Program, Input, sequence, intern_variables
+    from sem_abs import evaluate_Cmd_abs, IterationStrategy, program_thresholds
+    from sem import evaluate_Cmd
+    import sem_abs_compile
+
+    x, y = Var('x'), Var('y')
+    p = Program(sequence([Assign(y, 0),
+                          While(BoolExpr('<', x, 100),
+                                sequence([Assign(x, BinOp('+', x, 1)),
+                                          IfThenElse(BoolExpr('>', y, 3), Assign(y, BinOp('-', y, 1)), Assign(y, 10)),
+                                          Input(Var('z'))]))]))
+    M = [dict([('x', 3), ('y', 4), ('z', 0)] + [(f"v{i}", i) for i in range(100)])]
+
+    for strategy in [None, IterationStrategy(narrowing = 2)]:
+        for dom in [IntervalsDomain(), IntervalsDomain(program_thresholds(p))]:
+            for compiled in [True, False]:
+                sem_abs_compile.enabled = compiled
+                try:
+                    nra = abstractions.NonRelationalAbstraction(dom, strategy)
+                    iaa = IntervalArrayAbstraction(dom, strategy)
+                    out = evaluate_Cmd_abs(p, iaa.phi(M), iaa)
+                finally:
+                    sem_abs_compile.enabled = True
+
+                assert isinstance(out, IntervalArray) and out == evaluate_Cmd_abs(p, nra.phi(M), nra)
+                assert iaa.included(evaluate_Cmd(p, M), out)
+
+    # laid out by the program's symbol table, variables are at their slots
+    symbols = intern_variables(p)
+    iaa = IntervalArrayAbstraction(symbols = symbols)
+    M_abs = iaa.phi(M)
+    assert M_abs.layout.names[:3] == ('y', 'x', 'z') and M_abs.lo[x.slot] == 3 and M_abs.lo[y.slot] == 4
+    nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+    assert evaluate_Cmd_abs(p, M_abs, iaa) == evaluate_Cmd_abs(p, nra.phi(M), nra)
+
+if __name__ == "__main__":
+    test_IntervalArray()
+    test_IntervalArray_programs()
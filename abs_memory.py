@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+#
+# abs_memory.py
+#
+# An immutable abstract memory, mapping variable names to abstract
+# values, whose updates share structure with the memory they update.
+#
+# Large memories are hash array mapped tries (HAMTs): each node branches
+# on 5 bits of a variable's hash, so setting a variable copies at most
+# one small node per level instead of the whole memory. Nodes cache
+# their size and a hash of their contents, which makes comparing
+# memories cheap, and comparisons skip subtrees that are shared. Small
+# memories are plain dicts that are copied on update.
+#
+# BOTTOM is the memory that represents no concrete memories at all.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to abs_memory.py. This
+# work is published from: United States.
+
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_MASK = (1 << 64) - 1
+
+# after this shift, all the bits of a hash have been used, and keys with
+# the same hash are kept in a _Collision
+_MAX_SHIFT = 64
+
+# Leaves are tuples (key hash, key, value, hash of (key, value)), and
+# the hash of a node is the sum of the hashes of its leaves.
+
+class _Node(object):
+    __slots__ = ('bitmap', 'entries', 'hash', 'size')
+
+    def __init__(self, bitmap, entries, hash, size):
+        self.bitmap = bitmap
+        self.entries = entries
+        self.hash = hash
+        self.size = size
+
+class _Collision(object):
+    __slots__ = ('khash', 'entries', 'hash', 'size')
+
+    def __init__(self, khash, entries, hash, size):
+        self.khash = khash
+        self.entries = entries
+        self.hash = hash
+        self.size = size
+
+_EMPTY = _Node(0, (), 0, 0)
+
+def _leaf(key, value):
+    return (hash(key) & _HASH_MASK, key, value, hash((key, value)))
+
+def _get(node, khash, key):
+    shift = 0
+    while True:
+        if type(node) is _Collision:
+            for l in node.entries:
+                if l[1] == key: return l
+
+            return None
+
+        bit = 1 << ((khash >> shift) & _MASK)
+        if not node.bitmap & bit: return None
+
+        e = node.entries[(node.bitmap & (bit - 1)).bit_count()]
+        if type(e) is tuple:
+            return e if e[1] == key else None
+
+        node = e
+        shift += _BITS
+
+def _pair(a, b, shift):
+    """Returns a node containing the leaves a and b, with different keys"""
+    if shift >= _MAX_SHIFT:
+        return _Collision(a[0], (a, b), (a[3] + b[3]) & _HASH_MASK, 2)
+
+    ia = (a[0] >> shift) & _MASK
+    ib = (b[0] >> shift) & _MASK
+    h = (a[3] + b[3]) & _HASH_MASK
+    if ia == ib:
+        return _Node(1 << ia, (_pair(a, b, shift + _BITS),), h, 2)
+
+    return _Node((1 << ia) | (1 << ib), (a, b) if ia < ib else (b, a), h, 2)
+
+def _set(node, leaf, shift):
+    """Returns node with leaf added or replaced, or node itself if it
+    already contains an equal leaf"""
+    if type(node) is _Collision:
+        for i, l in enumerate(node.entries):
+            if l[1] == leaf[1]:
+                if l[2] == leaf[2]: return node
+                return _Collision(node.khash, node.entries[:i] + (leaf,) + node.entries[i + 1:],
+                                  (node.hash - l[3] + leaf[3]) & _HASH_MASK, node.size)
+
+        return _Collision(node.khash, node.entries + (leaf,),
+                          (node.hash + leaf[3]) & _HASH_MASK, node.size + 1)
+
+    bit = 1 << ((leaf[0] >> shift) & _MASK)
+    i = (node.bitmap & (bit - 1)).bit_count()
+    entries = node.entries
+
+    if not node.bitmap & bit:
+        return _Node(node.bitmap | bit, entries[:i] + (leaf,) + entries[i:],
+                     (node.hash + leaf[3]) & _HASH_MASK, node.size + 1)
+
+    e = entries[i]
+    if type(e) is tuple:
+        if e[1] == leaf[1]:
+            if e[2] == leaf[2]: return node
+            sub, h, size = leaf, node.hash - e[3] + leaf[3], node.size
+        else:
+            sub, h, size = _pair(e, leaf, shift + _BITS), node.hash + leaf[3], node.size + 1
+    else:
+        sub = _set(e, leaf, shift + _BITS)
+        if sub is e: return node
+        h, size = node.hash - e.hash + sub.hash, node.size - e.size + sub.size
+
+    return _Node(node.bitmap, entries[:i] + (sub,) + entries[i + 1:], h & _HASH_MASK, size)
+
+def _leaves(e) -> Iterator[tuple]:
+    if e is None: return
+
+    stack = [e]
+    while len(stack):
+        e = stack.pop()
+        if type(e) is tuple:
+            yield e
+        else:
+            stack.extend(e.entries)
+
+def _diff(a, b, shift) -> Iterator[tuple]:
+    """Yields (key, value in a, value in b) for the keys whose values
+    differ between the entries a and b, with None for a missing value.
+    Either entry may be None."""
+    if a is b: return
+
+    if type(a) is _Node and type(b) is _Node:
+        if a.hash == b.hash and a.size == b.size and a.entries == b.entries:
+            return
+
+        bits = a.bitmap | b.bitmap
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            ea = a.entries[(a.bitmap & (bit - 1)).bit_count()] if a.bitmap & bit else None
+            eb = b.entries[(b.bitmap & (bit - 1)).bit_count()] if b.bitmap & bit else None
+            if ea is eb: continue
+
+            # the common cases, without recursing
+            ta, tb = type(ea) is tuple, type(eb) is tuple
+            if ta and tb:
+                if ea[1] == eb[1]:
+                    if ea[2] != eb[2]: yield (ea[1], ea[2], eb[2])
+                    continue
+            elif ta and eb is None:
+                yield (ea[1], ea[2], None)
+                continue
+            elif tb and ea is None:
+                yield (eb[1], None, eb[2])
+                continue
+
+            yield from _diff(ea, eb, shift + _BITS)
+
+        return
+
+    la = dict([(l[1], l[2]) for l in _leaves(a)])
+    lb = dict([(l[1], l[2]) for l in _leaves(b)])
+    for k, v in la.items():
+        if k not in lb:
+            yield (k, v, None)
+        elif lb[k] != v:
+            yield (k, v, lb[k])
+
+    for k, v in lb.items():
+        if k not in la: yield (k, None, v)
+
+def _diff_dicts(a, b) -> Iterator[tuple]:
+    """Like _diff, for memories kept in dicts"""
+    for k, v in a.items():
+        w = b.get(k)
+        if w is None:
+            yield (k, v, None)
+        elif w is not v and w != v:
+            yield (k, v, w)
+
+    for k, w in b.items():
+        if k not in a: yield (k, None, w)
+
+def _trie(d):
+    root = _EMPTY
+    for k, v in d.items():
+        root = _set(root, _leaf(k, v), 0)
+
+    return root
+
+_new = object.__new__
+
+# Memories with at most this many variables are kept in a dict, which
+# is copied on every update. At these sizes, copying is faster than
+# walking a trie, in both time and allocations.
+SMALL = 16
+
+class PersistentMemory(Mapping):
+    """An immutable mapping from variable names to abstract values.
+
+    set() returns a new memory that shares all but the updated path with
+    this one. Memories compare equal to other memories, and to dicts,
+    with the same contents.
+    """
+    __slots__ = ('_d', '_root', '_hash')
+
+    def __init__(self, items = ()):
+        d = dict(items)
+        if len(d) <= SMALL:
+            self._d, self._root = d, None
+        else:
+            self._d, self._root = None, _trie(d)
+
+        self._hash = None
+
+    @classmethod
+    def _make(cls, d, root) -> 'PersistentMemory':
+        m = object.__new__(cls)
+        m._d = d
+        m._root = root
+        m._hash = None
+        return m
+
+    def __getitem__(self, key):
+        if self._d is not None: return self._d[key]
+
+        l = _get(self._root, hash(key) & _HASH_MASK, key)
+        if l is None: raise KeyError(key)
+        return l[2]
+
+    def get(self, key, default = None):
+        if self._d is not None: return self._d.get(key, default)
+
+        l = _get(self._root, hash(key) & _HASH_MASK, key)
+        return default if l is None else l[2]
+
+    def __contains__(self, key):
+        if self._d is not None: return key in self._d
+
+        return _get(self._root, hash(key) & _HASH_MASK, key) is not None
+
+    def __len__(self):
+        return len(self._d) if self._d is not None else self._root.size
+
+    def __iter__(self):
+        if self._d is not None: return iter(self._d)
+
+        return (l[1] for l in _leaves(self._root))
+
+    def items(self):
+        if self._d is not None: return self._d.items()
+
+        return [(l[1], l[2]) for l in _leaves(self._root)]
+
+    def _dict(self):
+        return self._d if self._d is not None else dict(self.items())
+
+    def set(self, key, value) -> 'PersistentMemory':
+        d = self._d
+        if d is not None:
+            old = d.get(key)
+            if old is value or (old is not None and old == value): return self
+
+            d = d.copy()
+            d[key] = value
+            if len(d) > SMALL: return PersistentMemory._make(None, _trie(d))
+
+            m = _new(PersistentMemory)
+            m._d = d
+            m._root = m._hash = None
+            return m
+
+        root = _set(self._root, _leaf(key, value), 0)
+        return self if root is self._root else PersistentMemory._make(None, root)
+
+    def differences(self, other: 'PersistentMemory') -> Iterator[tuple]:
+        """Yields (variable, value here, value in other) for the variables
+        whose values differ, with None for a missing value"""
+        if self._root is not None and other._root is not None:
+            return _diff(self._root, other._root, 0)
+
+        return _diff_dicts(self._dict(), other._dict())
+
+    def diff(self, other: 'PersistentMemory') -> List[str]:
+        """Returns the variables whose values differ between this memory
+        and other, including those that only one of them has"""
+        return [d[0] for d in self.differences(other)]
+
+    def combine(self, other: 'PersistentMemory', f) -> 'PersistentMemory':
+        """Returns the memory with f(self[x], other[x]) for every variable
+        x, which must satisfy f(v, v) == v. Variables that only one
+        memory has keep their value."""
+        out = self
+        for k, a, b in self.differences(other):
+            if a is not None:
+                out = out.set(k, a if b is None else f(a, b))
+            else:
+                out = out.set(k, b)
+
+        return out
+
+    def copy(self) -> 'PersistentMemory':
+        return self
+
+    def __hash__(self):
+        if self._root is not None: return self._root.hash
+
+        if self._hash is None:
+            self._hash = sum([hash(kv) for kv in self._d.items()]) & _HASH_MASK
+
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other: return True
+
+        if isinstance(other, PersistentMemory):
+            if self is BOTTOM or other is BOTTOM: return False
+
+            # the same size means the same representation
+            if self._d is not None: return self._d == other._d
+            if other._d is not None: return False
+
+            a, b = self._root, other._root
+            if a.hash != b.hash: return False
+            return next(_diff(a, b, 0), None) is None
+        elif isinstance(other, Mapping):
+            return self._dict() == dict(other.items())
+
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __repr__(self):
+        return "{" + ", ".join([f"{k!r}: {v!r}" for k, v in self.items()]) + "}"
+
+    def __reduce__(self):
+        return (PersistentMemory, (list(self.items()),))
+
+class _Bottom(PersistentMemory):
+    __slots__ = ()
+
+    def __repr__(self):
+        return "BOTTOM"
+
+    def __hash__(self):
+        return 0
+
+    def __reduce__(self):
+        return "BOTTOM"
+
+# the abstract memory that represents no memories, it has no variables
+BOTTOM = _Bottom._make({}, None)
+
+def as_memory(M) -> PersistentMemory:
+    """Returns M, a PersistentMemory or a mapping, as a PersistentMemory"""
+    return M if isinstance(M, PersistentMemory) else PersistentMemory(M)
+
+class Layout(object):
+    """The variables of a memory stored as a vector, in the order of
+    their slots. Layouts are only ever extended, so that a vector over a
+    prefix of a layout's variables is also a vector over the whole
+    layout, with BOT for the variables after the prefix."""
+    __slots__ = ('names', 'index', '_extended')
+
+    def __init__(self, names: Tuple[str, ...] = ()):
+        self.names = names
+        self.index = dict([(x, i) for i, x in enumerate(names)])
+        self._extended: Dict[str, 'Layout'] = {}
+
+    def extend(self, name: str) -> 'Layout':
+        out = self._extended.get(name)
+        if out is None:
+            out = self._extended[name] = Layout(self.names + (name,))
+
+        return out
+
+    def covers(self, other: 'Layout') -> bool:
+        """Returns True if other's variables are a prefix of these"""
+        return other is self or self.names[:len(other.names)] == other.names
+
+    def union(self, other: 'Layout') -> 'Layout':
+        """Returns a layout with the variables of both, which covers self"""
+        if self.covers(other): return self
+
+        out = self
+        for x in other.names:
+            if x not in out.index: out = out.extend(x)
+
+        return out
+
+def layout_names(M, symbols = None) -> List[str]:
+    """Returns the variables of the memories M in the order of their
+    slots: those of symbols, a SymbolTable, first, then the others,
+    sorted"""
+    names = sorted(set([x for m in M for x in m]))
+    if symbols is None: return names
+
+    return list(symbols.names) + [x for x in names if x not in symbols]
+
+def test_PersistentMemory():
+    m = PersistentMemory({'x': 1, 'y': 2})
+    m2 = m.set('x', 3)
+
+    assert m['x'] == 1 and m2['x'] == 3 and m2['y'] == 2
+    assert m.set('x', 1) is m
+    assert m == {'x': 1, 'y': 2} and m2 != m
+    assert m2.set('x', 1) == m and hash(m2.set('x', 1)) == hash(m)
+    assert sorted(m2.diff(m)) == ['x']
+    assert sorted(m.diff(PersistentMemory({'x': 1, 'z': 0}))) == ['y', 'z']
+    assert m.combine(m2, max) == {'x': 3, 'y': 2}
+    assert 'z' not in m and m.get('z') is None
+
+    try:
+        m['z']
+        assert False, "Expected KeyError"
+    except KeyError:
+        pass
+
+    assert BOTTOM != PersistentMemory() and BOTTOM == BOTTOM and len(BOTTOM) == 0
+
+    import pickle
+    assert pickle.loads(pickle.dumps(BOTTOM)) is BOTTOM
+    assert pickle.loads(pickle.dumps(m2)) == m2
+
+def test_PersistentMemory_large():
+    import random
+
+    n = 5000
+    d = dict([(f"x{i}", i) for i in range(n)])
+    m = PersistentMemory(d)
+    assert len(m) == n and m == d and sorted(m) == sorted(d)
+
+    r = random.Random(0)
+    for _ in range(1000):
+        k = f"x{r.randrange(n + 100)}"
+        v = r.randrange(10)
+        d[k] = v
+        m = m.set(k, v)
+
+    assert m == d and len(m) == len(d)
+    assert m == PersistentMemory(d) and hash(m) == hash(PersistentMemory(reversed(list(d.items()))))
+
+def test_collisions():
+    class K(str):
+        def __hash__(self):
+            return 42
+
+    # enough variables for a trie
+    m = PersistentMemory([(f"x{i}", i) for i in range(SMALL)])
+
+    a, b, c = K('a'), K('b'), K('c')
+    m = m.set(a, 1).set(b, 2).set(c, 3)
+    assert m._root is not None
+    assert m[a] == 1 and m[b] == 2 and m[c] == 3 and len(m) == SMALL + 3
+    assert m.set(b, 5)[b] == 5 and m.set(b, 5).diff(m) == [b]
+
+if __name__ == "__main__":
+    test_PersistentMemory()
+    test_PersistentMemory_large()
+    test_collisions()
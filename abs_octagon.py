@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+#
+# abs_octagon.py
+#
+# The octagon abstraction of memories, a relational abstraction that
+# keeps constraints of the form +-x +-y <= c between pairs of
+# variables. It requires NumPy.
+#
+# An octagon over n variables is a difference-bound matrix (DBM) m of
+# 2n x 2n float64 bounds, following Miné, "The Octagon Abstract
+# Domain" (2006). Variable i has the two forms V[2i] = x_i and
+# V[2i + 1] = -x_i, and m[i, j] is an upper bound of V[j] - V[i], with
+# inf for no bound. So m[2i + 1, 2i] bounds 2x_i from above and
+# m[2i, 2i + 1] bounds -2x_i. Values are integers, kept exactly in
+# floats up to 2**53.
+#
+# Most operations need the tight closure of m, its canonical form,
+# which is a Floyd-Warshall shortest-path closure vectorised over
+# each pivot, followed by tightening (for integers) and strengthening
+# (Bagnara, Hill and Zaffanella, 2009). Assignments and guards only
+# change the constraints on one variable, so they restore the closure
+# with the two Floyd-Warshall passes over that variable's forms, in
+# O(n^2) rather than O(n^3).
+#
+# OctagonAbstraction can be passed to sem_abs.evaluate_Cmd_abs in
+# place of a NonRelationalAbstraction.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to abs_octagon.py. This
+# work is published from: United States.
+
+from typing import Dict, List, Optional, Tuple
+from collections.abc import Mapping
+from tinyast import *
+from abs_memory import BOTTOM
+from dom_intervals import IntervalsDomain, Interval, PINF, NINF, make
+import dom_intervals
+import abs_trace
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INF = np.inf
+
+# set to False to close the whole matrix after every assignment and
+# guard, for comparison
+incremental = True
+
+# phi() works on chunks of memories of at most this many bounds
+_PHI_CELLS = 1 << 20
+
+def _top(n: int) -> np.ndarray:
+    m = np.full((2 * n, 2 * n), INF)
+    np.fill_diagonal(m, 0.0)
+    return m
+
+def _floyd_warshall(m: np.ndarray, pivots) -> None:
+    for k in pivots:
+        np.minimum(m, m[:, k, None] + m[None, k, :], out = m)
+
+def _tighten_strengthen(m: np.ndarray) -> bool:
+    """Tightens and strengthens m, which must be closed, in place.
+    Returns False if m is empty."""
+    if len(m) == 0: return True
+    if np.any(np.diagonal(m) < 0): return False
+
+    idx = np.arange(len(m))
+    bar = idx ^ 1
+
+    # m[i, bar i] bounds an even multiple of a variable
+    u = 2 * np.floor(m[idx, bar] / 2)
+    if np.any(u + u[bar] < 0): return False
+    m[idx, bar] = u
+
+    np.minimum(m, (u[:, None] + u[bar][None, :]) / 2, out = m)
+    np.fill_diagonal(m, 0.0)
+    return True
+
+def _sum_bounds(m: np.ndarray, i: int, j: int) -> Tuple[float, float]:
+    # lower and upper bounds of V[i] + V[j] = V[i] - V[bar j]
+    return -m[j, i ^ 1], m[j ^ 1, i]
+
+def _interval(lo, hi) -> Interval:
+    return make(NINF if lo == -INF else int(lo), PINF if hi == INF else int(hi))
+
+def close(m: np.ndarray) -> bool:
+    """Replaces m by its tight closure, returns False if m is empty"""
+    _floyd_warshall(m, range(len(m)))
+    return _tighten_strengthen(m)
+
+def close_incremental(m: np.ndarray, v: int) -> bool:
+    """Replaces m by its tight closure, assuming m was closed before
+    the constraints on variable v changed. Returns False if m is empty.
+
+    A shortest path that uses a changed constraint splits at 2v and
+    2v + 1 into paths that only go through other forms, which are
+    closed. Relaxing the rows and columns of 2v and 2v + 1 finds those,
+    and the two Floyd-Warshall passes join them."""
+    if not incremental: return close(m)
+
+    for p in (2 * v, 2 * v + 1):
+        m[p, :] = np.min(m[p, :, None] + m, axis = 0)
+
+    for p in (2 * v, 2 * v + 1):
+        m[:, p] = np.min(m + m[None, :, p], axis = 1)
+
+    _floyd_warshall(m, (2 * v, 2 * v + 1))
+    return _tighten_strengthen(m)
+
+class Octagon(Mapping):
+    """An immutable octagon over the variables in names, which are
+    sorted.
+
+    As a mapping, it maps each variable to its bounds, as an Interval,
+    so that it can be used where a memory of intervals is expected.
+    Octagons are equal if their tight closures are. Empty octagons are
+    represented by abs_memory.BOTTOM, like empty memories.
+
+    The closure of m is computed when it is first needed. Widening
+    returns octagons that are not closed, since closing them could stop
+    widening from terminating.
+    """
+    __slots__ = ('names', 'index', '_m', '_closed', '_hash')
+
+    def __init__(self, names: Tuple[str, ...], m: np.ndarray, closed: bool = False):
+        self.names = names
+        self.index = dict([(x, i) for i, x in enumerate(names)])
+        m.flags.writeable = False
+        self._m = m
+        self._closed = m if closed else None
+        self._hash = None
+
+    @property
+    def matrix(self) -> Optional[np.ndarray]:
+        """The closed matrix, None if this octagon is empty"""
+        if self._closed is None:
+            m = self._m.copy()
+            if close(m):
+                m.flags.writeable = False
+                self._closed = m
+            else:
+                self._closed = False
+
+        return self._closed if self._closed is not False else None
+
+    def _closed_or_bottom(self) -> 'Octagon':
+        m = self.matrix
+        if m is None: return BOTTOM
+        return self if self._m is m else Octagon(self.names, m, True)
+
+    def __getitem__(self, x) -> Interval:
+        i = self.index[x]
+        m = self.matrix
+        if m is None: return dom_intervals.BOT
+
+        # bounds of 2x, which are even
+        lo, hi = _sum_bounds(m, 2 * i, 2 * i)
+        return _interval(lo / 2, hi / 2)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def difference(self, x: str, y: str) -> Interval:
+        """Returns the bounds of x - y"""
+        i, j = self.index[x], self.index[y]
+        m = self.matrix
+        if m is None: return dom_intervals.BOT
+
+        return _interval(*_sum_bounds(m, 2 * i, 2 * j + 1))
+
+    def extend(self, names: Tuple[str, ...]) -> 'Octagon':
+        """Returns this octagon over names, a sorted superset of its
+        names, leaving the new variables unconstrained"""
+        if names == self.names: return self
+
+        m = self.matrix
+        if m is None: return BOTTOM
+
+        pos = np.array([names.index(x) for x in self.names], dtype = np.intp)
+        rows = np.empty(2 * len(pos), dtype = np.intp)
+        rows[0::2] = 2 * pos
+        rows[1::2] = 2 * pos + 1
+
+        out = _top(len(names))
+        out[np.ix_(rows, rows)] = m
+        return Octagon(names, out, True)
+
+    def set(self, x: str, value: Interval) -> 'Octagon':
+        """Returns this octagon with x forgotten and then bounded by
+        value, which is how sem_abs assigns TOP to a variable"""
+        if value is dom_intervals.BOT: return BOTTOM
+
+        o = self if x in self.index else self.extend(tuple(sorted(self.names + (x,))))
+        if o is BOTTOM: return o
+
+        m = o._forget(o.index[x])
+        if m is None: return BOTTOM
+        return o._bound(m, o.index[x], value.lo, value.hi)
+
+    def _forget(self, i: int) -> Optional[np.ndarray]:
+        m = self.matrix
+        if m is None: return None
+
+        m = m.copy()
+        m[2 * i:2 * i + 2, :] = INF
+        m[:, 2 * i:2 * i + 2] = INF
+        m[2 * i, 2 * i] = m[2 * i + 1, 2 * i + 1] = 0.0
+        return m
+
+    def _bound(self, m: np.ndarray, i: int, lo, hi) -> 'Octagon':
+        # m, which is closed and this octagon's to change, with
+        # lo <= x_i <= hi
+        if hi != PINF: m[2 * i + 1, 2 * i] = min(m[2 * i + 1, 2 * i], 2 * hi)
+        if lo != NINF: m[2 * i, 2 * i + 1] = min(m[2 * i, 2 * i + 1], -2 * lo)
+        if not close_incremental(m, i): return BOTTOM
+        return Octagon(self.names, m, True)
+
+    def diff(self, other: 'Octagon') -> List[str]:
+        """Returns the variables whose constraints differ between this
+        octagon and other, where a variable only one of them has is
+        unconstrained in the other"""
+        names = _union_names(self, other)
+        a, b = self.extend(names).matrix, other.extend(names).matrix
+        rows = np.any(a != b, axis = 1)
+        return [x for i, x in enumerate(names) if rows[2 * i] or rows[2 * i + 1]]
+
+    def __eq__(self, other):
+        if self is other: return True
+        if not isinstance(other, Octagon): return NotImplemented
+        if self.names != other.names: return False
+
+        a, b = self.matrix, other.matrix
+        if a is None or b is None: return a is b
+        return bool(np.array_equal(a, b))
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        if self._hash is None:
+            m = self.matrix
+            # + 0.0 turns -0.0, which compares equal to 0.0, into 0.0
+            self._hash = hash((self.names, None if m is None else (m + 0.0).tobytes()))
+
+        return self._hash
+
+    def __repr__(self):
+        m = self.matrix
+        if m is None: return "BOTTOM"
+
+        dom = IntervalsDomain()
+        out = [f"{x}: {self[x]}" for x in self.names]
+        for i, x in enumerate(self.names):
+            for j in range(i + 1, len(self.names)):
+                y = self.names[j]
+                for op, s in [('-', 2 * j + 1), ('+', 2 * j)]:
+                    # only the relations that the bounds of x and y don't imply
+                    b = _interval(*_sum_bounds(m, 2 * i, s))
+                    if b != dom.f_binop(op, self[x], self[y]): out.append(f"{x} {op} {y}: {b}")
+
+        return "{" + ", ".join(out) + "}"
+
+def _union_names(a: Octagon, b: Octagon) -> Tuple[str, ...]:
+    if a.names == b.names: return a.names
+    return tuple(sorted(set(a.names) | set(b.names)))
+
+def _align(a: Octagon, b: Octagon) -> Tuple[Octagon, Octagon]:
+    names = _union_names(a, b)
+    return a.extend(names), b.extend(names)
+
+def _linear(E: Expr) -> Optional[Tuple[Dict[str, int], int]]:
+    """Returns E as coefficients of variables and a constant, None if it
+    is not linear"""
+    if isinstance(E, Var):
+        return {E.name: 1}, 0
+    elif isinstance(E, BinOp) and E.op in ('+', '-'):
+        left, right = _linear(E.left), _linear(E.right)
+        if left is None or right is None: return None
+
+        s = 1 if E.op == '+' else -1
+        coefs = dict(left[0])
+        for x, a in right[0].items():
+            coefs[x] = coefs.get(x, 0) + s * a
+
+        return dict([(x, a) for x, a in coefs.items() if a != 0]), left[1] + s * right[1]
+    elif isinstance(E, Scalar):
+        return {}, E
+    else:
+        return None
+
+class OctagonAbstraction(object):
+    """Abstracts sets of memories as octagons.
+
+    The interpreter calls assign() and filter() instead of evaluating
+    assignments and conditions on values, since relational = True.
+    Assignments of the forms x := c, x := +-y + c and x := +-x + c are
+    exact. Other linear expressions are evaluated with the bounds the
+    octagon implies, and non-linear ones as intervals, in dom.
+
+    strategy, cache and profiler are as for NonRelationalAbstraction.
+    """
+    relational = True
+
+    def __init__(self, strategy = None, cache = None, profiler = None):
+        # the domain of the bounds of variables, abs_iter checks it for
+        # finite_height and TOP
+        self.dom = IntervalsDomain()
+        self.strategy = strategy
+        self.cache = cache
+        self.profiler = profiler
+
+    def phi(self, M):
+        """Returns the smallest octagon that contains the memories M"""
+        if len(M) == 0: return BOTTOM
+
+        names = tuple(sorted(set([x for m in M for x in m])))
+        n = len(names)
+
+        # NaN for variables a memory does not have, which fmax skips
+        W = np.full((len(M), 2 * n), np.nan)
+        for k, m in enumerate(M):
+            for i, x in enumerate(names):
+                if x in m:
+                    W[k, 2 * i] = m[x]
+                    W[k, 2 * i + 1] = -m[x]
+
+        out = np.full((2 * n, 2 * n), -INF)
+        chunk = max(1, _PHI_CELLS // max(1, 4 * n * n))
+        for s in range(0, len(M), chunk):
+            w = W[s:s + chunk]
+            np.fmax(out, np.fmax.reduce(w[:, None, :] - w[:, :, None], axis = 0), out = out)
+
+        out[np.isnan(out) | (out == -INF)] = INF
+        np.fill_diagonal(out, 0.0)
+        return Octagon(names, out)._closed_or_bottom()
+
+    def lte(self, O0, O1):
+        if O0 is BOTTOM: return True
+        if O1 is BOTTOM: return False
+
+        O0, O1 = _align(O0, O1)
+        m0 = O0.matrix
+        return m0 is None or bool(np.all(m0 <= O1._m))
+
+    def union(self, O0, O1):
+        if O0 is BOTTOM: return O1
+        if O1 is BOTTOM: return O0
+
+        a, b = _align(O0, O1)
+        m0, m1 = a.matrix, b.matrix
+        if m0 is None: return b
+        if m1 is None: return a
+
+        # the join of closed octagons is closed
+        out = Octagon(a.names, np.maximum(m0, m1), True)
+        if abs_trace.enabled: abs_trace.emit('join', left = O0, right = O1, result = out)
+        return out
+
+    def widen(self, O0, O1):
+        if O0 is BOTTOM: return O1
+        if O1 is BOTTOM: return O0
+
+        a, b = _align(O0, O1)
+        m1 = b.matrix
+        if m1 is None: return a
+
+        # bounds of a that grew go to inf. a is not closed first, and
+        # the result is left unclosed, so that this terminates
+        out = Octagon(a.names, np.where(m1 <= a._m, a._m, INF))
+        if abs_trace.enabled: abs_trace.emit('widen', left = O0, right = O1, result = out)
+        return out
+
+    def narrow(self, O0, O1):
+        if O0 is BOTTOM or O1 is BOTTOM: return BOTTOM
+
+        a, b = _align(O0, O1)
+        m0, m1 = a.matrix, b.matrix
+        if m0 is None or m1 is None: return BOTTOM
+
+        # only infinite bounds improve, so this terminates too
+        return Octagon(a.names, np.where(m0 == INF, m1, m0))._closed_or_bottom()
+
+    def included(self, M_conc, O):
+        return self.lte(self.phi(M_conc), O)
+
+    def _bounds(self, O: Octagon, coefs: Dict[str, int], c: int) -> Interval:
+        # the bounds of c + the sum of the a * V[i]
+        m = O.matrix
+        signed = [(2 * O.index[x] + (0 if a > 0 else 1), abs(a)) for x, a in coefs.items()]
+
+        if len(signed) == 2 and signed[0][1] == signed[1][1] == 1:
+            # a constraint of the octagon
+            lo, hi = _sum_bounds(m, signed[0][0], signed[1][0])
+        else:
+            lo = hi = 0.0
+            for i, a in signed:
+                l, h = _sum_bounds(m, i, i)
+                lo, hi = lo + a * l / 2, hi + a * h / 2
+
+        return _interval(c + lo, c + hi)
+
+    def assign(self, O, x: str, E: Expr):
+        """Returns O after x := E"""
+        if O is BOTTOM: return O
+
+        names = set([x] + [v.name for v in _variables(E)])
+        if not names <= O.index.keys(): O = O.extend(tuple(sorted(names | set(O.names))))
+        O = O._closed_or_bottom()
+        if O is BOTTOM: return O
+
+        lin = _linear(E)
+        if lin is None:
+            return O.set(x, _evaluate_Expr(E, O, self.dom))
+
+        coefs, c = lin
+        i = O.index[x]
+
+        if len(coefs) == 0:
+            return O.set(x, make(c, c))
+        elif coefs.keys() == {x} and abs(coefs[x]) == 1:
+            # translates the constraints on x, which keeps m closed
+            m = O.matrix.copy()
+            if coefs[x] == -1:
+                m[[2 * i, 2 * i + 1], :] = m[[2 * i + 1, 2 * i], :]
+                m[:, [2 * i, 2 * i + 1]] = m[:, [2 * i + 1, 2 * i]]
+
+            m[:, 2 * i] += c
+            m[2 * i, :] -= c
+            m[:, 2 * i + 1] -= c
+            m[2 * i + 1, :] += c
+            return Octagon(O.names, m, True)
+        elif len(coefs) == 1 and x not in coefs and abs(list(coefs.values())[0]) == 1:
+            (y, a), = coefs.items()
+            j = 2 * O.index[y] + (0 if a > 0 else 1)
+
+            m = O._forget(i)
+            # x - a y <= c and a y - x <= -c
+            m[j, 2 * i] = m[2 * i + 1, j ^ 1] = c
+            m[2 * i, j] = m[j ^ 1, 2 * i + 1] = -c
+            if not close_incremental(m, i): return BOTTOM
+            return Octagon(O.names, m, True)
+        else:
+            return O.set(x, self._bounds(O, coefs, c))
+
+    def filter(self, B: BoolExpr, O) -> Tuple[Octagon, Octagon]:
+        """Returns O where B is true and where it is false"""
+        if O is BOTTOM: return BOTTOM, BOTTOM
+
+        x, c = B.left.name, B.right
+        if x not in O.index: O = O.extend(tuple(sorted(O.names + (x,))))
+
+        # integers, so x < c is x <= c - 1
+        if B.op == '<':
+            t, f = (NINF, c - 1), (c, PINF)
+        elif B.op == '<=':
+            t, f = (NINF, c), (c + 1, PINF)
+        elif B.op == '>':
+            t, f = (c + 1, PINF), (NINF, c)
+        elif B.op == '>=':
+            t, f = (c, PINF), (NINF, c - 1)
+        else:
+            raise NotImplementedError(f'Operator {B.op}')
+
+        O = O._closed_or_bottom()
+        if O is BOTTOM: return BOTTOM, BOTTOM
+
+        i = O.index[x]
+        O_true = O._bound(O.matrix.copy(), i, *t)
+        O_false = O._bound(O.matrix.copy(), i, *f)
+
+        if abs_trace.enabled: abs_trace.emit('filter', cond = B, input = O, true = O_true, false = O_false)
+        return O_true, O_false
+
+def _variables(E: Expr) -> List[Var]:
+    if isinstance(E, Var): return [E]
+    if isinstance(E, BinOp): return _variables(E.left) + _variables(E.right)
+    return []
+
+def _evaluate_Expr(E: Expr, O: Octagon, dom):
+    if isinstance(E, Scalar):
+        return dom.phi(E)
+    elif isinstance(E, Var):
+        return O[E.name]
+    elif isinstance(E, BinOp):
+        return dom.f_binop(E.op, _evaluate_Expr(E.left, O, dom), _evaluate_Expr(E.right, O, dom))
+
+def test_closure():
+    # x - y <= 1, y - z <= 2, z <= 0 imply x <= 3 and x - z <= 3
+    oa = OctagonAbstraction()
+    O = oa.phi([{'x': 0, 'y': 0, 'z': 0}])
+    assert O['x'] == make(0, 0) and O.difference('x', 'y') == make(0, 0)
+
+    m = _top(3)
+    m[2, 0] = m[1, 3] = 1 # x - y <= 1
+    m[4, 2] = m[3, 5] = 2 # y - z <= 2
+    m[5, 4] = 0 # 2z <= 0
+    O = Octagon(('x', 'y', 'z'), m)
+    assert O['x'] == make(NINF, 3) and O['z'] == make(NINF, 0) and O.difference('x', 'z') == make(NINF, 3)
+    assert O.difference('z', 'x') == make(-3, PINF) and O['y'] == make(NINF, 2)
+
+    # tightening: 2x <= 1 is x <= 0 for integers
+    m = _top(1)
+    m[1, 0] = 1
+    assert Octagon(('x',), m)['x'] == make(NINF, 0)
+
+    # x + y <= 1 and x - y <= -2 imply x <= -1, so with x >= 0 they
+    # are empty
+    m = _top(2)
+    m[3, 0] = m[1, 2] = 1 # x + y <= 1
+    m[2, 0] = m[1, 3] = -2 # x - y <= -2
+    assert Octagon(('x', 'y'), m.copy())['x'] == make(NINF, -1)
+    m[0, 1] = 0 # -2x <= 0
+    assert Octagon(('x', 'y'), m)._closed_or_bottom() is BOTTOM
+
+    # x = 1/2 is only empty for integers
+    m = _top(1)
+    m[1, 0], m[0, 1] = 1, -1
+    assert Octagon(('x',), m)._closed_or_bottom() is BOTTOM
+
+    # incremental closure agrees with full closure
+    import random
+    rng = random.Random(0)
+    global incremental
+    for _ in range(50):
+        M = [dict([(x, rng.randint(-20, 20)) for x in 'abcde']) for _ in range(3)]
+        O = oa.phi(M)
+        for x, op, c in [(rng.choice('abcde'), rng.choice(['<', '>', '<=', '>=']), rng.randint(-20, 20)) for _ in range(3)]:
+            B = BoolExpr(op, Var(x), c)
+            incremental = True
+            t, f = oa.filter(B, O)
+            incremental = False
+            t_full, f_full = oa.filter(B, O)
+            incremental = True
+            assert t == t_full and f == f_full
+            O = t if t is not BOTTOM else f
+
+        for x, E in [('a', BinOp('+', Var('b'), 3)), ('c', BinOp('-', 2, Var('a'))), ('d', Var('d')),
+                     ('e', BinOp('-', 5, Var('e'))), ('b', BinOp('+', Var('c'), Var('d')))]:
+            out = oa.assign(O, x, E)
+            incremental = False
+            assert oa.assign(O, x, E) == out, (x, E)
+            incremental = True
+            O = out
+
+def test_OctagonAbstraction():
+    oa = OctagonAbstraction()
+    M = [{'x': 1, 'y': 2, 'z': 9}, {'x': 5, 'y': 4, 'z': -3}, {'x': 3, 'y': 3, 'z': 0}]
+    O = oa.phi(M)
+    print(O)
+
+    assert O['x'] == make(1, 5) and O['y'] == make(2, 4) and O.difference('x', 'y') == make(-1, 1)
+    assert oa.included(M, O) and oa.included([], O) and not oa.included([{'x': 5, 'y': 2, 'z': 0}], O)
+    assert oa.lte(BOTTOM, O) and not oa.lte(O, BOTTOM) and oa.union(BOTTOM, O) is O
+    assert hash(O) == hash(oa.phi(list(reversed(M)))) and O == oa.phi(list(reversed(M)))
+
+    # variables are aligned, missing ones are unconstrained
+    O2 = oa.phi([{'x': 0, 'w': 1}])
+    J = oa.union(O, O2)
+    assert J.names == ('w', 'x', 'y', 'z') and J['x'] == make(0, 5) and J['w'] == dom_intervals.TOP
+    assert oa.lte(O, J) and oa.lte(O2, J) and not oa.lte(J, O)
+    assert O.diff(J) == ['x', 'y', 'z'] and O.diff(O) == [] # w is unconstrained in both
+
+    # assignments
+    x, y, z = Var('x'), Var('y'), Var('z')
+    for E, expected in [(BinOp('+', y, 3), make(5, 7)),
+                        (BinOp('-', 4, y), make(0, 2)),
+                        (BinOp('+', x, 1), make(2, 6)),
+                        (BinOp('-', 0, x), make(-5, -1)),
+                        (BinOp('+', x, y), make(3, 9)),
+                        (BinOp('-', x, y), make(-1, 1)),
+                        (BinOp('+', BinOp('+', x, y), z), make(0, 18)),
+                        (7, make(7, 7))]:
+        out = oa.assign(O, 'x', E)
+        assert out['x'] == expected, (E, out['x'])
+        assert oa.included([dict(m, x = _concrete(E, m)) for m in M], out), E
+
+    # x := y + 3 keeps x - y == 3, so x < 6 bounds y
+    O3 = oa.assign(O, 'x', BinOp('+', y, 3))
+    t, f = oa.filter(BoolExpr('<', x, 6), O3)
+    assert t['y'] == make(2, 2) and f['y'] == make(3, 4) and t.difference('x', 'y') == make(3, 3)
+    assert oa.filter(BoolExpr('>', x, 100), O3)[0] is BOTTOM
+
+    # widening drops the bounds that grew, narrowing recovers some
+    W = oa.widen(O, oa.union(O, oa.assign(O, 'x', BinOp('+', x, 1))))
+    assert W['x'] == make(1, PINF) and W['y'] == O['y']
+    assert oa.narrow(W, O)['x'] == O['x']
+
+def _concrete(E, m):
+    import sem
+    return sem.evaluate_Expr(E, m) if not isinstance(E, int) else E
+
+def test_octagon_programs():
+    import sem
+    import proggen
+    from sem_abs import evaluate_Cmd_abs, IterationStrategy
+    from sem_compile import program_variables
+    import abstractions
+
+    x, y = Var('x'), Var('y')
+    p = Program(sequence([Assign(x, 0),
+                          Assign(y, 0),
+                          While(BoolExpr('<', x, 10),
+                                sequence([Assign(x, BinOp('+', x, 1)),
+                                          Assign(y, BinOp('+', y, 1))]))]))
+    M_in = [{'x': 3, 'y': 4}]
+    M_out = sem.evaluate_Cmd(p, M_in)
+
+    strategy = IterationStrategy(narrowing = 1)
+    oa = OctagonAbstraction(strategy)
+    out = evaluate_Cmd_abs(p, oa.phi(M_in), oa)
+    print(out)
+    assert oa.included(M_out, out)
+    assert out['x'] == make(10, 10) and out['y'] == make(10, 10), out
+
+    # intervals lose y
+    nra = abstractions.NonRelationalAbstraction(abstractions.IntervalsDomain(), strategy)
+    assert evaluate_Cmd_abs(p, nra.phi(M_in), nra)['y'].hi == PINF
+
+    # without narrowing, the relation still holds
+    out = evaluate_Cmd_abs(p, oa.phi(M_in), OctagonAbstraction())
+    assert out['x'] == make(10, PINF) and out.difference('x', 'y') == make(0, 0)
+
+    programs = [flatten_blocks(proggen.straight_line(30)), proggen.nested_ifs(10), proggen.nested_loops(2, 4)[0],
+                Program(sequence([Input(x), Assign(y, x), While(BoolExpr('<', x, 5), Assign(x, BinOp('+', x, 1)))]))]
+    for q in programs:
+        M = proggen.memories(program_variables(q), 10, -10, 10)
+        out = evaluate_Cmd_abs(q, oa.phi(M), oa)
+        assert oa.included(sem.evaluate_Cmd(q, M), out), q
+
+if __name__ == "__main__":
+    test_closure()
+    test_OctagonAbstraction()
+    test_octagon_programs()
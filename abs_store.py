@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+#
+# abs_store.py
+#
+# A binary file of analysed programs and their abstract results, which
+# is memory-mapped when read, so that one result can be loaded without
+# reading the rest of the file.
+#
+# Layout (little-endian, version 1):
+#
+#   header   magic, version, entry count, names offset, index offset
+#   entries  for each entry, a program and/or a result:
+#              program  node count, ref count, node records, refs
+#              result   (variable id, flags, lo, hi) records
+#   names    every string (variable names and keys), by id
+#   index    for each entry, its key id, domain, flags, and the
+#            offsets and lengths of its program and result
+#
+# Programs are stored as the node table of batch.encode_program, with
+# one fixed-size record per node, so they load without recursion.
+# Abstract values are stored as intervals with flags for infinite
+# bounds and BOT; signs are stored as the intervals they stand for.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to abs_store.py. This work
+# is published from: United States.
+
+from typing import Dict, Iterator, List, Optional
+from tinyast import *
+from abs_memory import PersistentMemory, BOTTOM, as_memory
+from batch import encode_program, decode_program
+import dom_intervals
+from dom_signs import SignsDomain
+import mmap
+import struct
+
+MAGIC = b"TINYABS\0"
+VERSION = 1
+
+_HEADER = struct.Struct("<8sIIQQ")     # magic, version, count, names, index
+_INDEX = struct.Struct("<IBB2xQIQI")   # key, domain, flags, program offset and nodes, result offset and records
+_PROGRAM = struct.Struct("<II")        # nodes, refs
+_NODE = struct.Struct("<BB2xIIIq")     # tag, op, a, b, c, value
+_VALUE = struct.Struct("<IB3xqq")      # variable, flags, lo, hi
+_STRLEN = struct.Struct("<I")
+
+# entry flags
+HAS_PROGRAM = 1
+HAS_RESULT = 2
+RESULT_BOTTOM = 4
+
+# value flags
+NINF_LO = 1
+PINF_HI = 2
+VALUE_BOT = 4
+
+DOMAINS = ('intervals', 'signs')
+OPS = ('+', '-', '*', '/', '<', '>', '==', '<=', '>=', '!=')
+TAGS = 'nvbckslaifwp'
+
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+
+_SIGNS = SignsDomain()
+_SIGN_BOUNDS = {_SIGNS.LTZ: (dom_intervals.NINF, 0), _SIGNS.GTZ: (0, dom_intervals.PINF),
+                _SIGNS.EQZ: (0, 0), _SIGNS.TOP: (dom_intervals.NINF, dom_intervals.PINF)}
+_BOUNDS_SIGN = dict([(v, k) for k, v in _SIGN_BOUNDS.items()])
+
+class StoreError(ValueError):
+    pass
+
+def _int64(v: int) -> int:
+    if not INT64_MIN <= v <= INT64_MAX:
+        raise ValueError(f"{v} does not fit in 64 bits")
+
+    return v
+
+class StoreWriter(object):
+    """Writes entries, each a program, its abstract result, or both, to
+    a new file at path. Use as a context manager, or call close()."""
+    def __init__(self, path: str):
+        self.f = open(path, 'wb')
+        self.f.write(_HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        self.names: Dict[str, int] = {}
+        self.index: List[bytes] = []
+        self.keys: set = set()
+
+    def name(self, s: str) -> int:
+        i = self.names.get(s)
+        if i is None:
+            i = self.names[s] = len(self.names)
+
+        return i
+
+    def _program(self, C: Node) -> int:
+        enc = encode_program(C)
+
+        refs: List[int] = []
+        out = bytearray()
+        for e in enc:
+            tag = e[0]
+            a = b = c = op = 0
+            value = 0
+            if tag == 'n': value = _int64(e[1])
+            elif tag == 'v': a = self.name(e[1])
+            elif tag == 'b': op, a, b = OPS.index(e[1]), e[2], e[3]
+            elif tag == 'c': op, a, value = OPS.index(e[1]), e[2], _int64(e[3])
+            elif tag == 'l':
+                a, b = len(refs), len(e[1])
+                refs.extend(e[1])
+            elif tag == 'k': pass
+            else:
+                a, b, c = (tuple(e[1:]) + (0, 0))[:3]
+
+            out += _NODE.pack(TAGS.index(tag), op, a, b, c, value)
+
+        self.f.write(_PROGRAM.pack(len(enc), len(refs)))
+        self.f.write(out)
+        self.f.write(struct.pack(f"<{len(refs)}I", *refs))
+        return len(enc)
+
+    def _result(self, M_abs, domain: str) -> int:
+        out = bytearray()
+        for var, v in M_abs.items():
+            if domain == 'signs':
+                if v == _SIGNS.BOT:
+                    v = dom_intervals.BOT
+                else:
+                    v = _SIGN_BOUNDS[v]
+
+            lo, hi = v
+            if v == dom_intervals.BOT:
+                flags, lo, hi = VALUE_BOT, 0, 0
+            else:
+                flags = 0
+                if lo == dom_intervals.NINF: flags, lo = flags | NINF_LO, 0
+                if hi == dom_intervals.PINF: flags, hi = flags | PINF_HI, 0
+
+            out += _VALUE.pack(self.name(var), flags, _int64(lo), _int64(hi))
+
+        self.f.write(out)
+        return len(out) // _VALUE.size
+
+    def add(self, key: str, program: Optional[Node] = None, result = None, domain: str = 'intervals'):
+        """Adds program and/or result (an abstract memory, in domain)
+        under key"""
+        if key in self.keys: raise ValueError(f"Duplicate key {key}")
+        if domain not in DOMAINS: raise ValueError(f"Unknown domain {domain}, known: {', '.join(DOMAINS)}")
+
+        flags = 0
+        program_off = program_len = result_off = result_len = 0
+        if program is not None:
+            flags |= HAS_PROGRAM
+            program_off = self.f.tell()
+            program_len = self._program(program)
+
+        if result is not None:
+            flags |= HAS_RESULT
+            result_off = self.f.tell()
+            if result is BOTTOM:
+                flags |= RESULT_BOTTOM
+            else:
+                result_len = self._result(as_memory(result), domain)
+
+        self.keys.add(key)
+        self.index.append(_INDEX.pack(self.name(key), DOMAINS.index(domain), flags,
+                                      program_off, program_len, result_off, result_len))
+
+    def close(self):
+        if self.f.closed: return
+
+        names_off = self.f.tell()
+        self.f.write(_STRLEN.pack(len(self.names)))
+        for s in self.names: # in id order
+            b = s.encode('utf-8')
+            self.f.write(_STRLEN.pack(len(b)))
+            self.f.write(b)
+
+        index_off = self.f.tell()
+        self.f.write(b"".join(self.index))
+
+        self.f.seek(0)
+        self.f.write(_HEADER.pack(MAGIC, VERSION, len(self.index), names_off, index_off))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class Store(object):
+    """A file written by StoreWriter, memory-mapped. Only the header,
+    names and index are read when it is opened; programs and results
+    are decoded when asked for."""
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            try:
+                self.buf = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            except ValueError: # empty
+                raise StoreError(f"{path}: not a store file")
+
+        try:
+            self._read_index()
+        except struct.error as e:
+            self.close()
+            raise StoreError(f"{path}: truncated ({e})")
+        except StoreError as e:
+            self.close()
+            raise StoreError(f"{path}: {e}")
+
+    def _read_index(self):
+        buf = self.buf
+        magic, version, count, names_off, index_off = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC: raise StoreError("not a store file")
+        if version != VERSION: raise StoreError(f"version {version} is not supported, expected {VERSION}")
+
+        n, = _STRLEN.unpack_from(buf, names_off)
+        pos = names_off + _STRLEN.size
+        self.names: List[str] = []
+        for _ in range(n):
+            length, = _STRLEN.unpack_from(buf, pos)
+            pos += _STRLEN.size
+            if pos + length > len(buf): raise StoreError("truncated names")
+            self.names.append(buf[pos:pos + length].decode('utf-8'))
+            pos += length
+
+        self.entries: Dict[str, tuple] = {}
+        for i in range(count):
+            e = _INDEX.unpack_from(buf, index_off + i * _INDEX.size)
+            self.entries[self.names[e[0]]] = e[1:]
+
+    def close(self):
+        self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: str):
+        return key in self.entries
+
+    def keys(self) -> Iterator[str]:
+        return iter(self.entries)
+
+    def domain(self, key: str) -> str:
+        return DOMAINS[self.entries[key][0]]
+
+    def program(self, key: str) -> Optional[Node]:
+        """Returns the program stored under key, or None if it has none"""
+        _, flags, off, n, _, _ = self.entries[key]
+        if not flags & HAS_PROGRAM: return None
+
+        buf = self.buf
+        n, nrefs = _PROGRAM.unpack_from(buf, off)
+        nodes_off = off + _PROGRAM.size
+        refs = struct.unpack_from(f"<{nrefs}I", buf, nodes_off + n * _NODE.size)
+
+        enc: List[tuple] = []
+        for tag, op, a, b, c, value in _NODE.iter_unpack(buf[nodes_off:nodes_off + n * _NODE.size]):
+            t = TAGS[tag]
+            if t == 'n': enc.append(('n', value))
+            elif t == 'v': enc.append(('v', self.names[a]))
+            elif t == 'b': enc.append(('b', OPS[op], a, b))
+            elif t == 'c': enc.append(('c', OPS[op], a, value))
+            elif t == 'k': enc.append(('k',))
+            elif t == 'l': enc.append(('l', refs[a:a + b]))
+            elif t == 'f': enc.append(('f', a, b, c))
+            elif t in 'saw': enc.append((t, a, b))
+            else: enc.append((t, a))
+
+        return decode_program(tuple(enc))
+
+    def result(self, key: str) -> Optional[PersistentMemory]:
+        """Returns the abstract memory stored under key, or None if it
+        has none"""
+        domain, flags, _, _, off, n = self.entries[key]
+        if not flags & HAS_RESULT: return None
+        if flags & RESULT_BOTTOM: return BOTTOM
+
+        signs = DOMAINS[domain] == 'signs'
+        out = []
+        for var, vflags, lo, hi in _VALUE.iter_unpack(self.buf[off:off + n * _VALUE.size]):
+            if vflags & VALUE_BOT:
+                v = _SIGNS.BOT if signs else dom_intervals.BOT
+            else:
+                if vflags & NINF_LO: lo = dom_intervals.NINF
+                if vflags & PINF_HI: hi = dom_intervals.PINF
+                v = _BOUNDS_SIGN[(lo, hi)] if signs else dom_intervals.make(lo, hi)
+
+            out.append((self.names[var], v))
+
+        return PersistentMemory(out)
+
+def test_Store():
+    import os
+    import tempfile
+    import abstractions
+    from sem_abs import evaluate_Cmd_abs
+    from batch import _test_jobs, _domains
+
+    path = os.path.join(tempfile.mkdtemp(), "results.bin")
+
+    jobs = _test_jobs()
+    jobs.append((Program(Assign(Var('x'), BinOp('-', -5, Var('x')))), [{'x': -3}], 'intervals'))
+    expected = {}
+    with StoreWriter(path) as w:
+        for i, (p, M_in, d) in enumerate(jobs):
+            nra = abstractions.NonRelationalAbstraction(_domains()[d]())
+            q = flatten_blocks(p) if i % 2 else p
+            expected[f"job{i}"] = (q, evaluate_Cmd_abs(q, nra.phi(M_in), nra))
+            w.add(f"job{i}", q, expected[f"job{i}"][1], d)
+
+        w.add("bottom", result = BOTTOM)
+        w.add("unbounded", result = {'x': dom_intervals.TOP, 'y': dom_intervals.interval(3, dom_intervals.PINF),
+                                     'z': dom_intervals.BOT})
+        w.add("signs", result = {'x': _SIGNS.TOP, 'y': _SIGNS.LTZ, 'z': _SIGNS.BOT}, domain = 'signs')
+
+        try:
+            w.add("big", result = {'x': dom_intervals.make(0, 2**70)})
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+
+    with Store(path) as s:
+        assert len(s) == len(jobs) + 3
+        for k, (p, out) in expected.items():
+            assert str(s.program(k)) == str(p), (s.program(k), p)
+            assert s.result(k) == out, (s.result(k), out)
+
+        assert s.result("bottom") is BOTTOM and s.program("bottom") is None
+        assert s.result("unbounded") == {'x': dom_intervals.TOP, 'y': dom_intervals.interval(3, dom_intervals.PINF),
+                                         'z': dom_intervals.BOT}
+        assert s.result("unbounded")['z'] is dom_intervals.BOT
+        assert s.result("signs") == {'x': _SIGNS.TOP, 'y': _SIGNS.LTZ, 'z': _SIGNS.BOT}
+
+    # bad files are rejected
+    with open(path, 'r+b') as f:
+        f.seek(8)
+        f.write(struct.pack("<I", VERSION + 1))
+
+    for bad in [b"", b"NOTASTORE" * 4]:
+        with open(path + ".bad", 'wb') as f:
+            f.write(bad)
+
+        try:
+            Store(path + ".bad")
+            assert False, "Expected an error"
+        except StoreError:
+            pass
+
+    try:
+        Store(path)
+        assert False, "Expected StoreError"
+    except StoreError as e:
+        assert "version" in str(e)
+
+def test_Store_deep():
+    import os
+    import tempfile
+
+    # a program too deep to pickle
+    x = Var('x')
+    p = Program(Skip())
+    for i in range(20000):
+        p = Program(While(BoolExpr('<', x, i), Seq(p.program, Assign(x, BinOp('+', x, 1)))))
+
+    path = os.path.join(tempfile.mkdtemp(), "deep.bin")
+    with StoreWriter(path) as w:
+        w.add("deep", p)
+
+    with Store(path) as s:
+        q = s.program("deep")
+        assert encode_program(q) == encode_program(p)
+
+if __name__ == "__main__":
+    test_Store()
+    test_Store_deep()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+#
+# abs_trace.py
+#
+# Structured tracing of the abstract interpreter.
+#
+# While tracing is on, the interpreter emits events, as dicts, to a
+# sink. Every event has a seq number and a kind, and events inside a
+# loop also have the run number of the innermost abs_iter call. The
+# kinds, and their other fields, are:
+#
+#   loop_start  run, parent, entry       abs_iter starts iterating
+#   step        k, op, before, body, after
+#                                        one iteration, op is union or widen
+#   cutoff      k, variables, after      max_iterations was reached, the
+#                                        variables were set to TOP
+#   narrowing   step, before, body, after
+#   loop_end    invariant, iterations, converged
+#   join        left, right, result      NonRelationalAbstraction.union
+#   widen       left, right, result      NonRelationalAbstraction.widen
+#   filter      cond, input, true, false filter_memory_abs
+#
+# Memories are kept as they are (they are immutable), so an in-memory
+# sink costs little. JsonLinesSink writes them as JSON, and load_jsonl
+# reads them back. fixpoints() and replay() reconstruct, from a trace,
+# how every loop invariant was reached.
+#
+# When tracing is off, the interpreter only checks the enabled flag.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to abs_trace.py. This
+# work is published from: United States.
+
+from typing import Dict, Iterable, List
+from collections import deque
+from contextlib import contextmanager
+from abs_memory import PersistentMemory, BOTTOM
+import dom_intervals
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# check this before calling emit()
+enabled = False
+
+_sink = None
+_seq = 0
+_next_run = 0
+_runs: List[int] = []
+
+MEMORY_FIELDS = frozenset(['entry', 'before', 'body', 'after', 'invariant', 'left', 'right', 'result',
+                           'input', 'true', 'false'])
+
+class RingBuffer(object):
+    """Keeps the last capacity events in memory"""
+    def __init__(self, capacity = 100000):
+        self.buf: deque = deque(maxlen = capacity)
+
+    def write(self, event: dict):
+        self.buf.append(event)
+
+    def events(self) -> List[dict]:
+        return list(self.buf)
+
+    def close(self):
+        pass
+
+class JsonLinesSink(object):
+    """Writes events to a file, one JSON object per line"""
+    def __init__(self, path: str):
+        self.f = open(path, 'w')
+
+    def write(self, event: dict):
+        self.f.write(json.dumps(to_json(event)))
+        self.f.write("\n")
+
+    def close(self):
+        self.f.close()
+
+class LogSink(object):
+    """Writes events to a logger, as the debug logs used to"""
+    def __init__(self, log = logger, level = logging.DEBUG):
+        self.log = log
+        self.level = level
+
+    def write(self, event: dict):
+        fields = ", ".join([f"{k}: {v}" for k, v in event.items() if k not in ('seq', 'kind')])
+        self.log.log(self.level, f"{event['kind']}: {fields}")
+
+    def close(self):
+        pass
+
+def start(sink):
+    """Sends events to sink until stop()"""
+    global enabled, _sink, _seq, _next_run, _runs
+    _sink = sink
+    _seq = 0
+    _next_run = 0
+    _runs = []
+    enabled = True
+
+def stop():
+    """Stops tracing, and closes and returns the sink"""
+    global enabled, _sink
+    enabled = False
+    sink, _sink = _sink, None
+    if sink is not None: sink.close()
+    return sink
+
+@contextmanager
+def tracing(sink):
+    start(sink)
+    try:
+        yield sink
+    finally:
+        stop()
+
+def emit(kind: str, **event):
+    global _seq
+    _seq += 1
+    event['seq'] = _seq
+    event['kind'] = kind
+    if len(_runs) and 'run' not in event: event['run'] = _runs[-1]
+    _sink.write(event)
+
+def loop_start(entry) -> int:
+    global _next_run
+    run = _next_run
+    _next_run += 1
+    emit('loop_start', run = run, parent = _runs[-1] if len(_runs) else None, entry = entry)
+    _runs.append(run)
+    return run
+
+def loop_end(invariant, iterations: int, converged: bool):
+    emit('loop_end', invariant = invariant, iterations = iterations, converged = converged)
+    _runs.pop()
+
+def _value_to_json(v):
+    if v is dom_intervals.BOT: return "BOT"
+    if isinstance(v, dom_intervals.Interval):
+        return ["-inf" if v.lo == dom_intervals.NINF else v.lo, "+inf" if v.hi == dom_intervals.PINF else v.hi]
+
+    return v
+
+def _value_from_json(v, dom):
+    if v == "BOT": return dom.BOT
+    if isinstance(v, list):
+        return dom_intervals.make(dom_intervals.NINF if v[0] == "-inf" else v[0],
+                                  dom_intervals.PINF if v[1] == "+inf" else v[1])
+
+    return v
+
+def to_json(event: dict) -> dict:
+    """Returns event with memories as dicts and nodes as strings"""
+    out = {}
+    for k, v in event.items():
+        if k in MEMORY_FIELDS:
+            v = "BOTTOM" if v is BOTTOM else dict([(x, _value_to_json(a)) for x, a in v.items()])
+        elif k == 'cond':
+            v = str(v)
+
+        out[k] = v
+
+    return out
+
+def from_json(event: dict, dom) -> dict:
+    """The inverse of to_json, except for nodes, which stay strings"""
+    out = dict(event)
+    for k in MEMORY_FIELDS:
+        if k in out:
+            v = out[k]
+            out[k] = BOTTOM if v == "BOTTOM" else PersistentMemory([(x, _value_from_json(a, dom)) for x, a in v.items()])
+
+    return out
+
+def load_jsonl(path: str, dom) -> List[dict]:
+    """Reads the events that a JsonLinesSink wrote, with values in dom"""
+    with open(path) as f:
+        return [from_json(json.loads(l), dom) for l in f if l.strip()]
+
+def fixpoints(events: Iterable[dict]) -> Dict[int, dict]:
+    """Returns, for every abs_iter run in events, its entry, steps,
+    cutoffs, narrowing steps and invariant, in the order they happened"""
+    out: Dict[int, dict] = {}
+    for e in events:
+        kind = e['kind']
+        if kind == 'loop_start':
+            out[e['run']] = {'parent': e['parent'], 'entry': e['entry'], 'steps': [], 'narrowing': [],
+                             'cutoffs': [], 'invariant': None, 'converged': None}
+        elif kind in ('step', 'narrowing', 'cutoff', 'loop_end') and e.get('run') in out:
+            r = out[e['run']]
+            if kind == 'step': r['steps'].append(e)
+            elif kind == 'narrowing': r['narrowing'].append(e)
+            elif kind == 'cutoff': r['cutoffs'].append(e)
+            else:
+                r['invariant'] = e['invariant']
+                r['converged'] = e['converged']
+
+    return out
+
+def replay(events: Iterable[dict], abstraction) -> List[dict]:
+    """Recomputes every step of every loop in events from its before and
+    body memories, and returns the steps whose result differs from the
+    traced one"""
+    assert not enabled, "Stop tracing before replaying"
+
+    ops = {'union': abstraction.union, 'widen': abstraction.widen}
+    bad = []
+    for run in fixpoints(events).values():
+        for s in run['steps']:
+            # a step's after is from before any cutoff
+            if ops[s['op']](s['before'], s['body']) != s['after']: bad.append(s)
+
+        for s in run['narrowing']:
+            if abstraction.narrow(s['before'], s['body']) != s['after']: bad.append(s)
+
+    return bad
+
+def test_tracing():
+    import os
+    import tempfile
+    import abstractions
+    from tinyast import Var, BinOp, BoolExpr, Assign, While, IfThenElse, Program, sequence
+    from sem_abs import evaluate_Cmd_abs, IterationStrategy
+    import abs_trace as tr # the module sem_abs uses, even when this is __main__
+
+    x = Var('x')
+    y = Var('y')
+    p = Program(sequence([Assign(x, 0),
+                          Assign(y, 0),
+                          While(BoolExpr('<', x, 100),
+                                sequence([While(BoolExpr('<', y, 3), Assign(y, BinOp('+', y, 1))),
+                                          IfThenElse(BoolExpr('>', x, 50),
+                                                     Assign(x, BinOp('+', x, 2)),
+                                                     Assign(x, BinOp('+', x, 1)))]))]))
+
+    for dom, strategy in [(abstractions.IntervalsDomain([99, 100, 101]), IterationStrategy(delay = 2, narrowing = 2)),
+                          (abstractions.IntervalsDomain(), IterationStrategy(delay = 10)),
+                          (abstractions.SignsDomain(), None)]:
+        nra = abstractions.NonRelationalAbstraction(dom, strategy)
+        M_in = nra.phi([{'x': 0, 'y': 0}])
+        expected = evaluate_Cmd_abs(p, M_in, nra)
+
+        with tr.tracing(tr.RingBuffer()) as ring:
+            assert evaluate_Cmd_abs(p, M_in, nra) == expected
+
+        events = ring.events()
+        assert not tr.enabled and [e['seq'] for e in events] == list(range(1, len(events) + 1))
+        kinds = set([e['kind'] for e in events])
+        assert set(['loop_start', 'step', 'loop_end', 'join', 'filter']) <= kinds, kinds
+
+        # every loop's steps lead from its entry to its invariant
+        runs = fixpoints(events)
+        assert len(runs) > 1 and runs[0]['parent'] is None and runs[1]['parent'] == 0
+        for r in runs.values():
+            assert r['steps'][-1]['after'] == r['invariant'] or r['narrowing']
+
+        assert replay(events, nra) == []
+
+        # the same trace through a file
+        path = os.path.join(tempfile.mkdtemp(), "trace.jsonl")
+        with tr.tracing(tr.JsonLinesSink(path)):
+            evaluate_Cmd_abs(p, M_in, nra)
+
+        loaded = load_jsonl(path, dom)
+        assert len(loaded) == len(events) and replay(loaded, nra) == []
+        assert [r['invariant'] for r in fixpoints(loaded).values()] == [r['invariant'] for r in runs.values()]
+
+    # a replay notices a wrong step
+    events[-1 if events[-1]['kind'] == 'step' else [e['kind'] for e in events].index('step')]['after'] = BOTTOM
+    assert len(replay(events, nra)) == 1
+
+if __name__ == "__main__":
+    test_tracing()
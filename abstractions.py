@@ -13,57 +13,76 @@
 # work is published from: United States.
 
 from dom_intervals import IntervalsDomain, IntervalPoint
-from dom_signs import SignsDomain
+from dom_signs import SignsDomain, SignsVector
+from abs_memory import PersistentMemory, BOTTOM, Layout, as_memory, layout_names
+import abs_trace
 import logging
 
 logger = logging.getLogger(__name__)
 
 class NonRelationalAbstraction(object):
-    def __init__(self, domain):
+    def __init__(self, domain, strategy = None, cache = None, profiler = None):
         self.dom = domain
+        # how sem_abs.abs_iter iterates, None for its default
+        self.strategy = strategy
+        # a sem_abs.TransferCache, None to not cache
+        self.cache = cache
+        # a sem_abs.Profiler, None to not profile
+        self.profiler = profiler
 
     # construct an abstraction for a set of memories
     def phi(self, M):
         m_accum = {}
 
         for m in M:
-            m_abs = {}
             for x in m:
-                m_abs[x] = self.dom.phi(m[x])
+                v = self.dom.phi(m[x])
+                m_accum[x] = self.dom.lub(m_accum[x], v) if x in m_accum else v
 
-            if len(m_accum) == 0:
-                m_accum = m_abs
-            else:
-                m_accum = self.union(m_accum, m_abs)
-
-
-        # also construct BOT
+        # also construct BOT, which callers that pass plain dicts to the
+        # interpreter still compare with
         self.BOT = {}
         for x in m_accum:
             self.BOT[x] = self.dom.BOT
 
-        return m_accum
+        if len(M) == 0: return BOTTOM
+
+        return PersistentMemory(m_accum)
+
+    # these accept plain dicts too, but are cheapest on PersistentMemory
+    # values that share structure, since only differing variables are
+    # visited
 
     def lte(self, M0_abs, M1_abs):
-        for x in M0_abs:
-            if not self.dom.lte(M0_abs[x], M1_abs[x]): return False
+        if M0_abs is BOTTOM: return True
+        if M1_abs is BOTTOM: return False
+
+        M0_abs, M1_abs = as_memory(M0_abs), as_memory(M1_abs)
+        for _, v0, v1 in M0_abs.differences(M1_abs):
+            if v0 is not None and not self.dom.lte(v0, self.dom.BOT if v1 is None else v1): return False
 
         return True
 
     def union(self, m0, m1):
-        m = {}
-        for x in m0:
-            m[x] = self.dom.lub(m0[x], m1[x])
-            logger.debug(f"union: {m0[x]} U {m1[x]} = {m[x]}")
+        if m0 is BOTTOM: return m1
+        if m1 is BOTTOM: return m0
 
-        return m
+        out = as_memory(m0).combine(as_memory(m1), self.dom.lub)
+        if abs_trace.enabled: abs_trace.emit('join', left = m0, right = m1, result = out)
+        return out
 
     def widen(self, m0, m1):
-        m = {}
-        for x in m0:
-            m[x] = self.dom.widen(m0[x], m1[x])
+        if m0 is BOTTOM: return m1
+        if m1 is BOTTOM: return m0
+
+        out = as_memory(m0).combine(as_memory(m1), self.dom.widen)
+        if abs_trace.enabled: abs_trace.emit('widen', left = m0, right = m1, result = out)
+        return out
 
-        return m
+    def narrow(self, m0, m1):
+        if m0 is BOTTOM or m1 is BOTTOM: return BOTTOM
+
+        return as_memory(m0).combine(as_memory(m1), self.dom.narrow)
 
     # convenience function
     def included(self, M_conc, M_abs):
@@ -71,6 +90,59 @@ class NonRelationalAbstraction(object):
         return self.lte(M_c_abs, M_abs)
 
 
+class SignsVectorAbstraction(NonRelationalAbstraction):
+    """A NonRelationalAbstraction over SignsDomain whose memories are
+    SignsVectors, so that its operations on memories are a few big-int
+    operations however many variables there are. With a SymbolTable,
+    phi() lays vectors out by it, so a variable's sign is at its slot."""
+    def __init__(self, strategy = None, cache = None, profiler = None, symbols = None):
+        super().__init__(SignsDomain(), strategy, cache, profiler)
+        self.symbols = symbols
+        # one layout per set of variables, so that aligning vectors from
+        # different phi() calls is an identity check
+        self.layouts: dict = {}
+
+    def phi(self, M):
+        names = layout_names(M, self.symbols)
+        self.BOT = dict([(x, self.dom.BOT) for x in names])
+        if len(M) == 0: return BOTTOM
+
+        layout = self.layouts.get(tuple(names))
+        if layout is None:
+            layout = self.layouts[tuple(names)] = Layout(tuple(names))
+
+        out = 0
+        for m in M:
+            data = bytes([self.dom.phi(m[x]) if x in m else self.dom.BOT for x in names])
+            out |= int.from_bytes(data, 'little')
+
+        return SignsVector(layout, out.to_bytes(len(names), 'little'))
+
+    def _vector(self, M_abs) -> SignsVector:
+        return M_abs if isinstance(M_abs, SignsVector) else SignsVector.from_memory(M_abs)
+
+    def lte(self, M0_abs, M1_abs):
+        if M0_abs is BOTTOM: return True
+        if M1_abs is BOTTOM: return False
+
+        return self._vector(M0_abs).lte(self._vector(M1_abs))
+
+    def union(self, m0, m1):
+        if m0 is BOTTOM: return m1
+        if m1 is BOTTOM: return m0
+
+        out = self._vector(m0).lub(self._vector(m1))
+        if abs_trace.enabled: abs_trace.emit('join', left = m0, right = m1, result = out)
+        return out
+
+    # signs have finite height, so widening is a join
+    widen = union
+
+    def narrow(self, m0, m1):
+        if m0 is BOTTOM or m1 is BOTTOM: return BOTTOM
+
+        return self._vector(m0).meet(self._vector(m1))
+
 def test_NonRelationalAbstraction():
     nra = NonRelationalAbstraction(IntervalsDomain())
 
@@ -79,9 +151,48 @@ def test_NonRelationalAbstraction():
          {'x': 20, 'y': 0, 'z': -10},
          {'x': 35, 'y': 8, 'z': -9}]
 
-    print(nra.phi(M))
+    M_abs = nra.phi(M)
+    print(M_abs)
+
+    assert M_abs['x'] == nra.dom.lub(nra.dom.phi(20), nra.dom.phi(35))
+    assert nra.included(M, M_abs) and nra.included([], M_abs)
+    assert not nra.included([{'x': 0, 'y': 0, 'z': 0}], M_abs)
+    assert nra.union(BOTTOM, M_abs) is M_abs and nra.lte(BOTTOM, M_abs)
+
+    m = M_abs.set('y', nra.dom.TOP)
+    assert nra.union(M_abs, m) == m and nra.lte(M_abs, m) and not nra.lte(m, M_abs)
+
+
+def test_SignsVectorAbstraction():
+    from tinyast import Var, BinOp, BoolExpr, Assign, While, IfThenElse, Program, sequence, intern_variables
+    from sem_abs import evaluate_Cmd_abs
+    from sem import evaluate_Cmd
+
+    nra = NonRelationalAbstraction(SignsDomain())
+    sva = SignsVectorAbstraction()
+
+    M = [{'x': 25, 'y': 7, 'z': -12}, {'x': 0, 'y': -7, 'z': -11}]
+    M_abs = sva.phi(M)
+    assert M_abs == nra.phi(M) and sva.included(M, M_abs) and not sva.included([{'x': -1, 'y': 0, 'z': 0}], M_abs)
+    assert sva.union(BOTTOM, M_abs) is M_abs and sva.lte(BOTTOM, M_abs) and sva.phi([]) is BOTTOM
+
+    x, y = Var('x'), Var('y')
+    p = Program(sequence([Assign(y, 0),
+                          While(BoolExpr('<', x, 10),
+                                sequence([Assign(x, BinOp('+', x, 1)),
+                                          IfThenElse(BoolExpr('>', y, 3), Assign(y, BinOp('-', y, 1)), Assign(y, 1))]))]))
+    M = [{'x': 3, 'y': 4, 'z': 0}, {'x': -5, 'y': 0, 'z': 1}]
+    out = evaluate_Cmd_abs(p, sva.phi(M), sva)
+    assert isinstance(out, SignsVector) and out == evaluate_Cmd_abs(p, nra.phi(M), nra)
+    assert sva.included(evaluate_Cmd(p, M), out)
 
+    # laid out by the program's symbol table, variables are at their slots
+    svs = SignsVectorAbstraction(symbols = intern_variables(p))
+    M_abs = svs.phi([{'z': 1, 'x': -3}])
+    assert M_abs.layout.names == ('y', 'x', 'z') and M_abs.data[x.slot] == SignsDomain.LTZ and M_abs['y'] == SignsDomain.BOT
+    assert evaluate_Cmd_abs(p, svs.phi(M), svs) == out
 
 if __name__ == "__main__":
     test_NonRelationalAbstraction()
+    test_SignsVectorAbstraction()
 
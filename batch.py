@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+#
+# batch.py
+#
+# Runs the abstract interpreter on many independent programs, on a
+# pool of worker processes.
+#
+# A job is a (program, memory, domain name) tuple. The memory is either
+# a list of concrete memories, which the worker abstracts, or an
+# abstract memory. Programs are sent to workers as flat tuples (see
+# encode_program), which pickle much faster and smaller than the
+# objects of a deep AST, and without recursion.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to batch.py. This work is
+# published from: United States.
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from tinyast import *
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import os
+import signal
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _domains():
+    from dom_intervals import IntervalsDomain
+    from dom_signs import SignsDomain
+
+    return {'intervals': IntervalsDomain, 'signs': SignsDomain}
+
+def encode_program(C: Node) -> tuple:
+    """Returns C as a tuple of nodes, children first, where each node is
+    a tuple of a tag and its fields, with children replaced by their
+    index in the tuple. Shared nodes and equal Scalars are only encoded
+    once."""
+    out: List[tuple] = []
+    index: Dict[object, int] = {}
+
+    def key(n):
+        return ('n', n) if isinstance(n, Scalar) else id(n)
+
+    def ref(n):
+        return index[key(n)]
+
+    stack: List[Tuple[object, bool]] = [(C, False)]
+    while len(stack):
+        n, done = stack.pop()
+        if key(n) in index: continue
+
+        cs = children(n)
+        if not done and len(cs):
+            stack.append((n, True))
+            stack.extend([(c, False) for c in cs])
+            continue
+
+        t = type(n)
+        if isinstance(n, Scalar): enc = ('n', n)
+        elif t is Var: enc = ('v', n.name)
+        elif t is BinOp: enc = ('b', n.op, ref(n.left), ref(n.right))
+        elif t is BoolExpr: enc = ('c', n.op, ref(n.left), n.right)
+        elif t is Skip: enc = ('k',)
+        elif t is Seq: enc = ('s', ref(n.cmd0), ref(n.cmd1))
+        elif t is Block: enc = ('l', tuple([ref(c) for c in n.cmds]))
+        elif t is Assign: enc = ('a', ref(n.left), ref(n.right))
+        elif t is Input: enc = ('i', ref(n.var))
+        elif t is IfThenElse: enc = ('f', ref(n.cond), ref(n.then_), ref(n.else_))
+        elif t is While: enc = ('w', ref(n.cond), ref(n.body))
+        elif t is Program: enc = ('p', ref(n.program))
+        else:
+            raise NotImplementedError(f"Don't know how to encode {type(n).__name__}({n})")
+
+        index[key(n)] = len(out)
+        out.append(enc)
+
+    return tuple(out)
+
+def decode_program(enc: tuple) -> Node:
+    """Inverse of encode_program, returns the root node"""
+    nodes: List[object] = []
+
+    for e in enc:
+        tag = e[0]
+        if tag == 'n': n = e[1]
+        elif tag == 'v': n = Var(e[1])
+        elif tag == 'b': n = BinOp(e[1], nodes[e[2]], nodes[e[3]])
+        elif tag == 'c': n = BoolExpr(e[1], nodes[e[2]], e[3])
+        elif tag == 'k': n = Skip()
+        elif tag == 's': n = Seq(nodes[e[1]], nodes[e[2]])
+        elif tag == 'l': n = Block([nodes[i] for i in e[1]])
+        elif tag == 'a': n = Assign(nodes[e[1]], nodes[e[2]])
+        elif tag == 'i': n = Input(nodes[e[1]])
+        elif tag == 'f': n = IfThenElse(nodes[e[1]], nodes[e[2]], nodes[e[3]])
+        elif tag == 'w': n = While(nodes[e[1]], nodes[e[2]])
+        elif tag == 'p': n = Program(nodes[e[1]])
+        else:
+            raise ValueError(f"Unknown tag {tag!r}")
+
+        nodes.append(n)
+
+    return nodes[-1]
+
+class BatchResult(object):
+    """The outcome of job number index: its output memory, or the error
+    that stopped it"""
+    def __init__(self, index: int, memory, error: Optional[str], elapsed: float):
+        self.index = index
+        self.memory = memory
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __str__(self):
+        out = self.memory if self.ok else f"error: {self.error}"
+        return f"job {self.index}: {out} ({self.elapsed * 1e3:.1f} ms)"
+
+    __repr__ = __str__
+
+class JobTimeout(Exception):
+    pass
+
+def _alarm(signum, frame):
+    raise JobTimeout()
+
+def _run_job(index: int, enc: tuple, memory, domain: str, timeout: Optional[float]) -> BatchResult:
+    import abstractions
+    from sem_abs import evaluate_Cmd_abs
+
+    start = time.perf_counter()
+    timer = timeout is not None and hasattr(signal, 'setitimer')
+    if timer:
+        old = signal.signal(signal.SIGALRM, _alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        nra = abstractions.NonRelationalAbstraction(_domains()[domain]())
+        if isinstance(memory, list):
+            memory = nra.phi(memory)
+
+        out = evaluate_Cmd_abs(decode_program(enc), memory, nra)
+        return BatchResult(index, out, None, time.perf_counter() - start)
+    except JobTimeout:
+        return BatchResult(index, None, f"timed out after {timeout} s", time.perf_counter() - start)
+    except Exception as e:
+        return BatchResult(index, None, f"{type(e).__name__}: {e}", time.perf_counter() - start)
+    finally:
+        if timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, old)
+
+def _run_chunk(chunk: List[tuple], timeout: Optional[float]) -> List[BatchResult]:
+    return [_run_job(*job, timeout) for job in chunk]
+
+def analyse_batch(jobs: Iterable[Tuple[Node, object, str]], workers: Optional[int] = None,
+                  timeout: Optional[float] = None, chunksize: int = 1) -> Iterator[BatchResult]:
+    """Runs evaluate_Cmd_abs on every (program, memory, domain name) job
+    in jobs on a pool of workers processes (the CPU count if None), and
+    yields their results as they complete.
+
+    A job that runs longer than timeout seconds is stopped and yields an
+    error, as does one that raises. Timeouts need signal.setitimer, so
+    they are not enforced where it is missing (Windows), which is
+    logged as a warning. Jobs are sent to workers chunksize
+    at a time, which amortises the cost of sending many small jobs. At
+    most a few chunks per worker are queued, so jobs can be a lazy
+    iterable of any length.
+    """
+    domains = _domains()
+    workers = workers or os.cpu_count() or 1
+    if timeout is not None and not hasattr(signal, 'setitimer'):
+        logger.warning(f"signal.setitimer is not available, the timeout of {timeout} s is not enforced")
+
+    def chunks():
+        chunk = []
+        for i, (p, memory, domain) in enumerate(jobs):
+            if domain not in domains:
+                raise ValueError(f"Unknown domain {domain}, known: {', '.join(domains)}")
+
+            chunk.append((i, encode_program(p), memory, domain))
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+
+        if len(chunk): yield chunk
+
+    with ProcessPoolExecutor(workers) as pool:
+        limit = 4 * workers
+        pending = set()
+        source = chunks()
+        exhausted = False
+
+        while True:
+            while not exhausted and len(pending) < limit:
+                chunk = next(source, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending.add(pool.submit(_run_chunk, chunk, timeout))
+
+            if len(pending) == 0: break
+
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for f in done:
+                yield from f.result()
+
+def _test_jobs():
+    x = Var('x')
+    y = Var('y')
+
+    programs = [Program(Assign(x, 9)),
+                Program(IfThenElse(BoolExpr('>', x, 7),
+                                   Assign(y, BinOp('-', x, 7)),
+                                   Assign(y, BinOp('-', 7, x)))),
+                Program(While(BoolExpr('<', x, 7),
+                              Seq(Assign(y, BinOp('-', y, 1)),
+                                  Assign(x, BinOp('+', x, 1))))),
+                Program(sequence([Assign(x, 0),
+                                  While(BoolExpr('<=', x, 100),
+                                        IfThenElse(BoolExpr('>=', x, 50),
+                                                   Assign(x, 10),
+                                                   Assign(x, BinOp('+', x, 1))))]))]
+
+    M_in = [{'x': 5, 'y': 6}, {'x': 8, 'y': 7}]
+    return [(p, M_in, d) for d in ['intervals', 'signs'] for p in programs]
+
+def test_encode_program():
+    import pickle
+
+    for p, _, _ in _test_jobs():
+        for q in [p, flatten_blocks(p)]:
+            enc = encode_program(q)
+            assert str(decode_program(enc)) == str(q)
+            assert encode_program(decode_program(enc)) == enc
+            assert len(pickle.dumps(enc)) < len(pickle.dumps(q))
+
+    # deep programs don't recurse
+    s = Skip()
+    for i in range(10000):
+        s = Seq(Assign(Var('x'), i), s)
+
+    assert len(encode_program(s)) > 10000
+    assert isinstance(decode_program(encode_program(s)), Seq)
+
+def test_analyse_batch():
+    import abstractions
+    from sem_abs import evaluate_Cmd_abs
+
+    jobs = _test_jobs()
+    results = list(analyse_batch(jobs, workers = 2, chunksize = 3))
+    assert sorted([r.index for r in results]) == list(range(len(jobs)))
+
+    for r in results:
+        p, M_in, d = jobs[r.index]
+        nra = abstractions.NonRelationalAbstraction(_domains()[d]())
+        assert r.ok and r.memory == evaluate_Cmd_abs(p, nra.phi(M_in), nra), r
+
+    # a job that runs too long only stops itself: the recursive
+    # interpreter takes time exponential in the depth of nested loops
+    slow: Cmd = Skip()
+    for i in range(16):
+        x = Var(f"x{i}")
+        slow = Seq(Assign(x, 0), While(BoolExpr('<', x, 10), Seq(slow, Assign(x, BinOp('+', x, 1)))))
+
+    results = list(analyse_batch([(Program(slow), [{'x0': 0}], 'intervals')] + jobs[:2], workers = 2, timeout = 0.5))
+    errors = [r for r in results if not r.ok]
+    assert len(results) == 3 and len(errors) == 1 and errors[0].index == 0, results
+    assert "timed out" in errors[0].error, errors
+
+    # without setitimer, jobs run without a timeout, which is logged
+    class Records(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.records = []
+
+        def emit(self, record):
+            self.records.append(record)
+
+    handler = Records()
+    logger.addHandler(handler)
+    setitimer = signal.setitimer
+    del signal.setitimer
+    try:
+        results = list(analyse_batch(jobs[:2], workers = 1, timeout = 0.5))
+    finally:
+        signal.setitimer = setitimer
+        logger.removeHandler(handler)
+
+    assert len(results) == 2 and all([r.ok for r in results]), results
+    assert [r.levelno for r in handler.records] == [logging.WARNING] and "not enforced" in handler.records[0].getMessage()
+
+if __name__ == "__main__":
+    test_encode_program()
+    test_analyse_batch()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+#
+# bench_suite.py
+#
+# A reproducible benchmark suite for the interpreters, with results in
+# JSON that can be compared against a saved baseline.
+#
+# Every case is a program and a set of input memories from proggen.py.
+# The suite times, for each case, the concrete interpreter, the
+# abstract interpreter with the signs and intervals domains, and the
+# abstraction of the input memories (NonRelationalAbstraction.phi).
+#
+# Run as
+#
+#   python3 bench_suite.py --out results.json [--baseline base.json]
+#
+# which exits with status 1 if any timing is more than --threshold
+# slower than the baseline.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to bench_suite.py. This
+# work is published from: United States.
+
+from typing import Callable, Dict, List, Optional, Tuple
+from tinyast import *
+import proggen
+import argparse
+import json
+import platform
+import random
+import sys
+import timeit
+
+FORMAT_VERSION = 1
+
+def _case(p: Program, size: int, seed: int = 0):
+    # Blocks, so that long programs don't run out of stack
+    return flatten_blocks(p), proggen.memories(proggen.program_variables(p), size, seed = seed)
+
+def _loops(depth: int, size: int):
+    p, m = proggen.nested_loops(depth)
+    return flatten_blocks(p), [dict(m, x0 = i) for i in range(size)]
+
+CASES: Dict[str, Callable[[], Tuple[Node, List[proggen.Memory]]]] = {
+    'straight_line_1000': lambda: _case(proggen.straight_line(1000), 100),
+    'straight_line_50_wide': lambda: _case(proggen.straight_line(50), 10000),
+    'many_variables_500': lambda: _case(proggen.many_variables(500), 10),
+    'nested_ifs_100': lambda: _case(proggen.nested_ifs(100), 1000),
+    'nested_loops_3': lambda: _loops(3, 10),
+}
+
+def _time(f: Callable, repeat: int) -> Tuple[int, List[float]]:
+    """Returns the number of calls per run, so that a run takes at least
+    0.05 s, and the time per call of each run"""
+    def run():
+        random.seed(0) # Input is the only source of randomness
+        f()
+
+    timer = timeit.Timer(run)
+    number = 1
+    while number * min(timer.repeat(1, number)) < 0.05:
+        number *= 2
+
+    return number, [t / number for t in timer.repeat(repeat, number)]
+
+def measures(p: Node, M: List[proggen.Memory]) -> Dict[str, Callable]:
+    """Returns the functions that the suite times for a case"""
+    import sem
+    import abstractions
+    from sem_abs import evaluate_Cmd_abs
+
+    out: Dict[str, Callable] = {'sem': lambda: sem.evaluate_Cmd(p, M)}
+    for name, dom in [('signs', abstractions.SignsDomain()), ('intervals', abstractions.IntervalsDomain())]:
+        nra = abstractions.NonRelationalAbstraction(dom)
+        M_abs = nra.phi(M)
+        out[f'abs_{name}'] = (lambda nra, M_abs: lambda: evaluate_Cmd_abs(p, M_abs, nra))(nra, M_abs)
+        out[f'phi_{name}'] = (lambda nra: lambda: nra.phi(M))(nra)
+
+    return out
+
+def run_suite(cases: Optional[List[str]] = None, repeat: int = 5, log = None) -> dict:
+    """Runs the named cases (or all of them), and returns the results,
+    which json.dump can write"""
+    results = {}
+    for name in (cases or CASES):
+        if name not in CASES:
+            raise ValueError(f"Unknown case {name}, known: {', '.join(CASES)}")
+
+        p, M = CASES[name]()
+        for m, f in measures(p, M).items():
+            number, runs = _time(f, repeat)
+            results[f"{name}/{m}"] = {'best': min(runs), 'runs': runs, 'number': number}
+            if log: log(f"{name + '/' + m:>40}: {min(runs) * 1e3:10.3f} ms")
+
+    return {'version': FORMAT_VERSION,
+            'meta': {'python': platform.python_version(),
+                     'implementation': platform.python_implementation(),
+                     'machine': platform.machine(),
+                     'repeat': repeat},
+            'results': results}
+
+def compare(current: dict, baseline: dict, threshold: float = 0.10) -> List[dict]:
+    """Compares the best times of current against baseline. A benchmark
+    is 'slower' or 'faster' if it changed by more than threshold (a
+    fraction), and 'new' or 'missing' if only one side has it."""
+    for r in [current, baseline]:
+        if r.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported results version {r.get('version')}, expected {FORMAT_VERSION}")
+
+    cur, base = current['results'], baseline['results']
+
+    out = []
+    for name in list(base) + [n for n in cur if n not in base]:
+        row = {'name': name,
+               'baseline': base[name]['best'] if name in base else None,
+               'current': cur[name]['best'] if name in cur else None}
+
+        if row['baseline'] is None:
+            row['status'] = 'new'
+        elif row['current'] is None:
+            row['status'] = 'missing'
+        else:
+            row['ratio'] = row['current'] / row['baseline']
+            if row['ratio'] > 1 + threshold:
+                row['status'] = 'slower'
+            elif row['ratio'] < 1 - threshold:
+                row['status'] = 'faster'
+            else:
+                row['status'] = 'same'
+
+        out.append(row)
+
+    return out
+
+def format_comparison(rows: List[dict]) -> str:
+    lines = []
+    for r in rows:
+        b = "-" if r['baseline'] is None else f"{r['baseline'] * 1e3:.3f}"
+        c = "-" if r['current'] is None else f"{r['current'] * 1e3:.3f}"
+        ratio = f"{r['ratio']:.2f}x" if 'ratio' in r else ""
+        lines.append(f"{r['name']:>40}: {b:>10} -> {c:>10} ms {ratio:>7} {r['status']}")
+
+    return "\n".join(lines)
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description = "Runs the benchmark suite")
+    ap.add_argument('cases', nargs = '*', help = f"cases to run (default all): {', '.join(CASES)}")
+    ap.add_argument('--out', help = "write the results to this JSON file")
+    ap.add_argument('--baseline', help = "compare against the results in this JSON file")
+    ap.add_argument('--threshold', type = float, default = 0.10, help = "relative change to report (default 0.10)")
+    ap.add_argument('--repeat', type = int, default = 5, help = "runs of each benchmark, the fastest is kept (default 5)")
+    args = ap.parse_args(argv)
+
+    results = run_suite(args.cases, args.repeat, log = print)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent = 1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if args.cases:
+            baseline['results'] = dict([(k, v) for k, v in baseline['results'].items() if k.split('/')[0] in args.cases])
+
+        rows = compare(results, baseline, args.threshold)
+
+        print(format_comparison(rows))
+        if any([r['status'] == 'slower' for r in rows]): return 1
+
+    return 0
+
+def test_bench_suite():
+    import os
+    import tempfile
+
+    out = os.path.join(tempfile.mkdtemp(), "results.json")
+    assert main(['nested_loops_3', '--repeat', '1', '--out', out]) == 0
+
+    with open(out) as f:
+        results = json.load(f)
+
+    assert sorted(results['results']) == sorted([f"nested_loops_3/{m}" for m in ['sem', 'abs_signs', 'abs_intervals',
+                                                                                  'phi_signs', 'phi_intervals']])
+    assert main(['nested_loops_3', '--repeat', '1', '--baseline', out, '--threshold', '1e6']) == 0
+
+    # a baseline that was 100 times faster
+    slow = json.loads(json.dumps(results))
+    for r in slow['results'].values():
+        r['best'] /= 100
+
+    slow['results']['old/sem'] = {'best': 1.0, 'runs': [1.0], 'number': 1}
+    rows = dict([(r['name'], r) for r in compare(results, slow)])
+    assert rows['nested_loops_3/sem']['status'] == 'slower' and rows['old/sem']['status'] == 'missing'
+    assert compare(slow, results)[0]['status'] == 'faster'
+
+    with open(out, 'w') as f:
+        json.dump(slow, f)
+
+    assert main(['nested_loops_3', '--repeat', '1', '--baseline', out]) == 1
+    assert main(['nested_ifs_100', '--repeat', '1', '--baseline', out]) == 0 # nothing to compare
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
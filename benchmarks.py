@@ -0,0 +1,713 @@
+#!/usr/bin/env python3
+#
+# benchmarks.py
+#
+# Micro-benchmarks for the interpreters and the value abstractions.
+#
+# Run as `python3 benchmarks.py [name ...]` to run all (or only the
+# named) benchmarks.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to benchmarks.py. This
+# work is published from: United States.
+
+import sys
+import timeit
+
+from dom_intervals import IntervalPoint, IntervalsDomain, interval
+from tinyast import *
+from proggen import nested_loops
+
+def best_of(stmt, number, repeat = 5):
+    """Returns the best time per call of stmt, in microseconds"""
+    return min(timeit.repeat(stmt, number = number, repeat = repeat)) / number * 1e6
+
+def report(name, times):
+    base = None
+    for label, t in times:
+        if base is None:
+            base = t
+            print(f"{name:>24} {label:>12}: {t:8.3f} us")
+        else:
+            print(f"{name:>24} {label:>12}: {t:8.3f} us ({base / t:.2f}x)")
+
+def bench_intervals(number = 20000):
+    """Tuple-of-IntervalPoint values against Interval values"""
+
+    # the tuple-of-IntervalPoint representation, as the domain used it
+    # before Interval existed
+    def old_phi(v):
+        return (IntervalPoint(v), IntervalPoint(v))
+
+    def old_add(x, y):
+        return (x[0] + y[0], x[1] + y[1])
+
+    def old_sub(x, y):
+        return (x[0] - y[1], x[1] - y[0])
+
+    def old_lte(x, y):
+        return x[0] >= y[0] and x[1] <= y[1]
+
+    def old_lub(x, y):
+        if old_lte(x, y): return y
+        if old_lte(y, x): return x
+        return (min(x[0], y[0]), max(x[1], y[1]))
+
+    ninf = IntervalPoint(IntervalPoint.NINF)
+    pinf = IntervalPoint(IntervalPoint.PINF)
+    old_a, old_b = (IntervalPoint(1), IntervalPoint(5)), (ninf, IntervalPoint(3))
+    old_top = (ninf, pinf)
+
+    d = IntervalsDomain()
+    a, b = interval(1, 5), interval(d.NINF, 3)
+
+    report("phi", [("tuple", best_of(lambda: old_phi(7), number)),
+                   ("Interval", best_of(lambda: d.phi(7), number))])
+
+    report("add/sub", [("tuple", best_of(lambda: old_sub(old_add(old_a, old_b), old_a), number)),
+                       ("Interval", best_of(lambda: d.f_binop('-', d.f_binop('+', a, b), a), number))])
+
+    report("lte", [("tuple", best_of(lambda: old_lte(old_a, old_top), number)),
+                   ("Interval", best_of(lambda: d.lte(a, d.TOP), number))])
+
+    report("lub", [("tuple", best_of(lambda: old_lub(old_a, old_b), number)),
+                   ("Interval", best_of(lambda: d.lub(a, b), number))])
+
+def bench_columnar(size = 20000):
+    """List-of-dicts concrete interpreter against the NumPy columnar one"""
+    import sem
+    import sem_np
+
+    x = Var('x')
+    y = Var('y')
+
+    p = Program(sequence([Assign(y, BinOp('*', x, 3)),
+                          IfThenElse(BoolExpr('>', x, size // 2),
+                                     Assign(y, BinOp('-', y, x)),
+                                     Assign(y, BinOp('+', y, 7))),
+                          Assign(x, BinOp('/', y, 2))]))
+
+    M = [{'x': i, 'y': 0} for i in range(size)]
+    cm = sem_np.ColumnarMemories.from_memories(M)
+
+    report(f"{size} memories", [("list", best_of(lambda: sem.evaluate_Cmd(p, M), 1, 3)),
+                                ("columnar", best_of(lambda: sem_np.evaluate_Cmd_np(p, cm), 1, 3))])
+
+def bench_compile(size = 2000):
+    """Tree-walking concrete interpreter against compiled closures"""
+    import sem
+    from sem_compile import compile_program
+
+    x = Var('x')
+    y = Var('y')
+
+    # the programs from sem.test_evaluate_Cmd and sem.test_While
+    programs = {"assign": Program(Assign(x, 9)),
+                "seq": Program(sequence([Assign(x, 10), Assign(y, 11)])),
+                "ite": Program(IfThenElse(BoolExpr('>', x, 7),
+                                          Assign(y, BinOp('-', x, 7)),
+                                          Assign(y, BinOp('-', 7, x)))),
+                "loop": Program(While(BoolExpr('<', x, 7),
+                                      Seq(Assign(y, BinOp('-', y, 1)),
+                                          Assign(x, BinOp('+', x, 1))))),
+                "while": Program(While(BoolExpr('<', x, 7),
+                                       Seq(Assign(y, BinOp('+', y, 1)),
+                                           Assign(x, BinOp('+', x, 1))))),
+                }
+
+    M = sem.MemorySet(('x', 'y'), [(i % 13, i) for i in range(size)])
+
+    for name, p in programs.items():
+        cp = compile_program(p)
+        report(name, [("tree", best_of(lambda: sem.evaluate_Cmd(p, M), 10)),
+                      ("compiled", best_of(lambda: cp(M), 10))])
+
+def bench_abs_codegen(number = 200):
+    """Generic abstract transfer functions against generated ones"""
+    import abstractions
+    import sem_abs
+    import sem_abs_compile
+
+    x = Var('x')
+    y = Var('y')
+    z = Var('z')
+
+    p = Program(sequence([Assign(x, 0),
+                          Assign(y, 0),
+                          While(BoolExpr('<=', x, 100),
+                                sequence([IfThenElse(BoolExpr('>=', x, 50),
+                                                     Assign(y, BinOp('-', BinOp('+', y, x), 3)),
+                                                     Assign(y, BinOp('+', y, 1))),
+                                          Assign(z, BinOp('-', BinOp('+', x, y), BinOp('-', z, 2))),
+                                          Assign(x, BinOp('+', x, 1))]))]))
+
+    nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+    M_abs = nra.phi([{'x': 0, 'y': 0, 'z': 0}])
+
+    def run(enabled):
+        sem_abs_compile.enabled = enabled
+        return best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_abs, nra), number)
+
+    try:
+        report("loop", [("generic", run(False)), ("generated", run(True))])
+    finally:
+        sem_abs_compile.enabled = True
+
+def bench_cfg(max_depth = 8, number = 3):
+    """Recursive abstract interpreter against the CFG worklist solver on nested loops"""
+    import abstractions
+    import sem_abs
+    import sem_abs_cfg
+
+    nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+
+    for depth in range(1, max_depth + 1):
+        p, m = nested_loops(depth)
+        M_abs = nra.phi([m])
+
+        report(f"depth {depth}", [("recursive", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_abs, nra), number)),
+                                  ("worklist", best_of(lambda: sem_abs_cfg.evaluate_Cmd_abs_cfg(p, M_abs, nra), number))])
+
+        # abs_iter gives up after 5 iterations, so the two need not
+        # be equally precise
+        print(f"{'':>24} {'recursive':>12}: {sem_abs.evaluate_Cmd_abs(p, M_abs, nra)}")
+        print(f"{'':>24} {'worklist':>12}: {sem_abs_cfg.evaluate_Cmd_abs_cfg(p, M_abs, nra)}")
+
+def bench_widening(number = 20):
+    """Iteration strategies for abs_iter: thresholds, delayed widening and narrowing"""
+    import abstractions
+    import sem_abs
+
+    x = Var('x')
+    y = Var('y')
+
+    p = Program(sequence([Assign(x, 0),
+                          Assign(y, 0),
+                          While(BoolExpr('<', x, 100),
+                                sequence([IfThenElse(BoolExpr('<', x, 50),
+                                                     Assign(y, BinOp('+', y, 1)),
+                                                     Assign(y, BinOp('-', y, 1))),
+                                          Assign(x, BinOp('+', x, 1))]))]))
+    m = [{'x': 0, 'y': 0}]
+
+    strategies = [("default", (), sem_abs.IterationStrategy()),
+                  ("thresholds", sem_abs.program_thresholds(p), sem_abs.IterationStrategy(max_iterations = None)),
+                  ("delay 3", (), sem_abs.IterationStrategy(delay = 3, max_iterations = None)),
+                  ("narrow 2", (), sem_abs.IterationStrategy(max_iterations = None, narrowing = 2)),
+                  ("thr+narrow", sem_abs.program_thresholds(p), sem_abs.IterationStrategy(max_iterations = None, narrowing = 2))]
+
+    times = []
+    for label, thresholds, strategy in strategies:
+        nra = abstractions.NonRelationalAbstraction(IntervalsDomain(thresholds), strategy)
+        M_abs = nra.phi(m)
+        times.append((label, best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_abs, nra), number)))
+
+        strategy.reset()
+        out = sem_abs.evaluate_Cmd_abs(p, M_abs, nra)
+        print(f"{'':>24} {label:>12}: {strategy.report()}: {out}")
+
+    report("loop", times)
+
+def bench_cache(number = 50):
+    """evaluate_Cmd_abs with and without a TransferCache"""
+    import abstractions
+    import sem_abs
+
+    p, m = nested_loops(4)
+    plain = abstractions.NonRelationalAbstraction(IntervalsDomain())
+    M_abs = plain.phi([m])
+
+    # a cold cache only hits on repeated work within one analysis,
+    # a warm one also on analyses that came before
+    cache = sem_abs.TransferCache()
+    cached = abstractions.NonRelationalAbstraction(plain.dom, cache = cache)
+    cached.BOT = plain.BOT
+
+    def cold():
+        cache.clear()
+        return sem_abs.evaluate_Cmd_abs(p, M_abs, cached)
+
+    report("nested loops", [("uncached", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_abs, plain), number)),
+                            ("cold", best_of(cold, number)),
+                            ("warm", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_abs, cached), number))])
+    print(f"{'':>24} {'':>12}  {cache.report()}")
+
+def bench_memory(sizes = (10, 1000, 5000), number = 5):
+    """The abstract interpreter on memories with many variables, of which a loop updates a few"""
+    import abstractions
+    import sem_abs
+
+    x = Var('x')
+    y = Var('y')
+
+    p = Program(sequence([Assign(x, 0),
+                          While(BoolExpr('<', x, 100),
+                                sequence([IfThenElse(BoolExpr('<', y, 10),
+                                                     Assign(y, BinOp('+', y, 1)),
+                                                     Assign(y, 0)),
+                                          Assign(x, BinOp('+', x, 1))]))]))
+
+    nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+    for n in sizes:
+        m = dict([(f"v{i}", i) for i in range(n)])
+        m.update({'x': 0, 'y': 0})
+        M_abs = nra.phi([m])
+
+        report(f"{n} variables", [("analysis", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_abs, nra), number))])
+
+def bench_incremental(blocks = 20, number = 3):
+    """Full re-analysis against incremental re-analysis after one edit"""
+    import abstractions
+    import sem_abs
+    from sem_abs_incr import IncrementalAnalysis
+
+    def program(edited, step):
+        body = []
+        for i in range(blocks):
+            x, y = Var(f"x{i}"), Var(f"y{i}")
+            body.extend([Assign(x, 0),
+                         While(BoolExpr('<', x, 10),
+                               sequence([Assign(y, 0),
+                                         While(BoolExpr('<', y, 5),
+                                               Assign(y, BinOp('+', y, step if i == edited else 1))),
+                                         Assign(x, BinOp('+', x, 1))]))])
+
+        return Program(sequence(body))
+
+    nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+    M_abs = nra.phi([dict([(f"{v}{i}", 0) for i in range(blocks) for v in "xy"])])
+    base = program(None, 1)
+
+    for name, edited in [("first", 0), ("middle", blocks // 2), ("last", blocks - 1)]:
+        p = program(edited, 2)
+        inc = IncrementalAnalysis(nra)
+
+        # each call makes two edits, to p and back to base
+        def reanalyse():
+            inc.analyse(p, M_abs)
+            inc.analyse(base, M_abs)
+
+        inc.analyse(base, M_abs)
+        t_inc = best_of(reanalyse, number) / 2
+        assert inc.analyse(p, M_abs) == sem_abs.evaluate_Cmd_abs(p, M_abs, nra)
+
+        report(f"edit {name} of {blocks}", [("full", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_abs, nra), number)),
+                                            ("incremental", t_inc)])
+
+def bench_batch(jobs = 200):
+    """Serial analysis against batch.analyse_batch, and encoded programs against pickled ASTs"""
+    import os
+    import pickle
+    import abstractions
+    import sem_abs
+    import batch
+
+    # distinct programs, as a CI run would have, so that the serial run
+    # also generates code for every program
+    work = [(nested_loops(4)[0], [nested_loops(4)[1]], 'intervals') for _ in range(jobs)]
+
+    def serial():
+        for p, M, d in work:
+            nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+            sem_abs.evaluate_Cmd_abs(p, nra.phi(M), nra)
+
+    def pool(workers):
+        return lambda: list(batch.analyse_batch(work, workers = workers, chunksize = 8))
+
+    cpus = os.cpu_count() or 1
+    times = [("serial", best_of(serial, 1, 1) / jobs)]
+    for w in sorted(set([1, 2, cpus])):
+        times.append((f"{w} workers", best_of(pool(w), 1, 1) / jobs))
+
+    report(f"per job, {cpus} cpus", times)
+
+    deep, _ = nested_loops(8)
+    report("pickle", [("AST", best_of(lambda: pickle.loads(pickle.dumps(deep)), 100)),
+                      ("encoded", best_of(lambda: batch.decode_program(pickle.loads(pickle.dumps(batch.encode_program(deep)))), 100))])
+    print(f"{'':>24} {'':>12}  {len(pickle.dumps(deep))} bytes as an AST, {len(pickle.dumps(batch.encode_program(deep)))} encoded")
+
+def bench_sharded(size = 20000):
+    """sem.evaluate_Cmd against sem_par.ShardedInterpreter on a large set of memories"""
+    import os
+    import sem
+    import sem_par
+
+    x = Var('x')
+    y = Var('y')
+    p = Program(sequence([IfThenElse(BoolExpr('>', x, 500),
+                                     Assign(y, BinOp('-', x, 500)),
+                                     Assign(y, BinOp('-', 500, x))),
+                          While(BoolExpr('<', y, 50),
+                                Assign(y, BinOp('+', y, 7)))]))
+    M = [{'x': i, 'y': i % 97} for i in range(size)]
+
+    cpus = os.cpu_count() or 1
+    times = [("sem", best_of(lambda: sem.evaluate_Cmd(p, M), 1, 3))]
+    for w in sorted(set([1, 2, cpus])):
+        with sem_par.ShardedInterpreter(w) as si:
+            si.run(p, M[:10]) # start the workers
+            times.append((f"{w} workers", best_of(lambda: si.run(p, M), 1, 3)))
+
+    report(f"{size} memories, {cpus} cpus", times)
+
+def bench_parse(sizes = (1000, 10000, 100000)):
+    """tinyparse.parse throughput, per statement, on programs of increasing size"""
+    import tinyparse
+
+    def program(n):
+        stmts = []
+        for i in range(n // 3):
+            stmts.append(f"x := (x + {i})")
+            stmts.append(f"if(x > {i}) {{ y := ((x * 2) - y) }} else {{ input(y) }}")
+            stmts.append(f"while(y < {i}) {{ y := (y + 1); skip }}")
+
+        return "; ".join(stmts)
+
+    times = []
+    for n in sizes:
+        text = program(n)
+        t = best_of(lambda: tinyparse.parse(text), 1, 3)
+        times.append((f"{n} stmts", t / n))
+        print(f"{'':>24} {'':>12}  {n} statements, {len(text) / t:.2f} MB/s")
+
+    report("per statement", times)
+
+def bench_block(size = 300, large = 100000):
+    """Nested Seqs against flattened Blocks on straight-line programs"""
+    import abstractions
+    import sem
+    import sem_abs
+
+    x = Var('x')
+    y = Var('y')
+
+    def program(n):
+        return Program(sequence([Assign(x, BinOp('+', x, 1)) if i % 2 else Assign(y, BinOp('-', y, x)) for i in range(n)]))
+
+    # the recursive Seq evaluation needs about 2 frames per statement, so
+    # only short programs can be compared
+    p = program(size)
+    b = flatten_blocks(p)
+    M = sem.MemorySet(('x', 'y'), [(i, 0) for i in range(10)])
+
+    nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+    M_abs = nra.phi([{'x': 0, 'y': 0}])
+
+    report(f"sem {size}", [("Seq", best_of(lambda: sem.evaluate_Cmd(p, M), 10)),
+                           ("Block", best_of(lambda: sem.evaluate_Cmd(b, M), 10))])
+    report(f"sem_abs {size}", [("Seq", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_abs, nra), 10)),
+                               ("Block", best_of(lambda: sem_abs.evaluate_Cmd_abs(b, M_abs, nra), 10))])
+
+    b = flatten_blocks(program(large))
+    sem_abs.evaluate_Cmd_abs(b, M_abs, nra) # generate code once
+    report(f"sem {large}", [("per stmt", best_of(lambda: sem.evaluate_Cmd(b, M), 1, 3) / large)])
+    report(f"sem_abs {large}", [("per stmt", best_of(lambda: sem_abs.evaluate_Cmd_abs(b, M_abs, nra), 1, 3) / large)])
+
+def bench_store(entries = 200):
+    """Pickled programs and results against abs_store files"""
+    import os
+    import pickle
+    import tempfile
+    import abstractions
+    import sem_abs
+    import abs_store
+
+    nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+    data = {}
+    for i in range(entries):
+        p, m = nested_loops(4)
+        data[f"p{i}"] = (p, sem_abs.evaluate_Cmd_abs(p, nra.phi([m]), nra))
+
+    d = tempfile.mkdtemp()
+    pkl = os.path.join(d, "results.pkl")
+    bin = os.path.join(d, "results.bin")
+
+    def dump_pickle():
+        with open(pkl, 'wb') as f:
+            pickle.dump(data, f)
+
+    def load_pickle(key):
+        with open(pkl, 'rb') as f:
+            return pickle.load(f)[key]
+
+    def dump_store():
+        with abs_store.StoreWriter(bin) as w:
+            for k, (p, out) in data.items():
+                w.add(k, p, out)
+
+    def load_store(key):
+        with abs_store.Store(bin) as s:
+            return s.program(key), s.result(key)
+
+    def load_all_store():
+        with abs_store.Store(bin) as s:
+            return [(s.program(k), s.result(k)) for k in s.keys()]
+
+    report("write all", [("pickle", best_of(dump_pickle, 1)), ("store", best_of(dump_store, 1))])
+    report("load one", [("pickle", best_of(lambda: load_pickle("p7"), 5)), ("store", best_of(lambda: load_store("p7"), 5))])
+    report("load all", [("pickle", best_of(lambda: load_pickle("p7"), 5)), ("store", best_of(load_all_store, 1))])
+    print(f"{'':>24} {'':>12}  {os.path.getsize(pkl)} bytes pickled, {os.path.getsize(bin)} in a store")
+
+def bench_profile(number = 20):
+    """evaluate_Cmd_abs without and with a sem_abs.Profiler"""
+    import abstractions
+    import sem_abs
+
+    p, m = nested_loops(4)
+    nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+    M_abs = nra.phi([m])
+
+    off = best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_abs, nra), number)
+    nra.profiler = sem_abs.Profiler()
+    on = best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_abs, nra), number)
+
+    report("nested loops", [("off", off), ("on", on)])
+
+def bench_trace(number = 20):
+    """evaluate_Cmd_abs with tracing off and into a ring buffer"""
+    import abstractions
+    import sem_abs
+    import abs_trace
+
+    p, m = nested_loops(4)
+    nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+    M_abs = nra.phi([m])
+
+    def traced():
+        with abs_trace.tracing(abs_trace.RingBuffer()):
+            sem_abs.evaluate_Cmd_abs(p, M_abs, nra)
+
+    report("nested loops", [("off", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_abs, nra), number)),
+                            ("ring buffer", best_of(traced, number))])
+
+    # a wide memory, where formatting it for a log dominates
+    x = Var('v0')
+    wide = nra.phi([dict([(f"v{i}", i) for i in range(1000)])])
+    b = BoolExpr('<', x, 5)
+    report("filter, 1000 vars", [("off", best_of(lambda: sem_abs.filter_memory_abs(b, wide, nra.dom), number * 50))])
+
+def bench_octagon(sizes = (4, 16, 64), number = 200):
+    """Operations of the octagon abstraction against the intervals NonRelationalAbstraction"""
+    import abstractions
+    import abs_octagon
+    import sem_abs
+    import random
+
+    for n in sizes:
+        rng = random.Random(0)
+        names = [f"v{i}" for i in range(n)]
+        M0 = [dict([(v, rng.randint(-10, 10)) for v in names]) for _ in range(3)]
+        M1 = [dict([(v, rng.randint(-20, 20)) for v in names]) for _ in range(3)]
+        x, y = Var(names[0]), Var(names[1])
+        a = Assign(x, BinOp('+', y, 1))
+        b = BoolExpr('<', x, 5)
+
+        nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+        oa = abs_octagon.OctagonAbstraction()
+        for label, op in [("join", lambda A, m0, m1: A.union(m0, m1)),
+                          ("widen", lambda A, m0, m1: A.widen(m0, m1)),
+                          ("lte", lambda A, m0, m1: A.lte(m0, m1)),
+                          ("assign", lambda A, m0, m1: sem_abs.evaluate_Cmd_abs(a, m0, A)),
+                          ("filter", lambda A, m0, m1: sem_abs._filter(b, m0, A))]:
+            times = []
+            for name, A in [("intervals", nra), ("octagon", oa)]:
+                m0, m1 = A.phi(M0), A.phi(M1)
+                # closed, as the results of other operations are
+                times.append((name, best_of(lambda: op(A, m0, m1), number)))
+
+            report(f"{label}, {n} vars", times)
+
+        # full closure, as phi() and widening need, against the
+        # incremental closure that assign() and filter() use
+        m = abs_octagon.OctagonAbstraction().phi(M0).matrix
+        report(f"closure, {n} vars", [("full", best_of(lambda: abs_octagon.close(m.copy()), number)),
+                                      ("incremental", best_of(lambda: abs_octagon.close_incremental(m.copy(), 0), number))])
+
+    p, m = nested_loops(3)
+    nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+    oa = abs_octagon.OctagonAbstraction()
+    M_nra, M_oa = nra.phi([m]), oa.phi([m])
+    report("nested loops", [("intervals", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_nra, nra), 5)),
+                            ("octagon", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_oa, oa), 5))])
+
+def bench_signs(sizes = (10, 1000, 5000), number = 200000):
+    """SignsDomain operations, and signs memories as PersistentMemory against SignsVector"""
+    import abstractions
+    import sem_abs
+    from dom_signs import SignsDomain
+
+    d = SignsDomain()
+    report("lub", [("bitmask", best_of(lambda: d.lub(d.LTZ, d.GTZ), number))])
+    report("lte", [("bitmask", best_of(lambda: d.lte(d.LTZ, d.TOP), number))])
+    report("f_binop", [("table", best_of(lambda: d.f_binop('-', d.GTZ, d.LTZ), number))])
+    report("f_cmpop", [("table", best_of(lambda: d.f_cmpop('<', d.TOP, d.GTZ), number))])
+    report("refine", [("table", best_of(lambda: d.refine(d.TOP, d.GTZ), number))])
+
+    nra = abstractions.NonRelationalAbstraction(d)
+    sva = abstractions.SignsVectorAbstraction()
+    for n in sizes:
+        M0 = [dict([(f"v{i}", i % 3 - 1) for i in range(n)])]
+        M1 = [dict([(f"v{i}", i % 5 - 2) for i in range(n)])]
+        times = {}
+        for name, A in [("memory", nra), ("vector", sva)]:
+            m0, m1 = A.phi(M0), A.phi(M1)
+            j = A.union(m0, m1)
+            times[name] = [best_of(lambda: A.union(m0, m1), 20), best_of(lambda: A.lte(m0, j), 20)]
+
+        report(f"join, {n} vars", [(k, t[0]) for k, t in times.items()])
+        report(f"lte, {n} vars", [(k, t[1]) for k, t in times.items()])
+
+    p, m = nested_loops(3)
+    M = [dict(m, **dict([(f"v{i}", i) for i in range(1000)]))]
+    report("loops, 1000 vars", [("memory", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, nra.phi(M), nra), 5)),
+                                ("vector", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, sva.phi(M), sva), 5))])
+
+def bench_interval_arrays(sizes = (10, 1000, 5000), number = 20):
+    """Interval memories as PersistentMemory against IntervalArray"""
+    import abstractions
+    import abs_intervals_np
+    import sem_abs
+
+    nra = abstractions.NonRelationalAbstraction(IntervalsDomain())
+    iaa = abs_intervals_np.IntervalArrayAbstraction()
+    for n in sizes:
+        M0 = [dict([(f"v{i}", i % 7) for i in range(n)])]
+        M1 = [dict([(f"v{i}", i % 5) for i in range(n)])]
+        times = {}
+        for name, A in [("memory", nra), ("array", iaa)]:
+            m0, m1 = A.phi(M0), A.phi(M1)
+            j = A.union(m0, m1)
+            times[name] = [best_of(lambda: A.union(m0, m1), number), best_of(lambda: A.widen(m0, m1), number),
+                           best_of(lambda: A.lte(m0, j), number), best_of(lambda: j == A.union(m0, m1), number)]
+
+        for k, op in enumerate(["join", "widen", "lte", "join and =="]):
+            report(f"{op}, {n} vars", [(name, t[k]) for name, t in times.items()])
+
+    # the loop of bench_memory, on memories with many variables
+    x = Var('x')
+    y = Var('y')
+    p = Program(sequence([Assign(x, 0),
+                          While(BoolExpr('<', x, 100),
+                                sequence([IfThenElse(BoolExpr('<', y, 10),
+                                                     Assign(y, BinOp('+', y, 1)),
+                                                     Assign(y, 0)),
+                                          Assign(x, BinOp('+', x, 1))]))]))
+    for n in sizes:
+        M = [dict([(f"v{i}", i) for i in range(n)], x = 0, y = 0)]
+        M_nra, M_iaa = nra.phi(M), iaa.phi(M)
+        report(f"loop, {n} vars", [("memory", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_nra, nra), 5)),
+                                   ("array", best_of(lambda: sem_abs.evaluate_Cmd_abs(p, M_iaa, iaa), 5))])
+
+def bench_slots(size = 1000, number = 3):
+    """The concrete interpreter reading variables by name against by slot"""
+    import sem
+    import proggen
+
+    for n, nvars in [(50, 4), (50, 64)]:
+        by_name, by_slot = proggen.straight_line(n, nvars, 4), proggen.straight_line(n, nvars, 4)
+        intern_variables(by_slot)
+        M = proggen.memories(proggen.program_variables(by_name), size)
+        assert sem.evaluate_Cmd(by_name, M) == sem.evaluate_Cmd(by_slot, M)
+
+        report(f"{nvars} vars, {size} memories", [("name", best_of(lambda: sem.evaluate_Cmd(by_name, M), number)),
+                                                 ("slot", best_of(lambda: sem.evaluate_Cmd(by_slot, M), number))])
+
+def bench_while(n = 2000, long = 20000):
+    """Semi-naive loops against re-running the body on every memory that
+    satisfies the condition"""
+    import sem
+
+    # the loop as evaluate_Cmd ran it before evaluate_While
+    def old_while(C, M):
+        out = M
+        pre_iter_memories = M.filter(C.cond)
+        accum = sem.MemorySet(M.variables)
+        while len(pre_iter_memories):
+            after_iter_memories = sem.evaluate_Cmd(C.body, pre_iter_memories)
+            accum.update(after_iter_memories)
+            pre_iter_memories = after_iter_memories.filter(C.cond)
+
+        return out.union(accum).filter(C.cond, res = False)
+
+    x = Var('x')
+    y = Var('y')
+    loop = While(BoolExpr('<', x, n), Assign(x, BinOp('+', x, 1)))
+
+    # memories that start along the same count share their iterations
+    M = sem.MemorySet.from_memories([{'x': i} for i in range(n)])
+    assert old_while(loop, M) == sem.evaluate_While(loop, M)
+    report(f"{n} counts to {n}", [("old", best_of(lambda: old_while(loop, M), 1, 3)),
+                                 ("semi-naive", best_of(lambda: sem.evaluate_While(loop, M), 1, 3))])
+
+    # a single long count has nothing to share
+    loop = While(BoolExpr('<', x, long), sequence([Assign(x, BinOp('+', x, 1)), Assign(y, BinOp('+', y, x))]))
+    M = sem.MemorySet.from_memories([{'x': 0, 'y': 0}])
+    report(f"1 count to {long}", [("old", best_of(lambda: old_while(loop, M), 1, 3)),
+                                 ("semi-naive", best_of(lambda: sem.evaluate_While(loop, M), 1, 3))])
+
+def bench_enum(n = 60, chunk_size = 10000):
+    """Enumerating every Input as one set against a stream of chunks"""
+    import tracemalloc
+    import sem
+    import sem_enum
+    from tinyparse import parse
+
+    p = parse("input(x); input(y); input(z); s := (x + y); if(s > 50) { s := (s - z) } else { s := (s + z) }")
+    domain = range(n)
+
+    def materialised():
+        sem.input_domain = domain
+        try:
+            return len(sem.evaluate_Cmd(p, sem.MemorySet.from_memories([{}])))
+        finally:
+            sem.input_domain = None
+
+    def streamed():
+        return sum([len(c) for c in sem_enum.enumerate_Cmd(p, [{}], domain, chunk_size)])
+
+    peaks = []
+    for f in [materialised, streamed]:
+        tracemalloc.start()
+        assert f() == n ** 3
+        peaks.append(tracemalloc.get_traced_memory()[1] / 2 ** 20)
+        tracemalloc.stop()
+
+    report(f"{n ** 3} memories", [("set", best_of(materialised, 1, 3)), ("stream", best_of(streamed, 1, 3))])
+    print(f"{'peak':>24} {'set':>12}: {peaks[0]:8.1f} MiB")
+    print(f"{'peak':>24} {'stream':>12}: {peaks[1]:8.1f} MiB")
+
+    progress = sem_enum.Progress()
+    for _ in sem_enum.enumerate_Cmd(p, [{}], range(100), chunk_size, progress): pass
+    print(f"{'throughput':>24} {'stream':>12}: {progress}")
+
+def bench_staged(number = 20):
+    """Interval analysis on its own against a signs pre-pass that prunes
+    what it proves unreachable"""
+    import abstractions
+    import sem_abs
+    from tinyparse import parse
+
+    loops, m = nested_loops(3)
+    expensive = str(loops).replace("x", "w")
+    p = parse("x := 0; i := 0; while(i < 100) { x := (x + 1); i := (i + 1) }; "
+              f"if(x < 0) {{ {expensive} }} else {{ z := 1 }}")
+    for name, program, M, strategy in [("unreachable loops", p, [{}], sem_abs.IterationStrategy(delay = 10)),
+                                       ("nothing to prune", loops, [m], None)]:
+        nra = abstractions.NonRelationalAbstraction(IntervalsDomain(), strategy)
+        _, pruning = sem_abs.evaluate_staged(program, M, nra)
+        report(name, [("intervals", best_of(lambda: sem_abs.evaluate_Cmd_abs(program, nra.phi(M), nra), number)),
+                      ("staged", best_of(lambda: sem_abs.evaluate_staged(program, M, nra), number))])
+        print(f"{'':>24} {'':>12}  {pruning.report()}")
+
+def main(names):
+    benchmarks = dict([(n[len("bench_"):], f) for n, f in globals().items() if n.startswith("bench_")])
+
+    for n in (names or benchmarks):
+        if n not in benchmarks:
+            raise ValueError(f"Unknown benchmark {n}, known: {', '.join(benchmarks)}")
+
+        print(f"# {n}: {benchmarks[n].__doc__}")
+        benchmarks[n]()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+#
+# cfg.py
+#
+# A control-flow graph for programs of the tiny language.
+#
+# Basic blocks contain only Assign and Input commands. Conditions live
+# on the edges leaving a block: an edge is either unconditional, or is
+# taken when its condition evaluates to res. Every While gets an empty
+# loop head block, which is where fixpoint iterations should widen.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to cfg.py. This work is
+# published from: United States.
+
+from typing import Iterator, List, Optional
+from tinyast import *
+
+class Edge(object):
+    def __init__(self, src: 'BasicBlock', dst: 'BasicBlock', cond: Optional[BoolExpr] = None, res = True):
+        self.src = src
+        self.dst = dst
+        self.cond = cond
+        self.res = res
+
+    def __str__(self):
+        if self.cond is None:
+            return f"B{self.src.id} -> B{self.dst.id}"
+
+        return f"B{self.src.id} -> B{self.dst.id} [{'' if self.res else '!'}({self.cond})]"
+
+    __repr__ = __str__
+
+class BasicBlock(object):
+    def __init__(self, id: int, loop: Optional[While] = None):
+        self.id = id
+        self.stmts: List[Cmd] = []
+        self.succs: List[Edge] = []
+        self.preds: List[Edge] = []
+        self.loop = loop # the While this block is the head of
+
+    @property
+    def loop_head(self) -> bool:
+        return self.loop is not None
+
+    def __str__(self):
+        head = " (loop head)" if self.loop_head else ""
+        stmts = "".join([f"\n  {s}" for s in self.stmts])
+        succs = "".join([f"\n  {e}" for e in self.succs])
+        return f"B{self.id}{head}:{stmts}{succs}"
+
+    __repr__ = __str__
+
+def flatten_seq(C: Cmd) -> Iterator[Cmd]:
+    """Yields the commands of a (possibly nested) Seq or Block in order, without recursion"""
+    stack = [C]
+    while len(stack):
+        c = stack.pop()
+        if isinstance(c, Seq):
+            stack.append(c.cmd1)
+            stack.append(c.cmd0)
+        elif isinstance(c, Block):
+            stack.extend(reversed(c.cmds))
+        elif isinstance(c, Program):
+            stack.append(c.program)
+        else:
+            yield c
+
+class CFG(object):
+    """A control flow graph, with blocks numbered so that forward edges
+    always go from a lower to a higher numbered block"""
+
+    def __init__(self, C: Cmd):
+        self.blocks: List[BasicBlock] = []
+        self.entry = self.new_block()
+        self.exit = self._build(C, self.entry)
+
+    def new_block(self, loop: Optional[While] = None) -> BasicBlock:
+        b = BasicBlock(len(self.blocks), loop)
+        self.blocks.append(b)
+        return b
+
+    def add_edge(self, src: BasicBlock, dst: BasicBlock, cond: Optional[BoolExpr] = None, res = True) -> Edge:
+        e = Edge(src, dst, cond, res)
+        src.succs.append(e)
+        dst.preds.append(e)
+        return e
+
+    def _build(self, C: Cmd, cur: BasicBlock) -> BasicBlock:
+        # recursion is only as deep as the nesting of IfThenElse and While
+        for c in flatten_seq(C):
+            if isinstance(c, Skip):
+                continue
+            elif isinstance(c, (Assign, Input)):
+                cur.stmts.append(c)
+            elif isinstance(c, IfThenElse):
+                then_ = self.new_block()
+                self.add_edge(cur, then_, c.cond, True)
+                then_ = self._build(c.then_, then_)
+
+                else_ = self.new_block()
+                self.add_edge(cur, else_, c.cond, False)
+                else_ = self._build(c.else_, else_)
+
+                cur = self.new_block()
+                self.add_edge(then_, cur)
+                self.add_edge(else_, cur)
+            elif isinstance(c, While):
+                head = self.new_block(c)
+                self.add_edge(cur, head)
+
+                body = self.new_block()
+                self.add_edge(head, body, c.cond, True)
+                body = self._build(c.body, body)
+                self.add_edge(body, head)
+
+                cur = self.new_block()
+                self.add_edge(head, cur, c.cond, False)
+            else:
+                raise NotImplementedError(f"Don't know how to build a CFG for {type(c).__name__}({c})")
+
+        return cur
+
+    def __str__(self):
+        return "\n".join([str(b) for b in self.blocks])
+
+def build_cfg(C: Cmd) -> CFG:
+    return CFG(C)
+
+def test_build_cfg():
+    x = Var('x')
+    y = Var('y')
+
+    p = Program(sequence([Assign(x, 0),
+                          While(BoolExpr('<', x, 10),
+                                IfThenElse(BoolExpr('>', x, 5),
+                                           Assign(y, 1),
+                                           Skip())),
+                          Input(y)]))
+
+    g = build_cfg(p)
+    print(g)
+
+    assert len(g.blocks) == 7
+    assert [b.id for b in g.blocks if b.loop_head] == [1]
+    assert g.exit.stmts[0].var is y
+    assert len(g.blocks[1].preds) == 2
+
+    # forward edges go to higher numbered blocks, only back edges go to loop heads
+    for b in g.blocks:
+        for e in b.succs:
+            assert e.dst.id > b.id or e.dst.loop_head
+
+def test_flatten_seq():
+    x = Var('x')
+    n = 10000
+
+    s = Seq(Assign(x, 0), Skip())
+    for i in range(n):
+        s = Seq(s, Assign(x, i))
+
+    assert len(list(flatten_seq(s))) == n + 2
+
+if __name__ == "__main__":
+    test_flatten_seq()
+    test_build_cfg()
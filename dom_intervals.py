@@ -16,6 +16,8 @@
 # Note: this is still incomplete, and should throw NotImplementedErrors
 #
 
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
 import logging
 
 logger = logging.getLogger(__name__)
@@ -165,140 +167,175 @@ class IntervalPoint(object):
 
     __repr__ = __str__
 
-# TODO: Define an Interval type
+# Infinities are shared float sentinels, so that they compare and add
+# correctly against plain int bounds without any special casing.
+PINF = float("inf")
+NINF = float("-inf")
+
+_new = tuple.__new__
+
+class Interval(tuple):
+    """An immutable integer interval [lo, hi].
+
+    Bounds are ints, or the PINF/NINF sentinels. All empty intervals are
+    represented by the singleton BOT, so use interval() when the bounds
+    may cross.
+
+    This is a tuple, so that it is cheap to construct, hash and compare.
+    Hot paths construct it with _new(Interval, (lo, hi)), or make(),
+    which skip __new__.
+    """
+    __slots__ = ()
+
+    def __new__(cls, lo, hi):
+        return _new(cls, (lo, hi))
+
+    lo = property(itemgetter(0))
+    hi = property(itemgetter(1))
+
+    def __reduce__(self):
+        # keeps BOT a singleton across pickling
+        return (interval, (self.lo, self.hi))
+
+    def __str__(self):
+        if self is BOT: return "BOT"
+
+        lo = "-inf" if self.lo == NINF else self.lo
+        hi = "+inf" if self.hi == PINF else self.hi
+        return f"[{lo}, {hi}]"
+
+    __repr__ = __str__
+
+def make(lo, hi) -> Interval:
+    """Returns the interval [lo, hi], which must not be empty"""
+    return _new(Interval, (lo, hi))
+
+BOT = Interval(PINF, NINF)
+TOP = Interval(NINF, PINF)
+
+def interval(lo, hi) -> Interval:
+    """Returns the interval [lo, hi], or BOT if it is empty"""
+    if lo > hi or lo == PINF or hi == NINF: return BOT
+    return _new(Interval, (lo, hi))
 
 class IntervalsDomain(object):
-    PINF = IntervalPoint(IntervalPoint.PINF)
-    NINF = IntervalPoint(IntervalPoint.NINF)
-    BOT = "BOT"
-    TOP = (NINF, PINF)
+    PINF = PINF
+    NINF = NINF
+    BOT = BOT
+    TOP = TOP
     finite_height = False
 
+    def __init__(self, thresholds = ()):
+        # widen() stops at these values before going to infinity, see
+        # sem_abs.program_thresholds for a way to collect them
+        self.thresholds = tuple(sorted(set(thresholds)))
+
     def phi(self, v: int):
         """Returns an abstract element for a concrete element"""
-        return (IntervalPoint(v), IntervalPoint(v)) # this is the math interval [v, v]
+        return _new(Interval, (v, v)) # this is the math interval [v, v]
 
     # a best abstraction exists and is equal to phi
     alpha = phi
 
     def _norm(self, av):
-        if isinstance(av, tuple):
-            if av[1] == self.NINF: return self.BOT #  ..., -inf)
-            if av[0] == self.PINF: return self.BOT #  (+inf, ...
-
-            if av[0] > av[1]: return self.BOT
-
-        return av
+        # every Interval built by this domain is already normalised,
+        # this only catches ones built directly with crossing bounds
+        if av is BOT: return av
+        return interval(av.lo, av.hi)
 
     def refine(self, l, r):
-        l = self._norm(l)
-        r = self._norm(r)
+        if l is BOT: return r
+        if r is BOT: return l
 
-        if l == self.BOT: return r
-        if r == self.BOT: return l
+        new_start = l.lo if l.lo >= r.lo else r.lo
+        new_end = l.hi if l.hi <= r.hi else r.hi
 
-        new_start = max(l[0], r[0])
-        new_end = min(l[1], r[1])
-
-        return self._norm((new_start, new_end))
+        return interval(new_start, new_end)
 
     # it helps to think of abstract elements as sets, with lte
     # denoting set inclusion. So we're asking, is x included in y?
     def lte(self, x, y):
         # bot is always less than everything else
         # empty set {} is always included
-        x = self._norm(x)
-        y = self._norm(y)
-
-        if x is self.BOT: return True
-        if y is self.BOT: return False
-
-        # top is only lte
-        # top is all possible values, so it is only included in itself
-        if x == self.TOP:
-            return y == self.TOP
+        if x is BOT: return True
+        if y is BOT: return False
 
         # check if x is included in y
-        if x[0] >= y[0] and x[1] <= y[1]:
-            return True
-
-        return False
+        return x.lo >= y.lo and x.hi <= y.hi
 
     def lub(self, x, y):
         '''Least upper bound, the smallest set that includes both x and y'''
-        x = self._norm(x)
-        y = self._norm(y)
+        if x is BOT: return y
+        if y is BOT: return x
 
-        if self.lte(x, y): return y # y includes x
-        if self.lte(y, x): return x # x includes y
+        if x.lo >= y.lo and x.hi <= y.hi: return y # y includes x
+        if y.lo >= x.lo and y.hi <= x.hi: return x # x includes y
 
-        # note neither x nor y can be BOT at this point
+        new_left = x.lo if x.lo <= y.lo else y.lo
+        new_right = x.hi if x.hi >= y.hi else y.hi
 
-        new_left = min(x[0], y[0])
-        new_right = max(x[1], y[1])
+        return _new(Interval, (new_left, new_right))
 
-        return (new_left, new_right)
+    def _threshold_below(self, v):
+        i = bisect_right(self.thresholds, v)
+        return self.thresholds[i - 1] if i > 0 else NINF
 
-    def widen(self, x, y):
-        logger.debug(f"widen({x}, {y}")
+    def _threshold_above(self, v):
+        i = bisect_left(self.thresholds, v)
+        return self.thresholds[i] if i < len(self.thresholds) else PINF
 
+    def widen(self, x, y):
         # assume x is previous and y is current
+        if x is BOT: return y
+        if y is BOT: return x
 
-        # compute union
-        u = self.lub(x, y)
-        logger.debug(f"widen: u: {u}")
-
-        if u[0] == x[0]:
-            # stationary left
-            return (u[0], u[1] if u[1] == x[1] else self.PINF)
-        elif u[1] == x[1]:
-            # stationary right
-            return (u[0] if u[0] == x[0] else self.NINF, u[1])
-        else:
-            return u
-
-        assert False
+        # a bound that moved goes to the next threshold past it, each
+        # bound independently, so that widening always terminates
+        lo = x.lo if y.lo >= x.lo else self._threshold_below(y.lo)
+        hi = x.hi if y.hi <= x.hi else self._threshold_above(y.hi)
 
-    def f_binop(self, op, left, right):
-        def add(x, y):
-            return (x[0] + y[0], x[1] + y[1])
+        if lo == x.lo and hi == x.hi: return x
+        return _new(Interval, (lo, hi))
 
-        def sub(x, y):
-            a = x[0] - y[1]   # smallest of first interval - largest of second interval
-            b = x[1] - y[0]   # largest of first interval - smallest of second interval
+    def narrow(self, x, y):
+        '''Improves x, a result of widening, using y = F(x).
 
-            assert a <= b, f"{a}, {b}"
-            return (a, b)
+        This is the meet of x and y, so it does not terminate by itself,
+        callers must bound the number of narrowing steps.'''
+        if x is BOT or y is BOT: return BOT
 
-        def carry_out_op(op):
-            if left == self.BOT or right == self.BOT:
-                return self.BOT
+        lo = x.lo if x.lo >= y.lo else y.lo
+        hi = x.hi if x.hi <= y.hi else y.hi
+        if lo == x.lo and hi == x.hi: return x
 
-            return op(left, right)
+        return interval(lo, hi)
 
-        left = self._norm(left)
-        right = self._norm(right)
+    def f_binop(self, op, left, right):
+        if left is BOT or right is BOT:
+            return BOT
 
+        # bounds of non-empty intervals are never -inf + +inf, so
+        # these never produce NaNs
         if op == '+':
-            return carry_out_op(lambda x, y: add(x, y))
+            return _new(Interval, (left.lo + right.lo, left.hi + right.hi))
         elif op == '-':
-            return carry_out_op(lambda x, y: sub(x, y))
+            # smallest of first interval - largest of second interval,
+            # largest of first interval - smallest of second interval
+            return _new(Interval, (left.lo - right.hi, left.hi - right.lo))
         else:
             raise NotImplementedError(f'Operator {op}')
 
     def f_cmpop(self, op, left, c):
-        left = self._norm(left)
-        c = self._norm(c)
-
         # assume integers
+        k = c.lo
         if op == '<':
-            return (self.NINF, c[0] - 1), (c[0], self.PINF)
+            return _new(Interval, (NINF, k - 1)), _new(Interval, (k, PINF))
         elif op == '<=':
-            return (self.NINF, c[0]), (c[0] + 1, self.PINF)
+            return _new(Interval, (NINF, k)), _new(Interval, (k + 1, PINF))
         elif op == '>':
-            return (c[0] + 1, self.PINF), (self.NINF, c[0])
+            return _new(Interval, (k + 1, PINF)), _new(Interval, (NINF, k))
         elif op == '>=':
-            return (c[0], self.PINF), (self.NINF, c[0] - 1)
+            return _new(Interval, (k, PINF)), _new(Interval, (NINF, k - 1))
         else:
             raise NotImplementedError(f'Operator {op}')
 
@@ -320,6 +357,58 @@ def test_IntervalPoint():
     assert min(ninf, x) == ninf
     assert max(y, pinf) == pinf
 
+def test_Interval():
+    a = interval(1, 5)
+    assert a == Interval(1, 5)
+    assert hash(a) == hash(Interval(1, 5))
+    assert interval(5, 1) is BOT
+    assert interval(PINF, PINF) is BOT
+
+    try:
+        a.lo = 0
+        assert False, "Interval should be immutable"
+    except AttributeError:
+        pass
+
+    import pickle
+    assert pickle.loads(pickle.dumps(BOT)) is BOT
+    assert pickle.loads(pickle.dumps(a)) == a
+    assert str(TOP) == "[-inf, +inf]"
+
+def test_IntervalsDomain():
+    d = IntervalsDomain()
+
+    assert d.lub(d.phi(1), d.phi(5)) == interval(1, 5)
+    assert d.lub(BOT, d.phi(1)) == d.phi(1)
+    assert d.lte(d.phi(3), interval(1, 5))
+    assert not d.lte(TOP, interval(1, 5))
+    assert d.refine(interval(1, 5), interval(3, 9)) == interval(3, 5)
+    assert d.refine(interval(1, 2), interval(3, 9)) is BOT
+
+    assert d.f_binop('+', interval(1, 5), TOP) == TOP
+    assert d.f_binop('-', interval(1, 5), interval(0, 2)) == interval(-1, 5)
+    assert d.f_binop('+', BOT, TOP) is BOT
+
+    assert d.widen(interval(0, 1), interval(0, 2)) == interval(0, PINF)
+    assert d.widen(interval(0, 1), interval(-1, 1)) == interval(NINF, 1)
+    assert d.widen(interval(0, 1), interval(-1, 2)) == TOP
+    assert d.widen(interval(0, 5), interval(1, 3)) == interval(0, 5)
+    assert d.narrow(interval(0, PINF), interval(0, 100)) == interval(0, 100)
+    assert d.narrow(interval(0, PINF), BOT) is BOT
+
+    dt = IntervalsDomain([10, 0, 100, 10])
+    assert dt.thresholds == (0, 10, 100)
+    assert dt.widen(interval(0, 1), interval(0, 2)) == interval(0, 10)
+    assert dt.widen(interval(0, 10), interval(0, 11)) == interval(0, 100)
+    assert dt.widen(interval(0, 100), interval(0, 101)) == interval(0, PINF)
+    assert dt.widen(interval(5, 6), interval(-3, 6)) == interval(NINF, 6)
+    assert dt.widen(interval(5, 6), interval(3, 6)) == interval(0, 6)
+
+    t, f = d.f_cmpop('<', TOP, d.phi(7))
+    assert t == interval(NINF, 6) and f == interval(7, PINF)
+
 
 if __name__ == "__main__":
     test_IntervalPoint()
+    test_Interval()
+    test_IntervalsDomain()
@@ -10,21 +10,103 @@
 # copyright and related or neighboring rights to dom_signs.py. This
 # work is published from: United States.
 #
-# Note: This is still incomplete, but should throw NotImplementedErrors
+# Abstract values are small ints, bitmasks over the signs of the
+# values they contain: NEG (< 0), ZERO (= 0) and POS (> 0). The
+# lattice is BOT < EQZ < LTZ, GTZ < TOP, where LTZ is <= 0 and GTZ is
+# >= 0. Other masks, such as NEG alone, are not elements, and results
+# that would be one are rounded up to the smallest element containing
+# them. lub and meet are then | and &, and lte is a single comparison.
 #
+# The transfer functions are lookup tables, built once when this
+# module is imported from the signs of small sample values.
+#
+from typing import Iterator, List, Mapping as MappingType, Tuple
+from collections.abc import Mapping
+from abs_memory import Layout
 import logging
 
 logger = logging.getLogger(__name__)
 
-#TODO: this is really a static class/enum?
+NEG = 1
+ZERO = 2
+POS = 4
+
+# values whose signs cover every ordering of values of the same sign
+_SAMPLES = {NEG: (-3, -2, -1), ZERO: (0,), POS: (1, 2, 3)}
+
+# the smallest element that contains each mask
+_ROUND = (0, NEG | ZERO, ZERO, NEG | ZERO, ZERO | POS, NEG | ZERO | POS, ZERO | POS, NEG | ZERO | POS)
+
+def _sign(v: int) -> int:
+    return ZERO if v == 0 else (POS if v > 0 else NEG)
+
+def _atoms(mask: int) -> List[int]:
+    return [a for a in (NEG, ZERO, POS) if mask & a]
+
+def _binop_table(f) -> Tuple[Tuple[int, ...], ...]:
+    # f returns None when it is undefined, as for division by zero
+    out = []
+    for l in range(8):
+        row = []
+        for r in range(8):
+            mask = 0
+            for a in _atoms(l):
+                for b in _atoms(r):
+                    for x in _SAMPLES[a]:
+                        for y in _SAMPLES[b]:
+                            v = f(x, y)
+                            if v is not None: mask |= _sign(v)
+
+            row.append(_ROUND[mask])
+
+        out.append(tuple(row))
+
+    return tuple(out)
+
+def _cmpop_table(f) -> Tuple[Tuple[int, int], ...]:
+    # for each abstract constant, the signs for which the comparison
+    # can be true and can be false. These are not rounded, refine
+    # rounds their meet with the variable's value.
+    out = []
+    for c in range(8):
+        true, false = 0, 0
+        for a in (NEG, ZERO, POS):
+            for b in _atoms(c):
+                for x in _SAMPLES[a]:
+                    for y in _SAMPLES[b]:
+                        if f(x, y):
+                            true |= a
+                        else:
+                            false |= a
+
+        out.append((true, false))
+
+    return tuple(out)
+
+BINOPS = {'+': _binop_table(lambda x, y: x + y),
+          '-': _binop_table(lambda x, y: x - y),
+          '*': _binop_table(lambda x, y: x * y),
+          '/': _binop_table(lambda x, y: x // y if y != 0 else None)}
+
+CMPOPS = {'<': _cmpop_table(lambda x, y: x < y),
+          '<=': _cmpop_table(lambda x, y: x <= y),
+          '>': _cmpop_table(lambda x, y: x > y),
+          '>=': _cmpop_table(lambda x, y: x >= y),
+          '==': _cmpop_table(lambda x, y: x == y),
+          '!=': _cmpop_table(lambda x, y: x != y)}
+
+REFINE = tuple([tuple([_ROUND[l & r] for r in range(8)]) for l in range(8)])
+
 class SignsDomain(object):
-    LTZ = "[<= 0]"
-    GTZ = "[>= 0]"
-    EQZ = "[= 0]"
-    TOP = "TOP"
-    BOT = "BOT"
+    LTZ = NEG | ZERO
+    GTZ = ZERO | POS
+    EQZ = ZERO
+    TOP = NEG | ZERO | POS
+    BOT = 0
     finite_height = True
 
+    NAMES = {LTZ: "[<= 0]", GTZ: "[>= 0]", EQZ: "[= 0]", TOP: "TOP", BOT: "BOT"}
+
     def phi(self, v: int):
         """Returns an abstract element for a concrete element"""
         if v == 0:
@@ -42,81 +124,198 @@ class SignsDomain(object):
     # it helps to think of abstract elements as sets, with lte
     # denoting set inclusion. So we're asking, is x included in y?
     def lte(self, x, y):
-        # bot is always less than everything else
-        # empty set {} is always included
-        if x == self.BOT: return True
+        return x | y == y
 
-        # top is only lte
-        # top is all possible values, so it is only included in itself
-        if x == self.TOP:
-            if y != self.TOP: return False
-            return True
+    def lub(self, x, y):
+        '''Least upper bound, the smallest set that includes both x and y'''
+        return x | y
 
-        # eqz is the set {0}, which is included in all sets (>=0, <=0) except {}
-        if x == self.EQZ:
-            if y == self.BOT: return False
-            return True
+    def meet(self, x, y):
+        '''Greatest lower bound, the largest set included in both x and y'''
+        return x & y
 
-        if x == self.LTZ or x == self.GTZ:
-            if y == x: return True
-            if y == self.TOP: return True
+    def f_binop(self, op, left, right):
+        table = BINOPS.get(op)
+        if table is None: raise NotImplementedError(f'Operator {op}')
 
-            # these sets are not included in {0} or {} or {>=0} [resp. {<=0}]
-            return False
+        return table[left][right]
 
-    def lub(self, x, y):
-        '''Least upper bound, the smallest set that includes both x and y'''
+    def refine(self, l, r):
+        return REFINE[l][r]
 
-        if self.lte(x, y): return y # y includes x
-        if self.lte(y, x): return x # x includes y
+    def f_cmpop(self, op, left, c):
+        """Returns the signs of the values for which op against c can be
+        true, and those for which it can be false, for refine"""
+        table = CMPOPS.get(op)
+        if table is None: raise NotImplementedError(f'Operator {op}')
 
-        # if incomparable, then we return T
-        return self.TOP
+        return table[c]
 
-    def f_binop(self, op, left, right):
-        if op == '+':
-            return self.lub(left, right)
-        elif op == '*':
-            if left != right:
-                return self.lub(left, right)
-            elif left == self.LTZ:
-                return self.GTZ  # - * - = +
-            elif left == self.GTZ:
-                return self.GTZ  # + * + = +
-        elif op == '-':
-            if left == right:
-                if left != self.EQZ and left != self.BOT:
-                    return self.TOP
-
-                return left # {0} - {0} => {0}, {} - {} => {}
-            else:
-                return left   # {+ve} - {-ve} => positive, {-ve} - {+ve} => {-ve}
+    def name(self, v) -> str:
+        return self.NAMES.get(v, f"<mask {v}>")
 
-        else:
-            raise NotImplementedError(f'Operator {op}')
+def _or(a: bytes, b: bytes) -> bytes:
+    n = max(len(a), len(b))
+    return (int.from_bytes(a, 'little') | int.from_bytes(b, 'little')).to_bytes(n, 'little')
 
-    def refine(self, l, r):
-        if self.lte(l, r): return l
-        if self.lte(r, l): return r
+def _and(a: bytes, b: bytes) -> bytes:
+    n = max(len(a), len(b))
+    return (int.from_bytes(a, 'little') & int.from_bytes(b, 'little')).to_bytes(n, 'little')
 
-        return self.TOP
+class SignsVector(Mapping):
+    """An immutable memory of signs over the variables of a Layout, as
+    one byte per variable.
 
-    def f_cmpop(self, op, left, c):
-        # (abst of c, op) : (variable's true domain, variables false domain)
-        abs_results = {(self.EQZ, '<'): (self.LTZ, self.GTZ),
-                       (self.EQZ, '<='): (self.LTZ, self.GTZ),
-                       (self.EQZ, '>'): (self.GTZ, self.LTZ),
-                       (self.EQZ, '>='): (self.GTZ, self.LTZ),
-                       (self.EQZ, '!='): (self.TOP, self.EQZ),
-
-                       (self.GTZ, '>'): (self.GTZ, self.TOP),
-                       (self.GTZ, '<'): (self.TOP, self.GTZ),
-                       (self.GTZ, '<='): (self.TOP, self.GTZ),
-                       (self.GTZ, '>='): (self.GTZ, self.TOP),
-                       }
-
-        key = (c, op)
-        if key not in abs_results:
-            raise NotImplementedError(f"{key} not implemented")
-
-        return abs_results[key]
+    Joins, meets and inclusion over all variables are single big-int
+    operations on the bytes, rather than a loop over the variables.
+    Variables whose byte is BOT are still keys of the mapping, like
+    variables set to BOT in a PersistentMemory.
+    """
+    __slots__ = ('layout', 'data')
+
+    def __init__(self, layout: Layout, data: bytes):
+        self.layout = layout
+        self.data = data
+
+    @classmethod
+    def from_memory(cls, m: MappingType[str, int], layout: Layout = None) -> 'SignsVector':
+        """Returns m, a mapping of variables to signs, as a vector"""
+        if layout is None: layout = Layout(tuple(sorted(m)))
+        for x in m:
+            if x not in layout.index: layout = layout.extend(x)
+
+        return cls(layout, bytes([m.get(x, SignsDomain.BOT) for x in layout.names]))
+
+    def __getitem__(self, x):
+        i = self.layout.index[x]
+        return self.data[i] if i < len(self.data) else SignsDomain.BOT
+
+    def __len__(self):
+        return len(self.layout.names)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.layout.names)
+
+    def set(self, x: str, v: int) -> 'SignsVector':
+        layout = self.layout
+        i = layout.index.get(x)
+        if i is None:
+            layout = layout.extend(x)
+            i = len(layout.names) - 1
+
+        data = self.data.ljust(i + 1, b"\0")
+        return SignsVector(layout, data[:i] + bytes([v]) + data[i + 1:])
+
+    def align(self, other: 'SignsVector') -> Tuple['SignsVector', 'SignsVector']:
+        """Returns self and other over one layout"""
+        if self.layout.covers(other.layout): return self, SignsVector(self.layout, other.data)
+        if other.layout.covers(self.layout): return SignsVector(other.layout, self.data), other
+
+        layout = self.layout.union(other.layout)
+        return SignsVector.from_memory(self, layout), SignsVector.from_memory(other, layout)
+
+    def lub(self, other: 'SignsVector') -> 'SignsVector':
+        a, b = self.align(other)
+        return SignsVector(a.layout, _or(a.data, b.data))
+
+    def meet(self, other: 'SignsVector') -> 'SignsVector':
+        a, b = self.align(other)
+        return SignsVector(a.layout, _and(a.data, b.data))
+
+    def lte(self, other: 'SignsVector') -> bool:
+        a, b = self.align(other)
+        ib = int.from_bytes(b.data, 'little')
+        return int.from_bytes(a.data, 'little') | ib == ib
+
+    def diff(self, other: 'SignsVector') -> List[str]:
+        """Returns the variables whose signs differ"""
+        a, b = self.align(other)
+        n = max(len(a.data), len(b.data))
+        d = (int.from_bytes(a.data, 'little') ^ int.from_bytes(b.data, 'little')).to_bytes(n, 'little')
+        return [a.layout.names[i] for i, c in enumerate(d) if c]
+
+    def __eq__(self, other):
+        if self is other: return True
+        if isinstance(other, SignsVector):
+            a, b = self.align(other)
+            return a.data.rstrip(b"\0") == b.data.rstrip(b"\0")
+        elif isinstance(other, Mapping):
+            return dict(self.items()) == dict(other.items())
+
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        # trailing BOTs, which a longer layout adds, don't change it
+        return hash(self.data.rstrip(b"\0"))
+
+    def __repr__(self):
+        d = SignsDomain()
+        return "{" + ", ".join([f"{x!r}: {d.name(v)}" for x, v in self.items()]) + "}"
+
+def test_SignsDomain():
+    d = SignsDomain()
+    elements = [d.BOT, d.EQZ, d.LTZ, d.GTZ, d.TOP]
+    assert d.lub(d.LTZ, d.GTZ) == d.TOP and d.lub(d.EQZ, d.LTZ) == d.LTZ and d.meet(d.LTZ, d.GTZ) == d.EQZ
+    assert d.lte(d.BOT, d.EQZ) and d.lte(d.EQZ, d.GTZ) and not d.lte(d.LTZ, d.GTZ) and not d.lte(d.TOP, d.LTZ)
+
+    def concrete(a):
+        return [v for v in range(-4, 5) if d.lte(d.phi(v), a)]
+
+    # the tables are sound, and closed over the elements
+    for op in BINOPS:
+        for a in elements:
+            for b in elements:
+                out = d.f_binop(op, a, b)
+                assert out in elements
+                for x in concrete(a):
+                    for y in concrete(b):
+                        if op == '/' and y == 0: continue
+                        v = eval(f"x {'//' if op == '/' else op} y")
+                        assert d.lte(d.phi(v), out), (op, a, b, x, y)
+
+    for op in CMPOPS:
+        for c in range(-3, 4):
+            for a in elements:
+                true, false = d.f_cmpop(op, a, d.phi(c))
+                t, f = d.refine(a, true), d.refine(a, false)
+                for x in concrete(a):
+                    assert d.lte(d.phi(x), t if eval(f"x {op} c") else f), (op, c, a, x)
+
+    # 0 - 5 is negative, which this used to find to be 0
+    assert d.f_binop('-', d.EQZ, d.GTZ) == d.LTZ
+    # x >= 0 and x < 0 is empty, and x < 5 keeps x >= 0
+    assert d.refine(d.GTZ, d.f_cmpop('<', d.GTZ, d.phi(0))[0]) == d.BOT
+    assert d.refine(d.GTZ, d.f_cmpop('<', d.GTZ, d.phi(5))[0]) == d.GTZ
+
+    try:
+        d.f_binop('%', d.TOP, d.TOP)
+        assert False
+    except NotImplementedError:
+        pass
+
+def test_SignsVector():
+    d = SignsDomain()
+    a = SignsVector.from_memory({'x': d.LTZ, 'y': d.EQZ})
+    b = a.set('z', d.GTZ)
+    assert b.layout.covers(a.layout) and b['z'] == d.GTZ and a.get('z') is None
+    assert a.lub(b) == {'x': d.LTZ, 'y': d.EQZ, 'z': d.GTZ} and a.lte(b) and not b.lte(a)
+    assert a.meet(b) == a and hash(a.meet(b)) == hash(a)
+    assert b.set('x', d.GTZ).diff(b) == ['x']
+
+    # other layouts are aligned by name
+    c = SignsVector.from_memory({'z': d.LTZ, 'w': d.GTZ, 'x': d.GTZ})
+    assert c.lub(b) == {'x': d.TOP, 'y': d.EQZ, 'z': d.TOP, 'w': d.GTZ}
+    assert not c.lte(b) and c.lte(c.lub(b)) and b.lte(c.lub(b))
+
+    names = [f"v{i}" for i in range(5000)]
+    big = SignsVector.from_memory(dict([(x, d.phi(i % 3 - 1)) for i, x in enumerate(names)]))
+    other = big.set('v7', d.TOP)
+    assert big.lub(other)['v7'] == d.TOP and big.lte(other) and big.diff(other) == ['v7']
+
+if __name__ == "__main__":
+    test_SignsDomain()
+    test_SignsVector()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+#
+# proggen.py
+#
+# Generators of synthetic programs and input memories, for benchmarks
+# and tests.
+#
+# Every generator is deterministic for a given seed. The programs only
+# use + and -, and all their loops count up to a bound, so they
+# terminate under sem.evaluate_Cmd and their values stay small.
+# Conditions compare with constants >= 0, which SignsDomain supports.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to proggen.py. This work
+# is published from: United States.
+
+from typing import Dict, List, Tuple
+from tinyast import *
+from sem_compile import program_variables
+import random
+
+Memory = Dict[str, int]
+
+def variables(n: int, prefix: str = "v") -> List[Var]:
+    return [Var(f"{prefix}{i}") for i in range(n)]
+
+def _expr(rng: random.Random, vs: List[Var], size: int) -> Expr:
+    """Returns a random expression with size binary operators"""
+    e: Expr = rng.choice(vs)
+    for _ in range(size):
+        other = rng.choice(vs) if rng.random() < 0.5 else rng.randint(-10, 10)
+        op = rng.choice(['+', '-'])
+        e = BinOp(op, e, other) if rng.random() < 0.5 else BinOp(op, other, e)
+
+    return e
+
+def straight_line(n: int, nvars: int = 4, expr_size: int = 2, seed: int = 0) -> Program:
+    """Returns n random assignments to nvars variables"""
+    rng = random.Random(seed)
+    vs = variables(nvars)
+
+    return Program(sequence([Assign(rng.choice(vs), _expr(rng, vs, expr_size)) for _ in range(n)]))
+
+def many_variables(nvars: int, seed: int = 0) -> Program:
+    """Returns one assignment to each of nvars variables, each reading
+    the ones assigned before it"""
+    rng = random.Random(seed)
+    vs = variables(nvars)
+
+    cmds: List[Cmd] = [Assign(vs[0], 1)]
+    for i in range(1, nvars):
+        cmds.append(Assign(vs[i], BinOp('+', vs[rng.randrange(i)], rng.randint(-10, 10))))
+
+    return Program(sequence(cmds))
+
+def nested_ifs(depth: int, nvars: int = 4, seed: int = 0) -> Program:
+    """Returns depth IfThenElses, each nested in the then branch of the
+    one before"""
+    rng = random.Random(seed)
+    vs = variables(nvars)
+
+    body: Cmd = Assign(rng.choice(vs), _expr(rng, vs, 1))
+    for _ in range(depth):
+        body = IfThenElse(BoolExpr(rng.choice(['<', '>', '<=', '>=']), rng.choice(vs), rng.randint(0, 50)),
+                          Seq(Assign(rng.choice(vs), _expr(rng, vs, 1)), body),
+                          Assign(rng.choice(vs), _expr(rng, vs, 1)))
+
+    return Program(body)
+
+def nested_loops(depth: int, bound: int = 10) -> Tuple[Program, Memory]:
+    """Returns depth nested counting loops, each running bound times,
+    and a memory to run them from"""
+    xs = variables(depth, "x")
+
+    body: Cmd = Skip()
+    for x in reversed(xs):
+        body = sequence([Assign(x, 0),
+                         While(BoolExpr('<', x, bound),
+                               Seq(body, Assign(x, BinOp('+', x, 1))))])
+
+    return Program(body), dict([(x.name, 0) for x in xs])
+
+def memories(names: List[str], size: int, lo: int = -100, hi: int = 100, seed: int = 0) -> List[Memory]:
+    """Returns size memories over names, with values in [lo, hi]"""
+    rng = random.Random(seed)
+    return [dict([(n, rng.randint(lo, hi)) for n in names]) for _ in range(size)]
+
+def test_generators():
+    import sem
+    import abstractions
+    from sem_abs import evaluate_Cmd_abs
+
+    programs = [straight_line(50), straight_line(50, expr_size = 5, seed = 3), many_variables(30),
+                nested_ifs(20), nested_loops(3, 4)[0]]
+
+    # deterministic
+    assert str(straight_line(50)) == str(programs[0]) and str(straight_line(50, seed = 1)) != str(programs[0])
+    assert str(nested_ifs(20)) == str(programs[3])
+    assert len(memories(['a', 'b'], 10)) == 10 and memories(['a'], 5, seed = 2) == memories(['a'], 5, seed = 2)
+
+    nra = abstractions.NonRelationalAbstraction(abstractions.IntervalsDomain())
+    for p in programs:
+        M = memories(program_variables(p), 20)
+        out = sem.evaluate_Cmd(p, M)
+        assert len(out) > 0
+        assert nra.included(out, evaluate_Cmd_abs(p, nra.phi(M), nra))
+
+if __name__ == "__main__":
+    test_generators()
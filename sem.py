@@ -13,13 +13,24 @@
 # copyright and related or neighboring rights to sem.py. This work
 # is published from: United States.
 
-from typing import Dict, List
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 from tinyast import *
 import random
+import operator
 import logging
+import warnings
 
 logger = logging.getLogger(__name__)
 
+# The values that every Input takes, as a sequence, or as a dict of
+# sequences by variable. If None, an Input picks one random value from
+# 0 to 100 for all memories. See sem_enum.py.
+input_domain: Optional[Union[Sequence[int], Dict[str, Sequence[int]]]] = None
+
+def input_values(domain, name: str) -> Sequence[int]:
+    """Returns the values that an Input of name takes in domain"""
+    return domain[name] if isinstance(domain, dict) else domain
+
 # map of variables (here str, instead of Var) -> values
 #TODO: we could use var if we defined hash to be on the name of Var?
 Memory = Dict[str, int]
@@ -36,6 +47,12 @@ def f_binop(op: BinaryOps, left: Scalar, right: Scalar) -> Scalar:
     else:
         raise NotImplementedError(f"Unknown operator: {op}")
 
+CMPOPS = {'<': operator.lt,
+          '>': operator.gt,
+          '<=': operator.le,
+          '>=': operator.ge,
+          '!=': operator.ne}
+
 def f_cmpop(op: ComparisonOps, left: Scalar, right: Scalar) -> bool:
     if op == '<':
         return left < right
@@ -70,72 +87,315 @@ def filter_memory(B: BoolExpr, M: List[Memory], res = True) -> List[Memory]:
 
 
 def union_memories(M0: List[Memory], M1: List[Memory]) -> List[Memory]:
-    # this is, of course, ridiculous
+    return MemorySet.from_memories(M0).union(MemorySet.from_memories(M1)).to_memories()
+
+# A memory stored as a tuple of values, in the order of the variables
+# of the MemorySet that contains it. Variables that a memory does not
+# define are None.
+Row = Tuple[Optional[int], ...]
+
+class MemorySet(object):
+    """A set of memories over an ordered tuple of variables.
+
+    Memories are stored as hashable rows, in insertion order, and are
+    only turned into dicts by to_memories().
+
+    A set is laid out by a SymbolTable if the table's variables are a
+    prefix of its own. The value of a Var interned in that table is then
+    row[var.slot], without looking up its name, once the name at that
+    slot is checked. Operations on a set
+    only ever append variables, so they keep its layout.
+    """
+
+    def __init__(self, variables: Sequence[str], rows: Iterable[Row] = (), symbols: SymbolTable = None):
+        self.variables = tuple(variables)
+        self.index = dict([(x, i) for i, x in enumerate(self.variables)])
+        self.rows: Dict[Row, None] = dict.fromkeys(rows)
+        self.symbols: Optional[SymbolTable] = None
+        if symbols is not None and self.variables[:len(symbols)] == tuple(symbols.names):
+            self.symbols = symbols
+
+    @classmethod
+    def from_memories(cls, M: Iterable[Memory], symbols: SymbolTable = None) -> 'MemorySet':
+        """Returns the set of memories M, laid out by symbols if given"""
+        M = list(M)
+        variables: Dict[str, None] = dict.fromkeys(symbols.names) if symbols is not None else {}
+        for m in M:
+            variables.update(dict.fromkeys(m))
 
-    # convert everything to sets
-    M0_set = set([frozenset(m.items()) for m in M0])
-    M1_set = set([frozenset(m.items()) for m in M1])
+        return cls(variables, [tuple([m.get(x) for x in variables]) for m in M], symbols)
 
-    M_set = M0_set.union(M1_set)
+    def laid_out(self, symbols: Optional[SymbolTable]) -> 'MemorySet':
+        """Returns this set laid out by symbols, or by no table if None"""
+        if self.symbols is symbols: return self
 
-    # convert back to lists of dicts
-    return list([dict(m) for m in M_set])
+        out = MemorySet(self.variables)
+        out.rows = dict(self.rows)
+        if symbols is not None:
+            out = out.reorder(tuple(symbols.names) + tuple([x for x in self.variables if x not in symbols]))
+            out.symbols = symbols
 
-# M is a set of memory states, it belongs to Powerset(Memory)
-# We're using List, because set would choke on Dict and we don't have a frozendict type...
-def evaluate_Cmd(C: Cmd, M: List[Memory]) -> List[Memory]:
-    def update_memories(var, value_lambda):
-        out = []
-        for m in M:
-            # not sure using dicts is gaining us anything when we're copying dicts around...
-            m_out = dict(m)
-            m_out[var] = value_lambda(m)
-            out.append(m_out)
+        return out
+
+    def to_memories(self) -> List[Memory]:
+        return [dict([(x, v) for x, v in zip(self.variables, row) if v is not None])
+                for row in self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __contains__(self, row):
+        return row in self.rows
+
+    def __eq__(self, other):
+        if not isinstance(other, MemorySet): return NotImplemented
+
+        if self.variables != other.variables:
+            if set(self.variables) != set(other.variables): return False
+            other = other.reorder(self.variables)
+
+        return self.rows.keys() == other.rows.keys()
+
+    def __str__(self):
+        return str(self.to_memories())
+
+    __repr__ = __str__
+
+    def add(self, row: Row) -> bool:
+        """Adds row, returns True if it was not already present"""
+        if row in self.rows: return False
+        self.rows[row] = None
+        return True
+
+    def reorder(self, variables: Sequence[str]) -> 'MemorySet':
+        """Returns this set over variables, a superset of self.variables"""
+        variables = tuple(variables)
+        if variables == self.variables: return self
+
+        pos = [self.index.get(x) for x in variables]
+        return MemorySet(variables,
+                         [tuple([None if i is None else row[i] for i in pos]) for row in self.rows],
+                         self.symbols)
+
+    def update(self, other: 'MemorySet') -> List[Row]:
+        """In-place union, returns the rows of other that were new"""
+        if other.variables != self.variables:
+            extra = [x for x in other.variables if x not in self.index]
+            if extra:
+                extended = self.reorder(self.variables + tuple(extra))
+                self.variables, self.index, self.rows = extended.variables, extended.index, extended.rows
+                self.symbols = extended.symbols
+
+            other = other.reorder(self.variables)
+
+        rows = self.rows
+        new = [row for row in other.rows if row not in rows]
+        rows.update(dict.fromkeys(new))
+        return new
+
+    def union(self, other: 'MemorySet') -> 'MemorySet':
+        out = MemorySet(self.variables, symbols = self.symbols)
+        out.rows = dict(self.rows)
+        out.update(other)
+        return out
+
+    def filter(self, B: BoolExpr, res = True) -> 'MemorySet':
+        i = self.index.get(B.left.name)
+        if i is None and len(self.rows): raise KeyError(B.left.name)
+
+        if B.op not in CMPOPS:
+            raise NotImplementedError(f"Unknown comparison operator: {B.op}")
+
+        cmpop, c = CMPOPS[B.op], B.right
+        out = MemorySet(self.variables, symbols = self.symbols)
+        out.rows = dict([(row, None) for row in self.rows if cmpop(_defined(row[i], B.left.name), c) == res])
+        return out
+
+    def assign(self, var: str, value: Callable[[Row], int]) -> 'MemorySet':
+        i = self.index.get(var)
+        if i is None:
+            out = MemorySet(self.variables + (var,), symbols = self.symbols)
+            out.rows = dict.fromkeys([row + (value(row),) for row in self.rows])
+        else:
+            out = MemorySet(self.variables, symbols = self.symbols)
+            out.rows = dict.fromkeys([row[:i] + (value(row),) + row[i+1:] for row in self.rows])
 
         return out
 
+def _defined(v, name):
+    if v is None: raise KeyError(name)
+    return v
+
+def evaluate_Expr_row(E: Expr, row: Row, index: Dict[str, int]) -> Scalar:
+    """Evaluates E in a memory stored as a row of a MemorySet"""
+    if isinstance(E, Scalar):
+        return E
+    elif isinstance(E, Var):
+        return _defined(row[index[E.name]], E.name)
+    elif isinstance(E, BinOp):
+        return f_binop(E.op,
+                       evaluate_Expr_row(E.left, row, index),
+                       evaluate_Expr_row(E.right, row, index))
+
+def evaluate_Expr_slots(E: Expr, row: Row, variables: Tuple[str, ...], index: Dict[str, int]) -> Scalar:
+    """Evaluates E in a row of a MemorySet laid out by a SymbolTable.
+    A Var is read at its slot if the set has it there, and by name if it
+    was interned in another table since."""
+    if isinstance(E, Scalar):
+        return E
+    elif isinstance(E, Var):
+        i = E.slot
+        if i is None or i >= len(variables) or variables[i] != E.name: i = index[E.name]
+        return _defined(row[i], E.name)
+    elif isinstance(E, BinOp):
+        return f_binop(E.op,
+                       evaluate_Expr_slots(E.left, row, variables, index),
+                       evaluate_Expr_slots(E.right, row, variables, index))
+
+class NonTerminationWarning(UserWarning):
+    """Some memories that entered a loop never leave it. They are in
+    states, as memories, and are left out of the loop's result."""
+    def __init__(self, loop: While, states: List[Memory]):
+        super().__init__(f"{len(states)} memories never leave while({loop.cond}): {states[:3]}"
+                         + (" ..." if len(states) > 3 else ""))
+        self.loop = loop
+        self.states = states
+
+# the prefix of the column that tags each memory a loop body runs on
+# with its id. It is not a valid variable name, so no program can read
+# or assign it.
+_SOURCE = '#source'
+
+def evaluate_While(C: While, M: MemorySet) -> MemorySet:
+    """Evaluates C semi-naively: the body only runs on memories that the
+    loop has not seen before, so every memory in the loop is visited once,
+    and a memory that the loop reaches twice does not hang it.
+
+    The body runs on memories tagged with their ids, so that the
+    memories it leads to can be traced back to them. If some memories
+    are reached twice, memories that cannot reach the exit are reported
+    with a NonTerminationWarning.
+    """
+    if C.cond.op not in CMPOPS:
+        raise NotImplementedError(f"Unknown comparison operator: {C.cond.op}")
+
+    name, cmpop, c = C.cond.left.name, CMPOPS[C.cond.op], C.cond.right
+    frontier = M.filter(C.cond)
+    out = M.filter(C.cond, res = False)
+
+    # every memory that entered the loop, with its id
+    variables = frontier.variables
+    ids = dict([(row, i) for i, row in enumerate(frontier.rows)])
+
+    edges: List[Tuple[int, int]] = []
+    exits: Dict[int, None] = {}  # ids of memories that leave the loop after one iteration
+    revisited = False
+    tag = f"{_SOURCE}{id(C)}" # a loop nested in the body has its own column
+    debug = logger.isEnabledFor(logging.DEBUG) # these print every memory
+    while len(frontier):
+        if debug: logger.debug(f"pre_iter_memories: {frontier}")
+        after = evaluate_Cmd(C.body, frontier.assign(tag, ids.__getitem__))
+        if debug: logger.debug(f"after_iter_memories: {after}")
+
+        # the tag is after the variables of the frontier, and before
+        # those that the body added
+        j, k = after.index[tag], after.index.get(name)
+        if k is None and len(after): raise KeyError(name)
+        if len(after.variables) > j + 1:
+            extra = (None,) * (len(after.variables) - j - 1)
+            variables = after.variables[:j] + after.variables[j+1:]
+            ids = dict([(row + extra, i) for row, i in ids.items()])
+
+        new = []
+        leaving = []
+        for row in after.rows:
+            i, stripped = row[j], row[:j] + row[j+1:]
+            if cmpop(_defined(row[k], name), c):
+                dst = ids.get(stripped)
+                if dst is None:
+                    dst = ids[stripped] = len(ids)
+                    new.append(stripped)
+                else:
+                    revisited = True
+
+                edges.append((i, dst))
+            else:
+                exits[i] = None
+                leaving.append(stripped)
+
+        out.update(MemorySet(variables, leaving))
+        frontier = MemorySet(variables, new, M.symbols)
+
+    if revisited:
+        stuck = _nonterminating(len(ids), edges, exits)
+        if len(stuck):
+            rows = list(ids)
+            warnings.warn(NonTerminationWarning(C, MemorySet(variables, [rows[i] for i in stuck]).to_memories()),
+                          stacklevel = 2)
+
+    return out
+
+def _nonterminating(n: int, edges: List[Tuple[int, int]], exits: Dict[int, None]) -> List[int]:
+    """Returns the ids, out of n, that no path of edges leads from to an exit"""
+    preds: List[List[int]] = [[] for _ in range(n)]
+    for i, k in edges:
+        preds[k].append(i)
+
+    leaves = dict(exits)
+    stack = list(exits)
+    while len(stack):
+        for i in preds[stack.pop()]:
+            if i not in leaves:
+                leaves[i] = None
+                stack.append(i)
+
+    return [i for i in range(n) if i not in leaves]
+
+# M is a set of memory states, it belongs to Powerset(Memory). It is
+# either a MemorySet, or for convenience, a List of Memory, in which case
+# the result is also a List.
+def evaluate_Cmd(C: Cmd, M: Union[MemorySet, List[Memory]]) -> Union[MemorySet, List[Memory]]:
+    if not isinstance(M, MemorySet):
+        return evaluate_Cmd(C, MemorySet.from_memories(M, getattr(C, 'symbols', None))).to_memories()
+
     if isinstance(C, Skip):
         return M
     elif isinstance(C, Program):
-        return evaluate_Cmd(C.program, M)
+        # an interned program reads its variables by slot, and the
+        # result doesn't claim a layout that other commands don't share
+        return evaluate_Cmd(C.program, M.laid_out(C.symbols)).laid_out(None)
     elif isinstance(C, Assign):
-        return update_memories(C.left.name, lambda m: evaluate_Expr(C.right, m))
+        if M.symbols is not None:
+            return M.assign(C.left.name, lambda row: evaluate_Expr_slots(C.right, row, M.variables, M.index))
+
+        return M.assign(C.left.name, lambda row: evaluate_Expr_row(C.right, row, M.index))
     elif isinstance(C, Input):
+        if input_domain is not None:
+            out = MemorySet(M.variables, symbols = M.symbols)
+            for v in input_values(input_domain, C.var.name):
+                out.update(M.assign(C.var.name, lambda _, v = v: v))
+
+            return out
+
         n = random.randint(0, 100) # could be anything, actually
-        return update_memories(C.var.name, lambda _: n)
+        return M.assign(C.var.name, lambda _: n)
     elif isinstance(C, Seq):
         return evaluate_Cmd(C.cmd1, evaluate_Cmd(C.cmd0, M))
+    elif isinstance(C, Block):
+        for c in C.cmds:
+            M = evaluate_Cmd(c, M)
+
+        return M
     elif isinstance(C, IfThenElse):
-        then_memory = evaluate_Cmd(C.then_, filter_memory(C.cond, M))
-        else_memory = evaluate_Cmd(C.else_, filter_memory(C.cond, M, res = False))
+        then_memory = evaluate_Cmd(C.then_, M.filter(C.cond))
+        else_memory = evaluate_Cmd(C.else_, M.filter(C.cond, res = False))
 
-        return union_memories(then_memory, else_memory)
+        return then_memory.union(else_memory)
     elif isinstance(C, While):
-        # L0 but we apply filter at the end
-        out = [m for m in M] # copy all input states
-
-        # the next loop computes L1, L2, L3, ....
-        # identify those memories where condition is true
-
-        pre_iter_memories = filter_memory(C.cond, out)
-        accum: List[Memory] = []
-        while len(pre_iter_memories):
-            logger.debug(f"pre_iter_memories: {pre_iter_memories}")
-            after_iter_memories = evaluate_Cmd(C.body, pre_iter_memories)
-            logger.debug(f"after_iter_memories: {after_iter_memories}")
-            accum = union_memories(accum, after_iter_memories)
-            logger.debug(f"accum: {accum}")
-
-            # only keep memories where the condition is true for the next iteration
-            pre_iter_memories = filter_memory(C.cond, after_iter_memories)
-
-        # This computes L0 U (L1 U L2...) and retains only those memory states where the loop has
-        # terminated.
-        #
-        # we have exited the loop, so only keep those memories where condition is false
-        out = filter_memory(C.cond, union_memories(out, accum), res=False)
-
-        return out
+        return evaluate_While(C, M)
     else:
         raise NotImplementedError(f"Don't know how to interpret {type(C).__name__}({C})")
 
@@ -159,6 +419,28 @@ def test_evaluate_BoolExpr():
     eb1 = evaluate_BoolExpr(b1, m)
     assert eb1 == True, eb1
 
+def test_MemorySet():
+    M = MemorySet.from_memories([{'x': 5, 'y': 6}, {'x': 8, 'y': 7}, {'x': 5, 'y': 6}])
+    assert len(M) == 2
+    assert (5, 6) in M
+
+    M2 = MemorySet(('y', 'x'), [(7, 8), (0, 1)])
+    new = M.update(M2)
+    assert new == [(1, 0)], new
+    assert len(M) == 3
+    assert M.update(M2) == []
+    assert M == M2.union(MemorySet(('x', 'y'), [(5, 6)]))
+
+    # memories over different variables are kept apart
+    M3 = MemorySet.from_memories([{'x': 1}, {'x': 1, 'z': 2}])
+    assert sorted(M3.to_memories(), key = len) == [{'x': 1}, {'x': 1, 'z': 2}]
+
+    x = Var('x')
+    assert M.filter(BoolExpr('>', x, 5)).to_memories() == [{'x': 8, 'y': 7}]
+    assert len(M.assign('x', lambda row: 0)) == 3
+    assert len(M.assign('y', lambda row: 0)) == 3
+    assert M.assign('z', lambda row: row[0] + 1).variables == ('x', 'y', 'z')
+
 def test_evaluate_Cmd():
     #TODO: actually put in asserts for testing. Right now, rely on visual inspection...
 
@@ -218,9 +500,115 @@ def test_While():
     M_out = evaluate_Cmd(p, M_in)
     print(M_out)
 
+def test_Block():
+    x = Var('x')
+    y = Var('y')
+
+    M_in = [{x.name: 4, y.name: 0}, {x.name: 8, y.name: 0}]
+    p = Program(sequence([Assign(y, 3),
+                          While(BoolExpr('<', x, 7),
+                                sequence([Assign(y, BinOp('+', y, 1)),
+                                          Assign(x, BinOp('+', x, 1))])),
+                          Assign(x, BinOp('*', x, y))]))
+
+    assert evaluate_Cmd(flatten_blocks(p), M_in) == evaluate_Cmd(p, M_in)
+
+    # long blocks don't recurse
+    n = 20000
+    p = flatten_blocks(Program(sequence([Assign(x, BinOp('+', x, 1)) for _ in range(n)])))
+    assert evaluate_Cmd(p, M_in) == [{x.name: 4 + n, y.name: 0}, {x.name: 8 + n, y.name: 0}]
+
+def test_symbols():
+    x = Var('x')
+    y = Var('y')
+
+    def program():
+        return Program(sequence([Assign(y, 3),
+                                 While(BoolExpr('<', x, 7),
+                                       sequence([Assign(y, BinOp('+', y, x)),
+                                                  Assign(Var('z'), BinOp('-', y, 1)),
+                                                  Assign(x, BinOp('+', x, 1))])),
+                                 IfThenElse(BoolExpr('>', y, 10), Assign(x, BinOp('*', x, y)), Skip())]))
+
+    M_in = [{'x': 4, 'w': 1}, {'x': 8, 'w': 2}, {'x': 1, 'w': 3}]
+    expected = evaluate_Cmd(program(), M_in)
+
+    p = program()
+    symbols = intern_variables(p)
+    assert symbols.names == ['y', 'x', 'z']
+    assert evaluate_Cmd(p, M_in) == expected
+
+    # sets laid out by the table, or by another order, give the same result
+    M = MemorySet.from_memories(M_in, symbols)
+    assert M.symbols is symbols and M.variables == ('y', 'x', 'z', 'w')
+    assert M.filter(BoolExpr('>', x, 3)).symbols is symbols
+    assert M.assign('v', lambda row: 0).symbols is symbols
+    out = evaluate_Cmd(p, M)
+    assert out.symbols is None and out == MemorySet.from_memories(expected)
+    assert evaluate_Cmd(p, MemorySet.from_memories(M_in)) == out
+
+    # the result can be used by a program that isn't interned
+    assert evaluate_Cmd(program(), out) == evaluate_Cmd(program(), MemorySet.from_memories(expected))
+
+    # a set over other variables doesn't have the layout
+    assert MemorySet(('x', 'y'), [], symbols).symbols is None
+
+    # a Var shared with a program interned later reads the right slot
+    p1 = Program(Assign(y, x))
+    p2 = Program(Assign(Var('w'), BinOp('+', Var('q'), x)))
+    intern_variables(p1)
+    intern_variables(p2)
+    assert x.slot == 2 and p1.symbols.names == ['y', 'x']
+    assert evaluate_Cmd(p1, [{'x': 1, 'y': 100, 'a': 42}]) == [{'x': 1, 'y': 1, 'a': 42}]
+    assert evaluate_Cmd(p2, [{'x': 1, 'q': 2}]) == [{'x': 1, 'q': 2, 'w': 3}]
+
+def test_While_semi_naive():
+    from tinyparse import parse
+
+    # memories on the same path are only visited once
+    p = parse("while(x < 10) { x := (x + 1) }")
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert evaluate_Cmd(p, [{'x': i} for i in range(10, -10, -1)] + [{'x': 20}]) == [{'x': 10}, {'x': 20}]
+        M_out = evaluate_Cmd(p, [{'x': 0, 'y': 0}, {'x': 1, 'y': 1}])
+        assert MemorySet.from_memories(M_out) == MemorySet.from_memories([{'x': 10, 'y': 0}, {'x': 10, 'y': 1}])
+
+    # a nested loop, which adds a variable
+    q = parse("while(x < 4) { z := 0; while(z < 3) { z := (z + 1) }; x := (x + 1) }")
+    assert evaluate_Cmd(q, [{'x': 0}, {'x': 2}]) == [{'x': 4, 'z': 3}]
+
+    # memories that cycle are reported, and left out of the result
+    c = parse("while(x < 10) { if(x > 5) { x := (x - 1) } else { x := (x + 1) } }")
+    with warnings.catch_warnings(record = True) as w:
+        warnings.simplefilter('always')
+        M_out = evaluate_Cmd(c, [{'x': 3}, {'x': 20}])
+
+    assert M_out == [{'x': 20}]
+    assert len(w) == 1 and issubclass(w[0].category, NonTerminationWarning), w
+    assert sorted([m['x'] for m in w[0].message.states]) == [3, 4, 5, 6]
+
+    # only memories that can't leave are reported
+    d = parse("while(x < 10) { if(x > 5) { x := (x + 0) } else { x := (x + 5) } }")
+    with warnings.catch_warnings(record = True) as w:
+        warnings.simplefilter('always')
+        assert evaluate_Cmd(d, [{'x': 0}, {'x': 1}, {'x': 7}]) == [{'x': 10}]
+
+    assert [sorted([m['x'] for m in x.message.states]) for x in w] == [[1, 6, 7]]
+
+    # an unknown comparison operator is not implemented
+    try:
+        evaluate_Cmd(Program(While(BoolExpr('~', Var('x'), 0), Skip())), [{'x': 0}])
+        assert False
+    except NotImplementedError as e:
+        assert str(e) == "Unknown comparison operator: ~"
+
 if __name__ == "__main__":
     logging.basicConfig(level = logging.DEBUG)
     test_evaluate_Expr()
     test_evaluate_BoolExpr()
+    test_MemorySet()
     test_evaluate_Cmd()
     test_While()
+    test_Block()
+    test_symbols()
+    test_While_semi_naive()
@@ -13,16 +13,24 @@
 # copyright and related or neighboring rights to sem_abs.py. This work
 # is published from: United States.
 
-from typing import List, Dict, Union, Tuple
+from typing import List, Dict, Optional, Union, Tuple
 from tinyast import *
+from collections import OrderedDict
 import random
+import time
 import abstractions
 import logging
+from sem_abs_compile import compiled_transfer
+from abs_memory import PersistentMemory, BOTTOM
+import abs_trace
 
 from sem import evaluate_Cmd # for testing
 
+# or an abs_octagon.OctagonAbstraction, which is relational
 Abstraction = Union[abstractions.NonRelationalAbstraction]
-AbstractMemory = Dict[str, Abstraction]
+# a PersistentMemory, though plain dicts are accepted as inputs, or an
+# abs_octagon.Octagon for a relational abstraction
+AbstractMemory = PersistentMemory
 
 logger = logging.getLogger(__name__)
 
@@ -40,60 +48,443 @@ def evaluate_BoolExpr_abs(B: BoolExpr, m: AbstractMemory, vabs):
     return vabs.f_cmpop(B.op, m[B.left.name], vabs.phi(B.right))
 
 def filter_memory_abs(B: BoolExpr, M_abs: AbstractMemory, vabs) -> Tuple[AbstractMemory, AbstractMemory]:
-    true_abs, false_abs = evaluate_BoolExpr_abs(B, M_abs, vabs)
-    var_abs = M_abs[B.left.name]
-    logger.debug(f"true: {true_abs}, false: {false_abs}, value: {var_abs}")
-
-    true_abs = vabs.refine(var_abs, true_abs)
-    logger.debug(f"refined true: {true_abs}")
-    if true_abs != vabs.BOT:
-        # may enter true part
-        M_abs_true = dict(M_abs)
-        M_abs_true[B.left.name] = true_abs
+    if M_abs is BOTTOM: return BOTTOM, BOTTOM
+
+    if isinstance(M_abs, dict): M_abs = PersistentMemory(M_abs)
+    transfer = compiled_transfer(B, vabs)
+    if transfer is not None:
+        M_abs_true, M_abs_false = transfer(M_abs)
     else:
-        M_abs_true = dict([(m, vabs.BOT) for m in M_abs])
+        true_abs, false_abs = evaluate_BoolExpr_abs(B, M_abs, vabs)
+        var_abs = M_abs[B.left.name]
 
-    false_abs =  vabs.refine(var_abs, false_abs)
-    logger.debug(f"refined false: {false_abs}")
+        true_abs = vabs.refine(var_abs, true_abs)
+        if true_abs != vabs.BOT:
+            # may enter true part
+            M_abs_true = M_abs.set(B.left.name, true_abs)
+        else:
+            M_abs_true = BOTTOM
 
-    if false_abs != vabs.BOT:
-        # may enter false part
-        M_abs_false = dict(M_abs)
-        M_abs_false[B.left.name] = false_abs
-    else:
-        M_abs_false = dict([(m, vabs.BOT) for m in M_abs])
+        false_abs =  vabs.refine(var_abs, false_abs)
+        if false_abs != vabs.BOT:
+            # may enter false part
+            M_abs_false = M_abs.set(B.left.name, false_abs)
+        else:
+            M_abs_false = BOTTOM
 
+    if abs_trace.enabled: abs_trace.emit('filter', cond = B, input = M_abs, true = M_abs_true, false = M_abs_false)
     return M_abs_true, M_abs_false
 
-def abs_iter(F_abs, M_abs, abstraction):
-    R = M_abs
-    logger.debug(f'M0: {R}')
+def _filter(B: BoolExpr, M_abs: AbstractMemory, abstraction) -> Tuple[AbstractMemory, AbstractMemory]:
+    # relational abstractions filter whole memories, others their values
+    if getattr(abstraction, 'relational', False): return abstraction.filter(B, M_abs)
+    return filter_memory_abs(B, M_abs, abstraction.dom)
+
+class IterationStrategy(object):
+    """How abs_iter computes loop invariants.
+
+    delay is the number of iterations that use union before widening
+    starts. After max_iterations (None for no limit), variables that
+    still change are set to TOP. narrowing is the number of decreasing
+    iterations to run once a fixpoint has been found. The defaults are
+    those abs_iter always used.
+
+    Every abs_iter call records its iteration count, narrowing steps and
+    whether it converged before max_iterations in runs.
+    """
+    def __init__(self, delay = 0, max_iterations = 5, narrowing = 0):
+        self.delay = delay
+        self.max_iterations = max_iterations
+        self.narrowing = narrowing
+        self.runs: List[Tuple[int, int, bool]] = []
+
+    def reset(self):
+        self.runs = []
+
+    @property
+    def iterations(self) -> int:
+        return sum([r[0] for r in self.runs])
+
+    @property
+    def narrowing_steps(self) -> int:
+        return sum([r[1] for r in self.runs])
+
+    @property
+    def not_converged(self) -> int:
+        return len([r for r in self.runs if not r[2]])
+
+    def report(self) -> str:
+        return (f"{len(self.runs)} loops, {self.iterations} iterations, "
+                f"{self.narrowing_steps} narrowing steps, {self.not_converged} not converged")
+
+def program_thresholds(C: Cmd) -> List[int]:
+    """Returns widening thresholds for C, collected from the constants in
+    its conditions and assignments"""
+    out = set()
+    for c in walk(C):
+        if isinstance(c, (IfThenElse, While)):
+            # x < c exits with x >= c, and x <= c with x >= c + 1
+            out.update([c.cond.right - 1, c.cond.right, c.cond.right + 1])
+        elif isinstance(c, Assign) and isinstance(c.right, Scalar):
+            out.add(c.right)
+
+    return sorted(out)
+
+def abs_iter(F_abs, M_abs, abstraction, start = None):
+    """Returns an invariant of the loop with body F_abs entered with M_abs.
+
+    Iteration begins at M_abs, or at M_abs U start if start is given.
+    Any start is sound, and a previous invariant of the same loop
+    usually converges at once, but the result need not be the one
+    iterating from M_abs finds."""
+    strategy = getattr(abstraction, 'strategy', None) or IterationStrategy()
+
+    R = M_abs if start is None else abstraction.union(M_abs, start)
+    trace = abs_trace.enabled
+    if trace: abs_trace.loop_start(R)
+
     k = 1
+    converged = True
     while True:
         T = R
-        if abstraction.dom.finite_height:
-            R = abstraction.union(R, F_abs(R))
+        body = F_abs(R)
+        if abstraction.dom.finite_height or k <= strategy.delay:
+            R = abstraction.union(R, body)
+            if trace: abs_trace.emit('step', k = k, op = 'union', before = T, body = body, after = R)
         else:
-            R = abstraction.widen(R, F_abs(R))
+            R = abstraction.widen(R, body)
+            if trace: abs_trace.emit('step', k = k, op = 'widen', before = T, body = body, after = R)
 
-        logger.debug(f'M{k}: {R}')
         if R == T: break
+
         k = k + 1
-        if k > 5: break
+        if strategy.max_iterations is not None and k > strategy.max_iterations:
+            # give up, variables that are still changing go to TOP. This
+            # used to return T, which need not contain the fixpoint.
+            converged = False
+            changed = R.diff(T)
+            for x in changed:
+                R = R.set(x, abstraction.dom.TOP)
+
+            if trace: abs_trace.emit('cutoff', k = k - 1, variables = changed, after = R)
+
+    # T is now a post-fixpoint of M_abs U F_abs(.), which is what makes
+    # narrowing sound
+    steps = 0
+    if not abstraction.dom.finite_height:
+        while steps < strategy.narrowing:
+            body = abstraction.union(M_abs, F_abs(T))
+            R = abstraction.narrow(T, body)
+            steps += 1
+            if trace: abs_trace.emit('narrowing', step = steps, before = T, body = body, after = R)
+            if R == T: break
+            T = R
+
+    strategy.runs.append((k, steps, converged))
+    if trace: abs_trace.loop_end(T, k, converged)
+
+    profiler = getattr(abstraction, 'profiler', None)
+    if profiler is not None: profiler.loop_run(k, steps, converged)
 
     return T
 
-# M_abs is the abstract set of memory states
-def evaluate_Cmd_abs(C: Cmd, M_abs: AbstractMemory, abstraction) -> AbstractMemory:
-    def update_abs_memories(var, value_lambda):
-        out = dict(M_abs)
-        out[var] = value_lambda(M_abs)
+class TransferCache(object):
+    """An LRU cache of evaluate_Cmd_abs results, for at most maxsize
+    (command, abstract memory) pairs.
+
+    Commands are keyed on their identity, like sem_abs_compile, so call
+    clear() after editing a cached command in place. Keys also contain
+    the value domain and the iteration strategy, so one cache can be
+    shared by abstractions that use different domains. Only the command
+    types in cached_types are cached, others are cheaper to recompute.
+
+    Results taken from the cache do not add runs to an IterationStrategy.
+    """
+    cached_types = (IfThenElse, While)
+
+    def __init__(self, maxsize = 1024):
+        self.maxsize = maxsize
+        self.entries: 'OrderedDict' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, C: Cmd, M_abs: AbstractMemory, abstraction):
+        return (C, abstraction.dom, getattr(abstraction, 'strategy', None), M_abs)
+
+    def lookup(self, key) -> Optional[AbstractMemory]:
+        out = self.entries.get(key)
+        if out is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
         return out
 
+    def store(self, key, M_abs: AbstractMemory) -> AbstractMemory:
+        self.entries[key] = M_abs
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last = False)
+            self.evictions += 1
+
+        return M_abs
+
+    def clear(self):
+        self.entries.clear()
+
+    # hooks for subclasses, called around the abs_iter of every While
+
+    def loop_start(self, C: While, M_abs: AbstractMemory) -> Optional[AbstractMemory]:
+        """Returns where abs_iter should start for C, None for M_abs"""
+        return None
+
+    def loop_invariant(self, C: While, invariant: AbstractMemory) -> None:
+        pass
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return (f"{self.hits} hits, {self.misses} misses ({rate:.1%} hit rate), "
+                f"{self.evictions} evictions, {len(self.entries)} entries")
+
+class _CountingDomain(object):
+    """A domain that counts the calls to the operations in ops, and
+    otherwise forwards to wrapped. It compares equal to wrapped, so
+    cache keys are the same with or without it."""
+    def __init__(self, wrapped, ops: Dict[str, int]):
+        self.wrapped = wrapped
+        for name in ops:
+            f = getattr(wrapped, name, None)
+            if f is not None: setattr(self, name, self._counted(name, f, ops))
+
+    @staticmethod
+    def _counted(name, f, ops):
+        def counted(*args):
+            ops[name] += 1
+            return f(*args)
+
+        return counted
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def __eq__(self, other):
+        return self.wrapped == getattr(other, 'wrapped', other)
+
+    def __hash__(self):
+        return hash(self.wrapped)
+
+class Profiler(object):
+    """Records where evaluate_Cmd_abs spends its time.
+
+    For every node, this records its visits, its time including the
+    nodes inside it (time) and its time excluding them (self_time). For
+    every While, it records the abs_iter runs, as an IterationStrategy
+    does. It also counts calls to the domain operations in OPS.
+    Generated transfer functions (see sem_abs_compile) do their interval
+    arithmetic inline, so f_binop, f_cmpop and refine are only counted
+    for nodes that the interpreter evaluates.
+
+    Pass one to an abstraction to enable it. Without one, the only cost
+    is an attribute lookup per command.
+    """
+    OPS = ('lub', 'widen', 'narrow', 'refine', 'f_binop', 'f_cmpop')
+
+    def __init__(self):
+        self.nodes: Dict[Node, List[float]] = {} # visits, time, self_time
+        self.loops: Dict[Optional[Node], List[Tuple[int, int, bool]]] = {}
+        self.ops: Dict[str, int] = dict([(op, 0) for op in self.OPS])
+        self.stack: List[Node] = []
+        self.children: List[float] = []
+
+    def reset(self):
+        self.__init__()
+
+    def evaluate(self, C: Cmd, M_abs: AbstractMemory, abstraction) -> AbstractMemory:
+        # the outermost command counts the domain operations of the
+        # abstraction through a wrapper, the domain itself is untouched,
+        # since other abstractions may share it
+        outer = len(self.stack) == 0
+        if outer:
+            dom = abstraction.dom
+            abstraction.dom = _CountingDomain(dom, self.ops)
+
+        self.stack.append(C)
+        self.children.append(0.0)
+        start = time.perf_counter()
+        try:
+            return _evaluate_Cmd_abs_cached(C, M_abs, abstraction)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stack.pop()
+            inner = self.children.pop()
+            if len(self.children): self.children[-1] += elapsed
+
+            s = self.nodes.get(C)
+            if s is None:
+                s = self.nodes[C] = [0, 0.0, 0.0]
+
+            s[0] += 1
+            s[1] += elapsed
+            s[2] += elapsed - inner
+
+            if outer: abstraction.dom = dom
+
+    def loop_run(self, iterations: int, narrowing_steps: int, converged: bool):
+        # abs_iter runs while its While is the innermost node evaluated
+        node = self.stack[-1] if len(self.stack) else None
+        self.loops.setdefault(node, []).append((iterations, narrowing_steps, converged))
+
+    def stats(self) -> dict:
+        """Returns the profile as a dict of
+          nodes: per node, slowest first, its node, type, visits, time
+                 and self_time (in seconds)
+          loops: per While, its node, runs, iterations, max_iterations,
+                 narrowing_steps and not_converged runs
+          ops: calls per domain operation
+          time: the time of the outermost commands"""
+        nodes = [{'node': n, 'type': type(n).__name__, 'visits': s[0], 'time': s[1], 'self_time': s[2]}
+                 for n, s in self.nodes.items()]
+        nodes.sort(key = lambda s: s['time'], reverse = True)
+
+        loops = [{'node': n,
+                  'runs': len(runs),
+                  'iterations': sum([r[0] for r in runs]),
+                  'max_iterations': max([r[0] for r in runs]),
+                  'narrowing_steps': sum([r[1] for r in runs]),
+                  'not_converged': len([r for r in runs if not r[2]])}
+                 for n, runs in self.loops.items()]
+        loops.sort(key = lambda s: s['iterations'], reverse = True)
+
+        total = sum([s['time'] for s in nodes if isinstance(s['node'], Program)])
+        return {'nodes': nodes, 'loops': loops, 'ops': dict(self.ops), 'time': total}
+
+    def report(self, top = 10) -> str:
+        def text(n):
+            t = str(n)
+            return t if len(t) <= 50 else t[:47] + "..."
+
+        st = self.stats()
+        out = [f"{len(st['nodes'])} nodes, {st['time'] * 1e3:.3f} ms in programs"]
+        out.append(f"{'time ms':>10} {'self ms':>10} {'visits':>8}  node")
+        for s in st['nodes'][:top]:
+            out.append(f"{s['time'] * 1e3:10.3f} {s['self_time'] * 1e3:10.3f} {s['visits']:8}  {s['type']}: {text(s['node'])}")
+
+        out.append(f"{'runs':>10} {'iters':>10} {'max':>8} {'narrow':>8} {'not conv':>8}  loop")
+        for s in st['loops'][:top]:
+            out.append(f"{s['runs']:10} {s['iterations']:10} {s['max_iterations']:8} {s['narrowing_steps']:8} "
+                       f"{s['not_converged']:8}  {text(s['node'])}")
+
+        out.append(", ".join([f"{op} {n}" for op, n in st['ops'].items()]))
+        return "\n".join(out)
+
+class Pruning(object):
+    """The IfThenElse arms and While bodies that an analysis never ran on
+    a memory other than BOT.
+
+    Pass one to an abstraction, as its pruning attribute, to record the
+    commands that evaluate_Cmd_abs runs in reached, then call prune().
+    Passed to another abstraction, evaluate_Cmd_abs then skips the
+    unreachable commands, as if their entry were BOT, and counts the
+    skips in skipped. If the first analysis is sound, so is the second.
+
+    The TransferCache is not used while a Pruning is, since its results
+    depend on which analysis the commands were pruned by.
+    """
+    def __init__(self):
+        self.reached: set = set()
+        self.unreachable: Dict[Cmd, int] = {} # the number of commands in each
+        self.skipped: Dict[Cmd, int] = {}
+
+    def visit(self, C: Cmd) -> bool:
+        """Returns False if C is to be skipped"""
+        if C in self.unreachable:
+            self.skipped[C] = self.skipped.get(C, 0) + 1
+            return False
+
+        self.reached.add(C)
+        return True
+
+    def prune(self, C: Node) -> None:
+        """Marks the arms and bodies in C that were not reached"""
+        self.unreachable = {}
+        self.skipped = {}
+        for n in walk(C, lambda n: n in self.unreachable):
+            if n in self.unreachable: continue
+
+            if isinstance(n, (IfThenElse, While)):
+                for c in ([n.then_, n.else_] if isinstance(n, IfThenElse) else [n.body]):
+                    if c not in self.reached: self.unreachable[c] = _commands(c)
+
+    def report(self) -> str:
+        work = sum([n * self.unreachable[c] for c, n in self.skipped.items()])
+        return (f"{len(self.unreachable)} unreachable arms and loop bodies "
+                f"({sum(self.unreachable.values())} commands), skipped {sum(self.skipped.values())} times "
+                f"({work} commands not evaluated)")
+
+def _commands(C: Node) -> int:
+    """Returns the number of commands in C, other than Seqs and Blocks"""
+    return len([n for n in walk(C) if isinstance(n, Cmd) and not isinstance(n, (Seq, Block))])
+
+def evaluate_staged(C: Cmd, M: List[dict], abstraction, signs = None) -> Tuple[AbstractMemory, Pruning]:
+    """Runs C on the memories M with signs, a cheap finite-height
+    abstraction (a NonRelationalAbstraction over SignsDomain by default),
+    and then with abstraction, skipping the arms and loop bodies that
+    the first run never reached. Returns the result of the second run
+    and the Pruning, whose report() says how much it skipped."""
+    if signs is None: signs = abstractions.NonRelationalAbstraction(abstractions.SignsDomain())
+
+    pruning = Pruning()
+    for a, M_abs in [(signs, signs.phi(M)), (abstraction, abstraction.phi(M))]:
+        old = getattr(a, 'pruning', None)
+        a.pruning = pruning
+        try:
+            out = evaluate_Cmd_abs(C, M_abs, a)
+        finally:
+            a.pruning = old
+
+        if a is signs: pruning.prune(C)
+
+    return out, pruning
+
+# M_abs is the abstract set of memory states
+def evaluate_Cmd_abs(C: Cmd, M_abs: AbstractMemory, abstraction) -> AbstractMemory:
     # C[BOT] -> BOT
-    if M_abs == abstraction.BOT:
+    if M_abs is BOTTOM:
         return M_abs
 
+    if isinstance(M_abs, dict):
+        # a plain dict, as older callers pass
+        if M_abs == abstraction.BOT: return M_abs
+        M_abs = PersistentMemory(M_abs)
+
+    pruning = getattr(abstraction, 'pruning', None)
+    if pruning is not None and not pruning.visit(C):
+        return BOTTOM
+
+    profiler = getattr(abstraction, 'profiler', None)
+    if profiler is not None:
+        return profiler.evaluate(C, M_abs, abstraction)
+
+    return _evaluate_Cmd_abs_cached(C, M_abs, abstraction)
+
+def _evaluate_Cmd_abs_cached(C: Cmd, M_abs: AbstractMemory, abstraction) -> AbstractMemory:
+    cache = getattr(abstraction, 'cache', None)
+    if cache is not None and isinstance(C, cache.cached_types) and getattr(abstraction, 'pruning', None) is None:
+        key = cache.key(C, M_abs, abstraction)
+        out = cache.lookup(key)
+        if out is None:
+            out = cache.store(key, _evaluate_Cmd_abs(C, M_abs, abstraction))
+
+        return out
+
+    return _evaluate_Cmd_abs(C, M_abs, abstraction)
+
+def _evaluate_Cmd_abs(C: Cmd, M_abs: AbstractMemory, abstraction) -> AbstractMemory:
+    def update_abs_memories(var, value_lambda):
+        return M_abs.set(var, value_lambda(M_abs))
+
     # the value abstraction
     v_abs = abstraction.dom
 
@@ -102,29 +493,48 @@ def evaluate_Cmd_abs(C: Cmd, M_abs: AbstractMemory, abstraction) -> AbstractMemo
     elif isinstance(C, Program):
         return evaluate_Cmd_abs(C.program, M_abs, abstraction)
     elif isinstance(C, Assign):
+        if getattr(abstraction, 'relational', False):
+            return abstraction.assign(M_abs, C.left.name, C.right)
+
+        transfer = compiled_transfer(C, v_abs)
+        if transfer is not None:
+            return transfer(M_abs)
+
         return update_abs_memories(C.left.name, lambda m: evaluate_Expr_abs(C.right, m, v_abs))
     elif isinstance(C, Input):
         return update_abs_memories(C.var.name, lambda _: v_abs.TOP)
     elif isinstance(C, Seq):
         return evaluate_Cmd_abs(C.cmd1, evaluate_Cmd_abs(C.cmd0, M_abs, abstraction), abstraction)
+    elif isinstance(C, Block):
+        for c in C.cmds:
+            M_abs = evaluate_Cmd_abs(c, M_abs, abstraction)
+
+        return M_abs
     elif isinstance(C, IfThenElse):
-        then_memory, else_memory = filter_memory_abs(C.cond, M_abs, v_abs)
-        logger.debug(f"ite: part-wise precondition: then: {then_memory}, else: {else_memory}")
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        then_memory, else_memory = _filter(C.cond, M_abs, abstraction)
+        if debug: logger.debug(f"ite: part-wise precondition: then: {then_memory}, else: {else_memory}")
         then_memory = evaluate_Cmd_abs(C.then_, then_memory, abstraction)
         else_memory = evaluate_Cmd_abs(C.else_, else_memory, abstraction)
 
-        logger.debug(f"ite: part-wise postcondition: then: {then_memory}, else: {else_memory}")
+        if debug: logger.debug(f"ite: part-wise postcondition: then: {then_memory}, else: {else_memory}")
         ite_memory = abstraction.union(then_memory, else_memory)
 
-        logger.debug(f"ite: postcondition: {ite_memory}")
+        if debug: logger.debug(f"ite: postcondition: {ite_memory}")
         return ite_memory
     elif isinstance(C, While):
         def F_abs(MM_abs):
-            pre_memory, _ = filter_memory_abs(C.cond, MM_abs, v_abs)
+            pre_memory, _ = _filter(C.cond, MM_abs, abstraction)
             post_memory = evaluate_Cmd_abs(C.body, pre_memory, abstraction)
             return post_memory
 
-        _, out = filter_memory_abs(C.cond, abs_iter(F_abs, M_abs, abstraction), v_abs)
+        cache = getattr(abstraction, 'cache', None)
+        start = cache.loop_start(C, M_abs) if cache is not None else None
+        invariant = abs_iter(F_abs, M_abs, abstraction, start)
+        if cache is not None: cache.loop_invariant(C, invariant)
+
+        _, out = _filter(C.cond, invariant, abstraction)
         return out
     else:
         raise NotImplementedError(f"Don't know how to interpret {type(C).__name__}({C})")
@@ -250,9 +660,193 @@ def test_infinite_loop_abs_2():
     M_out_abs = evaluate_Cmd_abs(ploop3, M_in_abs, nra_abs)
     print(M_out_abs)
 
+def test_iteration_strategy():
+    x = Var('x')
+    y = Var('y')
+
+    ploop = Program(sequence([Assign(x, 0),
+                              Assign(y, 0),
+                              While(BoolExpr('<', x, 100),
+                                    Seq(Assign(x, BinOp('+', x, 1)),
+                                        Assign(y, BinOp('+', y, 2))))]))
+    M_in = [{'x': 3, 'y': 4}]
+    M_out = evaluate_Cmd(ploop, M_in)
+
+    assert program_thresholds(ploop) == [0, 99, 100, 101]
+
+    strategies = [IterationStrategy(),
+                  IterationStrategy(delay = 3, max_iterations = None),
+                  IterationStrategy(max_iterations = None, narrowing = 2)]
+    thresholds = [(), program_thresholds(ploop)]
+
+    out = {}
+    for t in thresholds:
+        for i, s in enumerate(strategies):
+            s.reset()
+            nra_abs = abstractions.NonRelationalAbstraction(abstractions.IntervalsDomain(t), s)
+            M_out_abs = evaluate_Cmd_abs(ploop, nra_abs.phi(M_in), nra_abs)
+            print(len(t), i, s.report(), M_out_abs)
+
+            assert nra_abs.included(M_out, M_out_abs)
+            assert s.not_converged == 0 and len(s.runs) == 1
+            out[(len(t), i)] = M_out_abs
+
+    # thresholds or narrowing find x's exit value, plain widening does not
+    assert out[(0, 0)]['x'].hi == abstractions.IntervalsDomain.PINF
+    assert out[(4, 0)]['x'] == abstractions.IntervalsDomain().phi(100)
+    assert out[(0, 2)]['x'] == abstractions.IntervalsDomain().phi(100)
+
+def test_transfer_cache():
+    x = Var('x')
+    y = Var('y')
+
+    inner = While(BoolExpr('<', y, 3), Assign(y, BinOp('+', y, 1)))
+    p = Program(sequence([Assign(x, 0),
+                          While(BoolExpr('<', x, 10),
+                                sequence([Assign(y, 0),
+                                          inner,
+                                          Assign(x, BinOp('+', x, 1))]))]))
+    M_in = [{'x': 5, 'y': 6}]
+
+    cache = TransferCache()
+    for dom in [abstractions.IntervalsDomain(), abstractions.IntervalsDomain([0, 10]), abstractions.SignsDomain()]:
+        plain = abstractions.NonRelationalAbstraction(dom)
+        cached = abstractions.NonRelationalAbstraction(dom, cache = cache)
+        M_in_abs = plain.phi(M_in)
+        cached.BOT = plain.BOT
+
+        expected = evaluate_Cmd_abs(p, M_in_abs, plain)
+        assert evaluate_Cmd_abs(p, M_in_abs, cached) == expected
+        hits = cache.hits
+        assert evaluate_Cmd_abs(p, M_in_abs, cached) == expected
+        assert cache.hits > hits
+
+    print(cache.report())
+
+    # analysing the same program again only needs its outermost loop
+    cache = TransferCache()
+    nra = abstractions.NonRelationalAbstraction(abstractions.IntervalsDomain(), cache = cache)
+    evaluate_Cmd_abs(p, nra.phi(M_in), nra)
+    misses = cache.misses
+    evaluate_Cmd_abs(p, nra.phi(M_in), nra)
+    assert cache.misses == misses and cache.hits == 1
+
+    cache = TransferCache(maxsize = 1)
+    nra.cache = cache
+    evaluate_Cmd_abs(p, nra.phi(M_in), nra)
+    assert len(cache.entries) == 1 and cache.evictions > 0
+
+def test_Block_abs():
+    import abstractions
+
+    x = Var('x')
+    y = Var('y')
+
+    p = Program(sequence([Assign(y, 3),
+                          While(BoolExpr('<', x, 7),
+                                sequence([Assign(y, BinOp('+', y, 1)),
+                                          Assign(x, BinOp('+', x, 1))])),
+                          Assign(x, BinOp('-', x, y))]))
+
+    nra = abstractions.NonRelationalAbstraction(abstractions.IntervalsDomain())
+    M_in = nra.phi([{x.name: 4, y.name: 0}, {x.name: 8, y.name: 0}])
+    assert evaluate_Cmd_abs(flatten_blocks(p), M_in, nra) == evaluate_Cmd_abs(p, M_in, nra)
+
+    # long blocks don't recurse
+    n = 20000
+    p = flatten_blocks(Program(sequence([Assign(x, BinOp('+', x, 1)) for _ in range(n)])))
+    out = evaluate_Cmd_abs(p, M_in, nra)
+    assert out.get(x.name) == nra.dom.lub(nra.dom.phi(4 + n), nra.dom.phi(8 + n)), out
+
+def test_profiler():
+    x = Var('x')
+    y = Var('y')
+
+    inner = While(BoolExpr('<', y, 3), Assign(y, BinOp('+', y, 1)))
+    outer = While(BoolExpr('<', x, 100),
+                  sequence([Assign(y, 0),
+                            inner,
+                            IfThenElse(BoolExpr('>', x, 50), Assign(x, BinOp('+', x, 2)), Assign(x, BinOp('+', x, 1)))]))
+    p = Program(sequence([Assign(x, 0), outer]))
+
+    # union only, so that the outer loop does not converge in 5 iterations
+    strategy = IterationStrategy(delay = 10)
+    nra = abstractions.NonRelationalAbstraction(abstractions.IntervalsDomain(), strategy)
+    M_in = nra.phi([{'x': 0, 'y': 0}])
+    expected = evaluate_Cmd_abs(p, M_in, nra)
+
+    profiler = Profiler()
+    nra.profiler = profiler
+    assert evaluate_Cmd_abs(p, M_in, nra) == expected
+    print(profiler.report())
+
+    st = profiler.stats()
+    nodes = dict([(id(s['node']), s) for s in st['nodes']])
+    assert st['nodes'][0]['node'] is p and nodes[id(p)]['visits'] == 1
+    assert st['time'] == nodes[id(p)]['time']
+    assert nodes[id(inner)]['visits'] == nodes[id(outer.body)]['visits'] > 1
+    assert all([0 <= s['self_time'] <= s['time'] for s in st['nodes']])
+
+    loops = dict([(id(s['node']), s) for s in st['loops']])
+    assert loops.keys() == set([id(inner), id(outer)])
+    assert loops[id(outer)]['runs'] == 1 and loops[id(outer)]['not_converged'] == 1
+    assert loops[id(inner)]['runs'] == nodes[id(inner)]['visits'] and loops[id(inner)]['not_converged'] == 0
+    assert st['ops']['lub'] > 0 and st['ops']['refine'] == 0 # filters are generated code
+
+    # the domain is left as it was
+    assert 'lub' not in vars(nra.dom)
+    profiler.reset()
+    assert profiler.stats()['nodes'] == [] and profiler.ops['lub'] == 0
+
+    # abstractions that share a domain count their own operations, and
+    # the domain's own attributes are kept
+    dom = nra.dom
+    dom.lub = dom.lub
+    other = abstractions.NonRelationalAbstraction(dom, strategy)
+    other.profiler = Profiler()
+    assert evaluate_Cmd_abs(p, M_in, nra) == expected
+    assert other.profiler.ops['lub'] == 0
+    assert evaluate_Cmd_abs(p, M_in, other) == expected
+    assert other.profiler.ops == profiler.ops and nra.dom is dom and other.dom is dom
+    assert vars(dom)['lub'] == dom.lub and 'widen' not in vars(dom)
+    del dom.lub
+
+def test_evaluate_staged():
+    import proggen
+    from tinyparse import parse
+
+    # delayed widening gives up on x, but the signs of x are known
+    p = parse("x := 0; i := 0; while(i < 100) { x := (x + 1); i := (i + 1) }; "
+              "if(x < 0) { z := 0; while(z < 100) { z := (z + 1) } } else { z := 1 }")
+    nra = abstractions.NonRelationalAbstraction(abstractions.IntervalsDomain(), IterationStrategy(delay = 10))
+    full = evaluate_Cmd_abs(p, nra.phi([{}]), nra)
+    out, pruning = evaluate_staged(p, [{}], nra)
+
+    [arm] = pruning.unreachable
+    assert str(arm) == "z := 0; while(z < 100) { z := (z + 1) }" and pruning.unreachable[arm] == 3
+    assert pruning.skipped == {arm: 1}
+    assert "skipped 1 times (3 commands not evaluated)" in pruning.report(), pruning.report()
+    assert nra.lte(out, full) and out['z'] == nra.dom.phi(1) and full['z'] != out['z']
+    assert nra.included(evaluate_Cmd(p, [{}]), out)
+    assert getattr(nra, 'pruning', None) is None
+
+    # pruning stays sound, and a cache is not used while it is
+    for seed in range(10):
+        q = proggen.nested_ifs(6, seed = seed)
+        M = proggen.memories(proggen.program_variables(q), 20, seed = seed)
+        nra = abstractions.NonRelationalAbstraction(abstractions.IntervalsDomain(), cache = TransferCache())
+        out, pruning = evaluate_staged(q, M, nra)
+        assert nra.included(evaluate_Cmd(q, M), out)
+        assert nra.lte(out, evaluate_Cmd_abs(q, nra.phi(M), nra))
+
 if __name__ == "__main__":
     logging.basicConfig(level = logging.DEBUG)
     test_ite_bot_abs()
     test_infinite_loop_abs()
     test_infinite_loop_abs_2()
     test_evaluate_Cmd_abs()
+    test_iteration_strategy()
+    test_transfer_cache()
+    test_Block_abs()
+    test_profiler()
+    test_evaluate_staged()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+#
+# sem_abs_compile.py
+#
+# Generates specialised Python code for the abstract transfer functions
+# of assignments and conditions over the intervals domain.
+#
+# For an Assign, the generated code computes the bounds of the result
+# directly from the bounds of the variables it reads, with constants
+# folded in. For a BoolExpr, it computes the refined values of the
+# variable on the true and false branches. The abstract interpreter in
+# sem_abs.py runs this code, when available, instead of walking the
+# expression and calling into IntervalsDomain on every fixpoint
+# iteration.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to sem_abs_compile.py.
+# This work is published from: United States.
+
+from typing import Callable, Dict, List, Optional, Tuple
+from tinyast import *
+from dom_intervals import IntervalsDomain, Interval, BOT, PINF, NINF
+from abs_memory import BOTTOM, PersistentMemory
+import weakref
+import logging
+
+logger = logging.getLogger(__name__)
+
+# set to False to always use the generic interpreter
+enabled = True
+
+# Generated transfer functions, keyed by AST node, as (key, function)
+# pairs. The function is None if the node can't be compiled.
+#
+# The key is the node's operands (and operator, for a BoolExpr), so that
+# replacing these is noticed. Expressions are compared by identity.
+# Nodes inside an expression are not checked on every use: AST nodes
+# must be treated as immutable once analysed, or invalidate() must be
+# called after editing them.
+_transfers: 'weakref.WeakKeyDictionary[Node, Tuple[object, Optional[Callable]]]' = weakref.WeakKeyDictionary()
+
+class _Unsupported(Exception):
+    pass
+
+class _Generator(object):
+    def __init__(self):
+        self.loads: Dict[str, str] = {} # variable name -> local
+        self.consts: Dict[str, object] = {}
+
+    def const(self, value) -> str:
+        name = f"K{len(self.consts)}"
+        self.consts[name] = value
+        return name
+
+    def load(self, name: str) -> str:
+        if name not in self.loads:
+            self.loads[name] = f"v{len(self.loads)}"
+
+        return self.loads[name]
+
+    def prologue(self) -> List[str]:
+        return [f"    {v} = m[{x!r}]" for x, v in self.loads.items()]
+
+    def bounds(self, E: Expr) -> Tuple[str, str]:
+        """Returns expressions for the lower and upper bounds of E"""
+        if isinstance(E, Scalar):
+            return (f"({E!r})", f"({E!r})")
+        elif isinstance(E, Var):
+            v = self.load(E.name)
+            return (f"{v}[0]", f"{v}[1]")
+        elif isinstance(E, BinOp):
+            l_lo, l_hi = self.bounds(E.left)
+            r_lo, r_hi = self.bounds(E.right)
+
+            # as in IntervalsDomain.f_binop
+            if E.op == '+':
+                return (f"({l_lo} + {r_lo})", f"({l_hi} + {r_hi})")
+            elif E.op == '-':
+                return (f"({l_lo} - {r_hi})", f"({l_hi} - {r_lo})")
+
+        raise _Unsupported(E)
+
+    def value(self, E: Expr) -> str:
+        """Returns an expression for evaluate_Expr_abs(E, m, IntervalsDomain())"""
+        if isinstance(E, Scalar):
+            return self.const(Interval(E, E))
+        elif isinstance(E, Var):
+            return self.load(E.name)
+
+        lo, hi = self.bounds(E)
+        if len(self.loads) == 0:
+            # a constant expression, folded here
+            return self.const(Interval(eval(lo), eval(hi)))
+
+        bot = " or ".join([f"{v} is BOT" for v in self.loads.values()])
+        return f"BOT if {bot} else _new(Interval, ({lo}, {hi}))"
+
+    def compile(self, source: List[str], name: str) -> Callable:
+        src = "\n".join(source)
+        logger.debug(f"generated:\n{src}")
+
+        namespace = {'BOT': BOT, 'BOTTOM': BOTTOM, 'Interval': Interval, '_new': tuple.__new__}
+        namespace.update(self.consts)
+        exec(compile(src, f"<{name}>", "exec"), namespace)
+        return namespace['transfer']
+
+def compile_Expr_abs(E: Expr) -> Callable:
+    """Returns a function of an abstract memory equivalent to evaluate_Expr_abs(E, m, IntervalsDomain())"""
+    g = _Generator()
+    value = g.value(E)
+    return g.compile(["def transfer(m):"] + g.prologue() + [f"    return {value}"], str(E))
+
+def compile_Assign_abs(C: Assign) -> Callable:
+    """Returns a function of an abstract memory that returns the memory
+    after C, as computed by sem_abs.evaluate_Cmd_abs"""
+    g = _Generator()
+    value = g.value(C.right)
+    body = g.prologue()
+    body.append(f"    return m.set({C.left.name!r}, {value})")
+    return g.compile(["def transfer(m):"] + body, str(C))
+
+def _refine(v: str, lo, hi) -> str:
+    """Returns an expression for IntervalsDomain.refine(v, [lo, hi]), where v is not BOT"""
+    if lo == NINF:
+        return f"BOT if {v}[0] > {hi!r} else ({v} if {v}[1] <= {hi!r} else _new(Interval, ({v}[0], {hi!r})))"
+    else:
+        assert hi == PINF
+        return f"BOT if {v}[1] < {lo!r} else ({v} if {v}[0] >= {lo!r} else _new(Interval, ({lo!r}, {v}[1])))"
+
+def _refinements(B: BoolExpr, g: _Generator) -> List[str]:
+    """Returns code that sets t and f to the refined values of B.left
+    when B is true and when B is false"""
+    d = IntervalsDomain()
+    if B.op not in ('<', '<=', '>', '>='):
+        raise _Unsupported(B)
+
+    # these are constant for a given B
+    true_abs, false_abs = d.f_cmpop(B.op, d.TOP, d.phi(B.right))
+
+    v = g.load(B.left.name)
+    return g.prologue() + [f"    if {v} is BOT:",
+                           f"        t, f = {g.const(true_abs)}, {g.const(false_abs)}",
+                           f"    else:",
+                           f"        t = {_refine(v, true_abs.lo, true_abs.hi)}",
+                           f"        f = {_refine(v, false_abs.lo, false_abs.hi)}"]
+
+def compile_BoolExpr_abs(B: BoolExpr) -> Callable:
+    """Returns a function of an abstract memory that returns the refined
+    values of B.left when B is true and when B is false"""
+    g = _Generator()
+    body = _refinements(B, g) + ["    return t, f"]
+    return g.compile(["def transfer(m):"] + body, str(B))
+
+def compile_filter_abs(B: BoolExpr) -> Callable:
+    """Returns a function of an abstract memory equivalent to
+    sem_abs.filter_memory_abs(B, m, IntervalsDomain())"""
+    g = _Generator()
+    x = B.left.name
+    body = _refinements(B, g)
+    for r, out in [("t", "mt"), ("f", "mf")]:
+        body += [f"    if {r} is BOT:",
+                 f"        {out} = BOTTOM",
+                 f"    else:",
+                 f"        {out} = m.set({x!r}, {r})"]
+
+    body.append("    return mt, mf")
+    return g.compile(["def transfer(m):"] + body, str(B))
+
+def _key(node: Node) -> object:
+    if isinstance(node, Assign):
+        return (node.left.name, node.right)
+    elif isinstance(node, BoolExpr):
+        return (node.op, node.left.name, node.right)
+
+    return None
+
+def _compile(node: Node) -> Optional[Callable]:
+    try:
+        if isinstance(node, Assign):
+            return compile_Assign_abs(node)
+        elif isinstance(node, BoolExpr):
+            return compile_filter_abs(node)
+    except _Unsupported:
+        logger.debug(f"can't compile {node}, using the interpreter")
+
+    return None
+
+def compiled_transfer(node: Node, vabs) -> Optional[Callable]:
+    """Returns the generated transfer function for an Assign (a function
+    from a memory to a memory) or a BoolExpr (a function from a memory
+    to the true and false memories), or None if the interpreter must be
+    used instead"""
+    # a profiler counts operations through a wrapper (see sem_abs.Profiler)
+    while hasattr(vabs, 'wrapped'): vabs = vabs.wrapped
+    if not enabled or type(vabs) is not IntervalsDomain: return None
+
+    entry = _transfers.get(node)
+    key = _key(node)
+    if entry is None or entry[0] != key:
+        entry = _transfers[node] = (key, _compile(node))
+
+    return entry[1]
+
+def invalidate(node: Optional[Node] = None) -> None:
+    """Discards generated code for node and everything inside it, or
+    for all nodes if node is None. Call this after editing an AST that
+    has already been analysed."""
+    if node is None:
+        _transfers.clear()
+        return
+
+    for c in walk(node):
+        if isinstance(c, Node): _transfers.pop(c, None)
+
+def compile_program_abs(C: Node) -> int:
+    """Generates code for all assignments and conditions in C ahead of
+    time, and returns how many were compiled"""
+    n = 0
+    for c in walk(C, lambda c: isinstance(c, (Assign, BoolExpr))):
+        if isinstance(c, (Assign, BoolExpr)):
+            _transfers[c] = (_key(c), _compile(c))
+            n += _transfers[c][1] is not None
+
+    return n
+
+def test_compile_Expr_abs():
+    from sem_abs import evaluate_Expr_abs
+    from dom_intervals import interval
+
+    d = IntervalsDomain()
+    x = Var('x')
+    y = Var('y')
+
+    exprs = [7, x, BinOp('+', 10, 11), BinOp('+', x, 1), BinOp('-', 7, x),
+             BinOp('-', BinOp('+', x, y), BinOp('-', y, -3))]
+
+    values = [d.TOP, interval(NINF, 3), interval(-2, PINF), interval(1, 5), d.phi(0), BOT]
+
+    for E in exprs:
+        f = compile_Expr_abs(E)
+        for xv in values:
+            for yv in values:
+                m = {'x': xv, 'y': yv}
+                assert f(m) == evaluate_Expr_abs(E, m, d), f"{E}, {m}: {f(m)}"
+
+    try:
+        compile_Expr_abs(BinOp('*', x, 2))
+        assert False, "Expected _Unsupported"
+    except _Unsupported:
+        pass
+
+def test_compile_BoolExpr_abs():
+    from dom_intervals import interval
+
+    d = IntervalsDomain()
+    x = Var('x')
+
+    values = [d.TOP, interval(NINF, 3), interval(-2, PINF), interval(1, 5), d.phi(0), d.phi(7), BOT]
+
+    for op in ['<', '<=', '>', '>=']:
+        for c in [-3, 0, 3, 7]:
+            B = BoolExpr(op, x, c)
+            f = compile_BoolExpr_abs(B)
+            for v in values:
+                t, e = d.f_cmpop(op, v, d.phi(c))
+                expected = (d.refine(v, t), d.refine(v, e))
+                assert f({'x': v}) == expected, f"{B}, {v}: {f({'x': v})} != {expected}"
+
+def test_compiled_transfer():
+    from dom_signs import SignsDomain
+
+    x = Var('x')
+    a = Assign(x, BinOp('+', x, 1))
+
+    assert compiled_transfer(a, SignsDomain()) is None
+    assert compiled_transfer(a, IntervalsDomain()) is not None
+    assert compiled_transfer(Assign(x, BinOp('*', x, 2)), IntervalsDomain()) is None
+
+    p = Program(While(BoolExpr('<', x, 7), a))
+    assert compile_program_abs(p) == 2
+
+    # replacing the operands of a node is noticed
+    d = IntervalsDomain()
+    m = PersistentMemory({'x': d.phi(1)})
+    assert compiled_transfer(a, d)(m)['x'] == d.phi(2)
+    a.right = BinOp('-', x, 1)
+    assert compiled_transfer(a, d)(m)['x'] == d.phi(0)
+
+    # but editing inside an expression needs invalidate()
+    a.right.op = '+'
+    invalidate(p)
+    assert compiled_transfer(a, d)(m)['x'] == d.phi(2)
+
+def test_compile_filter_abs():
+    from sem_abs import evaluate_Cmd_abs, filter_memory_abs
+    from dom_intervals import interval
+    global enabled
+
+    d = IntervalsDomain()
+    x = Var('x')
+    y = Var('y')
+
+    values = [d.TOP, interval(NINF, 3), interval(-2, PINF), interval(1, 5), d.phi(7), BOT]
+    nodes = [BoolExpr('<', x, 3), BoolExpr('>=', x, -2),
+             Assign(y, BinOp('-', BinOp('+', x, y), 3)), Assign(y, 4), Assign(y, x)]
+
+    class NRA(object):
+        BOT = {'x': BOT, 'y': BOT}
+        dom = d
+
+    for n in nodes:
+        f = compiled_transfer(n, d)
+        for xv in values:
+            m = PersistentMemory({'x': xv, 'y': d.phi(1)})
+            enabled = False
+            try:
+                if isinstance(n, BoolExpr):
+                    expected = filter_memory_abs(n, m, d)
+                else:
+                    expected = evaluate_Cmd_abs(n, m, NRA())
+            finally:
+                enabled = True
+
+            assert f(m) == expected, f"{n}, {m}: {f(m)} != {expected}"
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.DEBUG)
+    test_compile_Expr_abs()
+    test_compile_BoolExpr_abs()
+    test_compiled_transfer()
+    test_compile_filter_abs()
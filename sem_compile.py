@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+#
+# sem_compile.py
+#
+# Compiles programs of the tiny language into nested Python closures
+# that implement the concrete semantics of sem.py.
+#
+# The AST is walked, and operators are looked up, only once, when the
+# program is compiled. The compiled program runs on the rows of a
+# sem.MemorySet, with every variable resolved to its position in the
+# row.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to sem_compile.py. This
+# work is published from: United States.
+
+from typing import Callable, Dict, List, Tuple, Union
+from tinyast import *
+from sem import Memory, MemorySet, Row
+import operator
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+# '/' is integer (floor) division, as in sem.f_binop
+BINOPS = {'+': operator.add,
+          '-': operator.sub,
+          '*': operator.mul,
+          '/': operator.floordiv}
+
+# only those supported by sem.f_cmpop, with the operator that
+# implements their negation
+CMPOPS = {'<': (operator.lt, operator.ge),
+          '>': (operator.gt, operator.le),
+          '<=': (operator.le, operator.gt),
+          '>=': (operator.ge, operator.lt),
+          '!=': (operator.ne, operator.eq)}
+
+# a set of rows, in insertion order
+Rows = Dict[Row, None]
+CompiledExpr = Callable[[Row], Scalar]
+CompiledCmd = Callable[[Rows], Rows]
+
+def program_variables(C: Node) -> List[str]:
+    """Returns the names of all variables in C, in order of appearance"""
+    return list(dict.fromkeys([v.name for v in var_nodes(C)]))
+
+def compile_Expr(E: Expr, index: Dict[str, int]) -> Union[CompiledExpr, Scalar]:
+    """Compiles E to a function of a row, or a Scalar if E is constant"""
+    if isinstance(E, Scalar):
+        return E
+    elif isinstance(E, Var):
+        return operator.itemgetter(index[E.name])
+    elif isinstance(E, BinOp):
+        if E.op not in BINOPS:
+            raise NotImplementedError(f"Unknown operator: {E.op}")
+
+        f = BINOPS[E.op]
+
+        # specialise on the kinds of operands, to save a call per operand
+        if isinstance(E.left, Scalar) and isinstance(E.right, Scalar):
+            # fold constants, unless that would raise before any
+            # memory reaches this expression
+            if E.op != '/' or E.right != 0:
+                return f(E.left, E.right)
+
+            c, d = E.left, E.right
+            return lambda row: f(c, d)
+        elif isinstance(E.left, Var) and isinstance(E.right, Scalar):
+            i, c = index[E.left.name], E.right
+            return lambda row: f(row[i], c)
+        elif isinstance(E.left, Scalar) and isinstance(E.right, Var):
+            c, j = E.left, index[E.right.name]
+            return lambda row: f(c, row[j])
+        elif isinstance(E.left, Var) and isinstance(E.right, Var):
+            i, j = index[E.left.name], index[E.right.name]
+            return lambda row: f(row[i], row[j])
+
+        left = _as_function(compile_Expr(E.left, index))
+        right = _as_function(compile_Expr(E.right, index))
+        return lambda row: f(left(row), right(row))
+    else:
+        raise NotImplementedError(f"Don't know how to compile {type(E).__name__}({E})")
+
+def _as_function(e: Union[CompiledExpr, Scalar]) -> CompiledExpr:
+    if isinstance(e, Scalar):
+        return lambda _: e
+
+    return e
+
+def compile_filter(B: BoolExpr, index: Dict[str, int], res = True) -> CompiledCmd:
+    if B.op not in CMPOPS:
+        raise NotImplementedError(f"Unknown comparison operator: {B.op}")
+
+    f = CMPOPS[B.op][0 if res else 1]
+    i, c = index[B.left.name], B.right
+
+    return lambda rows: dict.fromkeys([row for row in rows if f(row[i], c)])
+
+def _compile_assign(i: int, value: Union[CompiledExpr, Scalar]) -> CompiledCmd:
+    if isinstance(value, Scalar):
+        v = (value,)
+        return lambda rows: dict.fromkeys([row[:i] + v + row[i+1:] for row in rows])
+
+    return lambda rows: dict.fromkeys([row[:i] + (value(row),) + row[i+1:] for row in rows])
+
+def compile_Cmd(C: Cmd, index: Dict[str, int]) -> CompiledCmd:
+    if isinstance(C, Skip):
+        return lambda rows: rows
+    elif isinstance(C, Program):
+        return compile_Cmd(C.program, index)
+    elif isinstance(C, Assign):
+        return _compile_assign(index[C.left.name], compile_Expr(C.right, index))
+    elif isinstance(C, Input):
+        i = index[C.var.name]
+        def input_(rows):
+            n = random.randint(0, 100) # could be anything, actually
+            return _compile_assign(i, n)(rows)
+
+        return input_
+    elif isinstance(C, Seq):
+        cmd0 = compile_Cmd(C.cmd0, index)
+        cmd1 = compile_Cmd(C.cmd1, index)
+        return lambda rows: cmd1(cmd0(rows))
+    elif isinstance(C, Block):
+        cmds = [compile_Cmd(c, index) for c in C.cmds]
+        def block(rows):
+            for c in cmds:
+                rows = c(rows)
+
+            return rows
+
+        return block
+    elif isinstance(C, IfThenElse):
+        then_ = compile_Cmd(C.then_, index)
+        else_ = compile_Cmd(C.else_, index)
+        true_filter = compile_filter(C.cond, index)
+        false_filter = compile_filter(C.cond, index, res = False)
+
+        def ite(rows):
+            # both filters return fresh dicts, so out can be updated in place
+            out = then_(true_filter(rows))
+            out.update(else_(false_filter(rows)))
+            return out
+
+        return ite
+    elif isinstance(C, While):
+        body = compile_Cmd(C.body, index)
+        true_filter = compile_filter(C.cond, index)
+        false_filter = compile_filter(C.cond, index, res = False)
+
+        # semi-naive, as sem.evaluate_While, but without looking for
+        # memories that never leave the loop
+        def while_(rows):
+            pre_iter_rows = true_filter(rows)
+            seen = dict(pre_iter_rows)
+            accum: Rows = {}
+            while len(pre_iter_rows):
+                after_iter_rows = body(pre_iter_rows)
+                accum.update(after_iter_rows)
+                pre_iter_rows = dict.fromkeys([row for row in true_filter(after_iter_rows) if row not in seen])
+                seen.update(pre_iter_rows)
+
+            out = dict(rows)
+            out.update(accum)
+            return false_filter(out)
+
+        return while_
+    else:
+        raise NotImplementedError(f"Don't know how to compile {type(C).__name__}({C})")
+
+class CompiledProgram(object):
+    """A program compiled to closures.
+
+    Closures are compiled once for every layout of input variables
+    the program is run on. Unlike sem.evaluate_Cmd, reading a variable
+    that is not defined raises a TypeError.
+    """
+    def __init__(self, P: Program):
+        self.program = P
+        self.variables = program_variables(P)
+        self._compiled: Dict[Tuple[str, ...], CompiledCmd] = {}
+
+    def _layout(self, variables: Tuple[str, ...]) -> Tuple[str, ...]:
+        return variables + tuple([x for x in self.variables if x not in variables])
+
+    def __call__(self, M: Union[MemorySet, List[Memory]]) -> Union[MemorySet, List[Memory]]:
+        if not isinstance(M, MemorySet):
+            return self(MemorySet.from_memories(M)).to_memories()
+
+        layout = self._layout(M.variables)
+        if layout not in self._compiled:
+            logger.debug(f"compiling {self.program} for {layout}")
+            self._compiled[layout] = compile_Cmd(self.program, dict([(x, i) for i, x in enumerate(layout)]))
+
+        return MemorySet(layout, self._compiled[layout](M.reorder(layout).rows))
+
+def compile_program(P: Program) -> CompiledProgram:
+    return CompiledProgram(P)
+
+def test_program_variables():
+    x = Var('x')
+    y = Var('y')
+    z = Var('z')
+
+    p = Program(sequence([Input(z),
+                          While(BoolExpr('<', x, 7), Assign(y, BinOp('+', x, 1)))]))
+
+    assert program_variables(p) == ['z', 'x', 'y'], program_variables(p)
+
+def test_compile_program():
+    from sem import evaluate_Cmd
+
+    x = Var('x')
+    y = Var('y')
+    z = Var('z')
+
+    M_in = [{'x': 5, 'y': 6}, {'x': 8, 'y': 7}, {'x': 4, 'y': 0}]
+
+    programs = [Program(Skip()),
+                Program(Assign(x, 9)),
+                Program(Input(y)),
+                Program(Assign(z, BinOp('*', BinOp('+', x, 1), BinOp('-', 2, 3)))),
+                Program(sequence([Assign(x, BinOp('*', x, 10)), Assign(y, BinOp('/', x, 3))])),
+                Program(IfThenElse(BoolExpr('>', x, 7),
+                                   Assign(y, BinOp('-', x, 7)),
+                                   Assign(y, BinOp('-', 7, x)))),
+                Program(While(BoolExpr('<', x, 7),
+                              Seq(Assign(y, BinOp('-', y, 1)),
+                                  Assign(x, BinOp('+', x, 1))))),
+                # a branch that no memory takes is never evaluated
+                Program(IfThenElse(BoolExpr('>', x, 100), Assign(y, BinOp('/', 1, 0)), Skip())),
+                ]
+
+    for p in programs:
+        cp = compile_program(p)
+
+        random.seed(0)
+        M_out = MemorySet.from_memories(evaluate_Cmd(p, M_in))
+        random.seed(0)
+        M_out_c = MemorySet.from_memories(cp(M_in))
+
+        assert M_out == M_out_c, f"{p}: {M_out} != {M_out_c}"
+
+        # compiled closures are reused
+        assert cp(MemorySet.from_memories(M_in)) is not None
+        assert len(cp._compiled) == 1
+
+    try:
+        compile_program(Program(Assign(y, BinOp('/', 1, 0))))(M_in)
+        assert False, "Expected ZeroDivisionError"
+    except ZeroDivisionError:
+        pass
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.DEBUG)
+    test_program_variables()
+    test_compile_program()
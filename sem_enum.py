@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+#
+# sem_enum.py
+#
+# Exhaustive enumeration of the concrete semantics, where every Input
+# takes every value of a bounded domain instead of one random value.
+#
+# The reachable memories are the ground truth that abstract results
+# are checked against, and there can be millions of them. So memories
+# flow through the program as a stream of MemorySet chunks. An Input
+# turns a chunk into chunks for its values, lazily, and the other
+# commands run on one chunk at a time with sem.evaluate_Cmd. An Input
+# puts as many values in a chunk as fit in the chunk size. Only a chunk
+# per Input is alive at once, whatever the product of the input ranges.
+#
+# A chunk is only free of duplicates within itself: the same memory
+# can be in more than one chunk. A While whose body has an Input needs
+# the whole set of memories in the loop, so it runs on one chunk at a
+# time, with every Input enumerated by sem.evaluate_Cmd.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to sem_enum.py. This
+# work is published from: United States.
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+from tinyast import *
+from sem import Memory, MemorySet, evaluate_Cmd, input_values
+import sem
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+Domain = Union[Sequence[int], Dict[str, Sequence[int]]]
+
+class Progress(object):
+    """Counts the chunks and memories that a stream has yielded, and
+    calls report with itself at most every interval seconds"""
+    def __init__(self, report: Optional[Callable[['Progress'], None]] = None, interval: float = 1.0):
+        self.report = report
+        self.interval = interval
+        self.chunks = 0
+        self.memories = 0
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def update(self, chunk: MemorySet):
+        self.chunks += 1
+        self.memories += len(chunk)
+        if self.report is not None:
+            now = time.perf_counter()
+            if now - self.last >= self.interval:
+                self.last = now
+                self.report(self)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    @property
+    def rate(self) -> float:
+        """Memories per second"""
+        t = self.elapsed
+        return self.memories / t if t > 0 else 0.0
+
+    def __str__(self):
+        return f"{self.memories} memories in {self.chunks} chunks, {self.elapsed:.1f} s ({self.rate:.0f}/s)"
+
+def log_progress(p: Progress):
+    logger.info(str(p))
+
+def _has_input(C: Node, memo: Dict[int, bool]) -> bool:
+    out = memo.get(id(C))
+    if out is None:
+        out = memo[id(C)] = any([isinstance(n, Input) for n in walk(C)])
+
+    return out
+
+def _exhaustive(C: Cmd, M: MemorySet, domain: Domain) -> MemorySet:
+    old = sem.input_domain
+    sem.input_domain = domain
+    try:
+        return evaluate_Cmd(C, M)
+    finally:
+        sem.input_domain = old
+
+class _Enumerator(object):
+    def __init__(self, domain: Domain, chunk_size: int):
+        self.domain = domain
+        self.chunk_size = chunk_size
+        self.memo: Dict[int, bool] = {}
+
+    def stream(self, C: Cmd, chunk: MemorySet) -> Iterator[MemorySet]:
+        """Yields chunks whose union is C run on chunk"""
+        if not len(chunk): return
+
+        if not _has_input(C, self.memo):
+            yield evaluate_Cmd(C, chunk)
+        elif isinstance(C, Input):
+            # as many values per chunk as fit
+            values = list(input_values(self.domain, C.var.name))
+            k = max(1, self.chunk_size // len(chunk))
+            for i in range(0, len(values), k):
+                out = MemorySet(chunk.variables, symbols = chunk.symbols)
+                for v in values[i:i+k]:
+                    out.update(chunk.assign(C.var.name, lambda _, v = v: v))
+
+                yield out
+        elif isinstance(C, (Seq, Block)):
+            yield from self.pipeline(C.cmds if isinstance(C, Block) else [C.cmd0, C.cmd1], chunk)
+        elif isinstance(C, IfThenElse):
+            yield from self.stream(C.then_, chunk.filter(C.cond))
+            yield from self.stream(C.else_, chunk.filter(C.cond, res = False))
+        elif isinstance(C, While):
+            yield _exhaustive(C, chunk, self.domain)
+        else:
+            raise NotImplementedError(f"Don't know how to enumerate {type(C).__name__}({C})")
+
+    def pipeline(self, cmds: List[Cmd], chunk: MemorySet) -> Iterator[MemorySet]:
+        # runs of commands without an Input are one stage, so that the
+        # generators only nest as deep as there are Inputs
+        stages: List[List[Cmd]] = []
+        for c in cmds:
+            if _has_input(c, self.memo) or not len(stages) or _has_input(stages[-1][-1], self.memo):
+                stages.append([c])
+            else:
+                stages[-1].append(c)
+
+        out: Iterable[MemorySet] = [chunk]
+        for s in stages:
+            out = self._stage(s[0] if len(s) == 1 else Block(s), out)
+
+        return iter(out)
+
+    def _stage(self, C: Cmd, chunks: Iterable[MemorySet]) -> Iterator[MemorySet]:
+        for chunk in chunks:
+            yield from self.stream(C, chunk)
+
+def _chunks(M: MemorySet, size: int) -> Iterator[MemorySet]:
+    rows = list(M.rows)
+    for i in range(0, len(rows), size):
+        yield MemorySet(M.variables, rows[i:i+size], M.symbols)
+
+def enumerate_Cmd(C: Cmd, M: Union[MemorySet, List[Memory]], domain: Domain = range(0, 101),
+                  chunk_size: int = 10000, progress: Optional[Progress] = None) -> Iterator[MemorySet]:
+    """Yields chunks of the memories that C leads the memories M to, when
+    every Input takes every value in domain, a sequence, or a dict of
+    sequences by variable. Chunks of M have at most chunk_size memories,
+    and so does every chunk yielded, unless a While has an Input in its
+    body."""
+    if not isinstance(M, MemorySet): M = MemorySet.from_memories(M, getattr(C, 'symbols', None))
+
+    symbols = None
+    if isinstance(C, Program):
+        symbols = C.symbols
+        M = M.laid_out(symbols)
+        C = C.program
+
+    e = _Enumerator(domain, chunk_size)
+    for chunk in _chunks(M, chunk_size):
+        for out in e.stream(C, chunk):
+            if symbols is not None: out = out.laid_out(None)
+            if progress is not None: progress.update(out)
+            yield out
+
+def collect(chunks: Iterable[MemorySet]) -> MemorySet:
+    """Returns the union of chunks"""
+    out = None
+    for c in chunks:
+        if out is None:
+            out = MemorySet(c.variables)
+
+        out.update(c)
+
+    return out if out is not None else MemorySet(())
+
+def test_enumerate_Cmd():
+    import itertools
+    from tinyparse import parse
+
+    p = parse("input(x); input(y); z := (x - y); if(z > 0) { input(w) } else { w := 0 }")
+    M_out = list(enumerate_Cmd(p, [{}], domain = range(-3, 4), chunk_size = 5))
+
+    expected = MemorySet.from_memories([{'x': x, 'y': y, 'z': x - y, 'w': w if x - y > 0 else 0}
+                                        for x, y, w in itertools.product(range(-3, 4), repeat = 3)])
+    assert collect(M_out) == expected
+    assert max([len(c) for c in M_out]) <= 5
+
+    # domains by variable, and chunks of the input
+    domain = {'x': range(10), 'y': [0, 1]}
+    M_in = [{'v': i} for i in range(25)]
+    progress = Progress()
+    chunks = list(enumerate_Cmd(parse("input(x); input(y); v := (v + (x * y))"), M_in, domain, 10, progress))
+    assert max([len(c) for c in chunks]) <= 10
+    assert progress.memories == 25 * 20 and progress.chunks == len(chunks) and "500 memories" in str(progress)
+    assert len(collect(chunks)) == len(set([(v + x * y, x, y) for v in range(25) for x in range(10) for y in [0, 1]]))
+
+    # a loop with an Input in its body enumerates every choice
+    q = parse("c := 0; while(x > 0) { input(d); x := (x - d); c := (c + 1) }")
+    out = collect(enumerate_Cmd(q, [{'x': 3}], domain = [1, 2]))
+    assert sorted(set([(m['c'], m['x']) for m in out.to_memories()])) == [(2, -1), (2, 0), (3, -1), (3, 0)]
+    assert sem.input_domain is None
+
+    # without Inputs, it is evaluate_Cmd
+    r = parse("while(x < 10) { x := (x + 1) }")
+    assert collect(enumerate_Cmd(r, [{'x': i} for i in range(20)], chunk_size = 7)) == \
+        MemorySet.from_memories(evaluate_Cmd(r, [{'x': i} for i in range(20)]))
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.INFO)
+    test_enumerate_Cmd()
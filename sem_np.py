@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+#
+# sem_np.py
+#
+# A columnar implementation of the concrete semantics using NumPy.
+#
+# A set of memories is stored as one integer column per variable, so
+# expressions are evaluated as whole-column array operations and
+# conditions become boolean masks. Results can be compared with the
+# list-of-dicts interpreter in sem.py.
+#
+# Note values are int64, so unlike sem.py, arithmetic can overflow.
+#
+# Loops are semi-naive, as in sem.evaluate_While: the body only runs on
+# memories the loop has not seen, and memories that cycle are reported
+# with a NonTerminationWarning and left out of the result.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to sem_np.py. This work
+# is published from: United States.
+
+from typing import Dict, List, Optional, Tuple
+from tinyast import *
+from sem import Memory, NonTerminationWarning, _nonterminating, _SOURCE
+import random
+import logging
+import warnings
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def _floor_divide(left, right):
+    if np.any(np.asarray(right) == 0):
+        raise ZeroDivisionError("integer division by zero")
+
+    return np.floor_divide(left, right)
+
+# '/' is integer (floor) division, as in sem.f_binop
+BINOPS = {'+': np.add,
+          '-': np.subtract,
+          '*': np.multiply,
+          '/': _floor_divide}
+
+# only those supported by sem.f_cmpop
+CMPOPS = {'<': np.less,
+          '>': np.greater,
+          '<=': np.less_equal,
+          '>=': np.greater_equal,
+          '!=': np.not_equal}
+
+class ColumnarMemories(object):
+    """A set of memories, stored as one int64 column per variable.
+
+    Memories need not define every variable. A variable that some
+    memories do not define has a boolean column in self.defined, and
+    its value in those memories is 0. Rows are not guaranteed to be
+    unique, use unique() to remove duplicates.
+    """
+    def __init__(self, columns: Dict[str, np.ndarray], size: int,
+                 defined: Optional[Dict[str, np.ndarray]] = None):
+        self.columns = columns
+        self.size = size
+        self.defined = defined or {}
+
+    @classmethod
+    def from_memories(cls, M: List[Memory]) -> 'ColumnarMemories':
+        names: Dict[str, None] = {}
+        for m in M:
+            names.update(dict.fromkeys(m))
+
+        columns = {}
+        defined = {}
+        for x in sorted(names):
+            columns[x] = np.fromiter((m.get(x, 0) for m in M), dtype = np.int64, count = len(M))
+
+            d = np.fromiter((x in m for m in M), dtype = bool, count = len(M))
+            if not d.all(): defined[x] = d
+
+        return cls(columns, len(M), defined)
+
+    def to_memories(self) -> List[Memory]:
+        names = list(self.columns)
+        values = [self.columns[x].tolist() for x in names]
+
+        if len(self.defined) == 0:
+            return [dict(zip(names, row)) for row in zip(*values)]
+
+        defined = [self.defined[x].tolist() if x in self.defined else [True] * self.size for x in names]
+        return [dict([(x, v) for x, v, d in zip(names, row, drow) if d])
+                for row, drow in zip(zip(*values), zip(*defined))]
+
+    def __len__(self):
+        return self.size
+
+    def column(self, var: str) -> np.ndarray:
+        """Returns the values of var, which all memories must define"""
+        if var not in self.columns or (var in self.defined and not self.defined[var].all()):
+            raise KeyError(var)
+
+        return self.columns[var]
+
+    def select(self, mask: np.ndarray) -> 'ColumnarMemories':
+        return ColumnarMemories(dict([(x, c[mask]) for x, c in self.columns.items()]),
+                                int(np.count_nonzero(mask)),
+                                dict([(x, d[mask]) for x, d in self.defined.items()]))
+
+    def assign(self, var: str, value) -> 'ColumnarMemories':
+        columns = dict(self.columns)
+        columns[var] = np.array(np.broadcast_to(value, (self.size,)), dtype = np.int64)
+
+        defined = dict(self.defined)
+        defined.pop(var, None)
+        return ColumnarMemories(columns, self.size, defined)
+
+    def drop(self, var: str) -> 'ColumnarMemories':
+        columns = dict(self.columns)
+        del columns[var]
+        defined = dict(self.defined)
+        defined.pop(var, None)
+        return ColumnarMemories(columns, self.size, defined)
+
+    def _pad(self, names) -> 'ColumnarMemories':
+        """Returns this set over names, with the variables it lacks undefined"""
+        missing = [x for x in names if x not in self.columns]
+        if len(missing) == 0: return self
+
+        columns = dict(self.columns)
+        defined = dict(self.defined)
+        for x in missing:
+            columns[x] = np.zeros(self.size, dtype = np.int64)
+            defined[x] = np.zeros(self.size, dtype = bool)
+
+        return ColumnarMemories(columns, self.size, defined)
+
+    def _matrix(self, names, partial):
+        # undefined variables get an extra 0/1 column, so that they stay
+        # distinct from defined variables with value 0
+        cols = [self.columns[x] for x in names]
+        cols.extend([self.defined[x] if x in self.defined else np.ones(self.size, dtype = bool)
+                     for x in partial])
+        if len(cols) == 0: return np.empty((self.size, 0), dtype = np.int64)
+
+        return np.stack(cols, axis = 1).astype(np.int64, copy = False)
+
+    def union(self, other: 'ColumnarMemories') -> 'ColumnarMemories':
+        """Returns the union of both memory sets, with duplicates removed"""
+        names = sorted(set(self.columns) | set(other.columns))
+        left, right = self._pad(names), other._pad(names)
+        partial = sorted(set(left.defined) | set(right.defined))
+
+        rows = np.concatenate([left._matrix(names, partial), right._matrix(names, partial)])
+        return ColumnarMemories._from_matrix(names, partial, rows)
+
+    def unique(self) -> 'ColumnarMemories':
+        names = sorted(self.columns)
+        partial = sorted(self.defined)
+        return ColumnarMemories._from_matrix(names, partial, self._matrix(names, partial))
+
+    def extend(self, other: 'ColumnarMemories') -> Tuple['ColumnarMemories', np.ndarray, 'ColumnarMemories']:
+        """Appends the memories of other that are not in this set, which
+        must not have duplicates. Returns the extended set, the position of
+        each memory of other in it, and the memories that were appended,
+        in order."""
+        names = sorted(set(self.columns) | set(other.columns))
+        left, right = self._pad(names), other._pad(names)
+        partial = sorted(set(left.defined) | set(right.defined))
+
+        n = self.size
+        rows = np.concatenate([left._matrix(names, partial), right._matrix(names, partial)])
+        _, first, inverse = np.unique(rows, axis = 0, return_index = True, return_inverse = True)
+        first = first[inverse.reshape(-1)[n:]]
+
+        # memories of other are numbered after those of self, in the
+        # order they first appear in other
+        appended = np.unique(first[first >= n])
+        pos = np.where(first >= n, n + np.searchsorted(appended, first), first)
+
+        extended = ColumnarMemories._from_matrix(names, partial, rows[np.concatenate([np.arange(n), appended])], False)
+        new = ColumnarMemories._from_matrix(names, partial, rows[appended], False)
+        return extended, pos, new
+
+    @staticmethod
+    def _from_matrix(names, partial, rows, unique = True):
+        if len(names) == 0:
+            # memories without variables are all the same memory
+            return ColumnarMemories({}, min(rows.shape[0], 1))
+
+        if unique: rows = np.unique(rows, axis = 0)
+        columns = dict([(x, np.ascontiguousarray(rows[:, i])) for i, x in enumerate(names)])
+        defined = {}
+        for i, x in enumerate(partial):
+            d = rows[:, len(names) + i].astype(bool)
+            if not d.all(): defined[x] = d
+
+        return ColumnarMemories(columns, rows.shape[0], defined)
+
+def evaluate_Expr_np(E: Expr, M: ColumnarMemories):
+    """Evaluates E over all memories, returns a column or a scalar.
+    M must not be empty."""
+    if isinstance(E, Scalar):
+        return np.int64(E)
+    elif isinstance(E, Var):
+        return M.column(E.name)
+    elif isinstance(E, BinOp):
+        if E.op not in BINOPS:
+            raise NotImplementedError(f"Unknown operator: {E.op}")
+
+        return BINOPS[E.op](evaluate_Expr_np(E.left, M),
+                            evaluate_Expr_np(E.right, M))
+
+def evaluate_BoolExpr_np(B: BoolExpr, M: ColumnarMemories) -> np.ndarray:
+    if B.op not in CMPOPS:
+        raise NotImplementedError(f"Unknown comparison operator: {B.op}")
+
+    return CMPOPS[B.op](M.column(B.left.name), B.right)
+
+def filter_memory_np(B: BoolExpr, M: ColumnarMemories, res = True) -> ColumnarMemories:
+    if len(M) == 0: return M
+
+    mask = evaluate_BoolExpr_np(B, M)
+    return M.select(mask if res else ~mask)
+
+def evaluate_Cmd_np(C: Cmd, M: ColumnarMemories) -> ColumnarMemories:
+    if isinstance(C, Skip):
+        return M
+    elif isinstance(C, Program):
+        return evaluate_Cmd_np(C.program, M)
+    elif isinstance(C, Assign):
+        # like sem.evaluate_Cmd, no memories means nothing is evaluated
+        if len(M) == 0: return M.assign(C.left.name, 0)
+        return M.assign(C.left.name, evaluate_Expr_np(C.right, M))
+    elif isinstance(C, Input):
+        n = random.randint(0, 100) # could be anything, actually
+        return M.assign(C.var.name, n)
+    elif isinstance(C, Seq):
+        return evaluate_Cmd_np(C.cmd1, evaluate_Cmd_np(C.cmd0, M))
+    elif isinstance(C, Block):
+        for c in C.cmds:
+            M = evaluate_Cmd_np(c, M)
+
+        return M
+    elif isinstance(C, IfThenElse):
+        then_memory = evaluate_Cmd_np(C.then_, filter_memory_np(C.cond, M))
+        else_memory = evaluate_Cmd_np(C.else_, filter_memory_np(C.cond, M, res = False))
+
+        return then_memory.union(else_memory)
+    elif isinstance(C, While):
+        return evaluate_While_np(C, M)
+    else:
+        raise NotImplementedError(f"Don't know how to interpret {type(C).__name__}({C})")
+
+def evaluate_While_np(C: While, M: ColumnarMemories) -> ColumnarMemories:
+    """sem.evaluate_While, column-wise. A memory's id is its position
+    in the set of memories that entered the loop."""
+    out = filter_memory_np(C.cond, M, res = False).unique()
+    seen = frontier = filter_memory_np(C.cond, M).unique()
+
+    src: List[np.ndarray] = []
+    dst: List[np.ndarray] = []
+    exits: List[np.ndarray] = []
+    revisited = False
+    tag = f"{_SOURCE}{id(C)}"
+    while len(frontier):
+        ids = np.arange(len(seen) - len(frontier), len(seen), dtype = np.int64)
+        after = evaluate_Cmd_np(C.body, frontier.assign(tag, ids))
+        source = after.columns[tag]
+        after = after.drop(tag)
+
+        mask = evaluate_BoolExpr_np(C.cond, after) if len(after) else np.zeros(0, dtype = bool)
+        exits.append(source[~mask])
+        out = out.union(after.select(~mask))
+
+        seen, pos, frontier = seen.extend(after.select(mask))
+        src.append(source[mask])
+        dst.append(pos)
+        revisited = revisited or len(frontier) < np.count_nonzero(mask)
+        logger.debug(f"seen: {len(seen)} memories")
+
+    if revisited:
+        edges = list(zip(np.concatenate(src).tolist(), np.concatenate(dst).tolist()))
+        stuck = _nonterminating(len(seen), edges, dict.fromkeys(np.concatenate(exits).tolist()))
+        if len(stuck):
+            mask = np.zeros(len(seen), dtype = bool)
+            mask[stuck] = True
+            warnings.warn(NonTerminationWarning(C, seen.select(mask).to_memories()), stacklevel = 2)
+
+    return out
+
+def evaluate_Cmd_columnar(C: Cmd, M: List[Memory]) -> List[Memory]:
+    """Like sem.evaluate_Cmd, but evaluated column-wise"""
+    return evaluate_Cmd_np(C, ColumnarMemories.from_memories(M)).to_memories()
+
+def same_memories(M0: List[Memory], M1: List[Memory]) -> bool:
+    """Checks if two lists of memories contain the same set of memories"""
+    return set([frozenset(m.items()) for m in M0]) == set([frozenset(m.items()) for m in M1])
+
+def test_ColumnarMemories():
+    M = [{'x': 5, 'y': 6}, {'x': 8, 'y': 7}, {'x': 5, 'y': 6}]
+    cm = ColumnarMemories.from_memories(M)
+
+    assert len(cm) == 3
+    assert same_memories(cm.to_memories(), M)
+    assert len(cm.unique()) == 2
+    assert len(cm.union(cm)) == 2
+
+    # memories need not define the same variables
+    M2 = [{'x': 1}, {'y': 1}, {'x': 0}]
+    cm2 = ColumnarMemories.from_memories(M2)
+    assert same_memories(cm2.to_memories(), M2)
+    assert same_memories(cm2.union(cm).to_memories(), M2 + M)
+
+    try:
+        cm2.column('x')
+        assert False, "Expected KeyError"
+    except KeyError:
+        pass
+
+def test_evaluate_Cmd_np():
+    from sem import evaluate_Cmd
+
+    x = Var('x')
+    y = Var('y')
+    z = Var('z')
+
+    M_in = [{'x': 5, 'y': 6}, {'x': 8, 'y': 7}, {'x': 4, 'y': 0}]
+
+    programs = [Program(Skip()),
+                Program(Assign(x, 9)),
+                Program(Input(y)),
+                Program(sequence([Assign(x, BinOp('*', x, 10)), Assign(y, BinOp('/', x, 3))])),
+                Program(IfThenElse(BoolExpr('>', x, 7),
+                                   Assign(y, BinOp('-', x, 7)),
+                                   Assign(y, BinOp('-', 7, x)))),
+                Program(While(BoolExpr('<', x, 7),
+                              Seq(Assign(y, BinOp('-', y, 1)),
+                                  Assign(x, BinOp('+', x, 1))))),
+                # branches and loops that define new variables
+                Program(IfThenElse(BoolExpr('>', x, 7), Assign(z, 1), Skip())),
+                Program(While(BoolExpr('<', x, 7),
+                              Seq(Assign(z, x),
+                                  Assign(x, BinOp('+', x, 1))))),
+                # a branch that no memory takes is never evaluated
+                Program(IfThenElse(BoolExpr('>', x, 100), Assign(y, BinOp('/', 1, 0)), Skip())),
+                ]
+
+    for p in programs:
+        for M in [M_in, []]:
+            random.seed(0)
+            M_out = evaluate_Cmd(p, M)
+            random.seed(0)
+            M_out_np = evaluate_Cmd_columnar(p, M)
+
+            assert same_memories(M_out, M_out_np), f"{p}: {M_out} != {M_out_np}"
+
+    assert evaluate_Cmd_columnar(Program(Assign(x, BinOp('+', y, 1))), []) == []
+
+def test_While_np():
+    from sem import evaluate_Cmd
+    from tinyparse import parse
+
+    # memories that cycle are reported and left out, as in sem.py
+    c = parse("while(x < 10) { if(x > 5) { x := (x - 1) } else { x := (x + 1) } }")
+    with warnings.catch_warnings(record = True) as w:
+        warnings.simplefilter('always')
+        M_out = evaluate_Cmd_columnar(c, [{'x': 3}, {'x': 20}])
+
+    assert M_out == [{'x': 20}]
+    assert len(w) == 1 and issubclass(w[0].category, NonTerminationWarning), w
+    assert sorted([m['x'] for m in w[0].message.states]) == [3, 4, 5, 6]
+
+    # only memories that can't leave are reported
+    d = parse("while(x < 10) { if(x > 5) { x := (x + 0) } else { x := (x + 5) } }")
+    with warnings.catch_warnings(record = True) as w:
+        warnings.simplefilter('always')
+        assert evaluate_Cmd_columnar(d, [{'x': 0}, {'x': 1}, {'x': 7}]) == [{'x': 10}]
+
+    assert [sorted([m['x'] for m in x.message.states]) for x in w] == [[1, 6, 7]]
+
+    # memories on the same path, and nested loops that add variables
+    for p in ["while(x < 10) { x := (x + 1) }",
+              "while(x < 4) { z := 0; while(z < 3) { z := (z + 1) }; x := (x + 1) }"]:
+        M_in = [{'x': i} for i in range(-5, 12)] + [{'x': 0, 'y': 1}]
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            assert same_memories(evaluate_Cmd_columnar(parse(p), M_in), evaluate_Cmd(parse(p), M_in)), p
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.DEBUG)
+    test_ColumnarMemories()
+    test_evaluate_Cmd_np()
+    test_While_np()
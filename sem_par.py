@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+#
+# sem_par.py
+#
+# A parallel implementation of the concrete semantics, over a set of
+# memories sharded across worker processes.
+#
+# Every worker runs the whole program on its shard with sem.py, in
+# lockstep with the others. Memories are partitioned by the hash of
+# their row, so equal memories always end up on the same worker and
+# duplicates can be removed locally. Workers only synchronise where
+# sem.evaluate_Cmd removes duplicates: at the join of an IfThenElse and
+# on every round of a While. There they exchange the memories that
+# changed owners directly with each other (a hash-partitioned union),
+# and the While rounds also agree on whether any shard still has
+# memories that enter the loop. No process holds the whole set until
+# the results are collected.
+#
+# Loops are semi-naive, as in sem.evaluate_While: each shard remembers
+# the memories it owns that entered the loop, and the body only runs on
+# new ones, so memories that cycle do not hang the workers. They are
+# left out of the result as in sem.py, but without a
+# NonTerminationWarning, since the paths they take span the shards.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to sem_par.py. This work
+# is published from: United States.
+
+from typing import Dict, List, Optional
+from tinyast import *
+from sem import Memory, MemorySet, evaluate_Cmd
+from batch import encode_program, decode_program
+import sem
+import multiprocessing
+import queue
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _owner(row, n: int) -> int:
+    # hash(None) need not be the same in every process
+    if None in row: row = tuple([('undefined',) if v is None else v for v in row])
+    return hash(row) % n
+
+class _Comm(object):
+    """The channels between the workers, one inbox each"""
+    def __init__(self, rank: int, inboxes: list):
+        self.rank = rank
+        self.inboxes = inboxes
+        self.n = len(inboxes)
+        self.seq = 0
+        self.early: Dict[int, list] = {} # messages for later exchanges
+
+    def exchange(self, payloads: list) -> list:
+        """Sends payloads[j] to worker j, and returns what every worker
+        sent to this one, by sender"""
+        self.seq += 1
+        for j, p in enumerate(payloads):
+            if j != self.rank: self.inboxes[j].put((self.seq, self.rank, p))
+
+        got = {self.rank: payloads[self.rank]}
+        for r, p in self.early.pop(self.seq, []):
+            got[r] = p
+
+        while len(got) < self.n:
+            seq, r, p = self.inboxes[self.rank].get()
+            if seq == self.seq:
+                got[r] = p
+            else:
+                self.early.setdefault(seq, []).append((r, p))
+
+        return [got[r] for r in range(self.n)]
+
+    def any(self, flag: bool) -> bool:
+        return any(self.exchange([flag] * self.n))
+
+    def shuffle(self, M: MemorySet) -> MemorySet:
+        """Returns the memories of every shard that this worker owns"""
+        buckets: List[list] = [[] for _ in range(self.n)]
+        for row in M.rows:
+            buckets[_owner(row, self.n)].append(row)
+
+        out = MemorySet(M.variables)
+        for variables, rows in self.exchange([(M.variables, b) for b in buckets]):
+            out.update(MemorySet(variables, rows))
+
+        return out
+
+def evaluate_Cmd_shard(C: Cmd, M: MemorySet, comm: _Comm) -> MemorySet:
+    """sem.evaluate_Cmd on one shard. Every worker must call this with
+    the same command, in the same order."""
+    if isinstance(C, (Skip, Assign, Input)):
+        return evaluate_Cmd(C, M)
+    elif isinstance(C, Program):
+        return evaluate_Cmd_shard(C.program, M, comm)
+    elif isinstance(C, Seq):
+        return evaluate_Cmd_shard(C.cmd1, evaluate_Cmd_shard(C.cmd0, M, comm), comm)
+    elif isinstance(C, Block):
+        for c in C.cmds:
+            M = evaluate_Cmd_shard(c, M, comm)
+
+        return M
+    elif isinstance(C, IfThenElse):
+        then_memory = evaluate_Cmd_shard(C.then_, M.filter(C.cond), comm)
+        else_memory = evaluate_Cmd_shard(C.else_, M.filter(C.cond, res = False), comm)
+
+        return comm.shuffle(then_memory.union(else_memory))
+    elif isinstance(C, While):
+        # as in sem.evaluate_While, but the loop runs until no shard has
+        # new memories left that enter it. Equal memories have the same
+        # owner, so the memories a shard has seen are enough to tell
+        # whether one is new.
+        out = M.filter(C.cond, res = False)
+        seen = comm.shuffle(M.filter(C.cond))
+        frontier = MemorySet(seen.variables, seen.rows)
+        while comm.any(len(frontier) > 0):
+            after = comm.shuffle(evaluate_Cmd_shard(C.body, frontier, comm))
+            out.update(after.filter(C.cond, res = False))
+            frontier = MemorySet(seen.variables, seen.update(after.filter(C.cond)))
+
+        return comm.shuffle(out)
+    else:
+        raise NotImplementedError(f"Don't know how to interpret {type(C).__name__}({C})")
+
+def _worker(rank: int, inboxes: list, control, results):
+    comm = _Comm(rank, inboxes)
+    while True:
+        job = control.get()
+        if job is None: break
+
+        enc, variables, rows, seed, domain = job
+        # every worker makes the same Input choices
+        random.seed(seed)
+        sem.input_domain = domain
+        try:
+            out = evaluate_Cmd_shard(decode_program(enc), MemorySet(variables, rows), comm)
+            results.put((rank, None, out.variables, list(out.rows)))
+        except Exception as e:
+            results.put((rank, f"{type(e).__name__}: {e}", None, None))
+
+class ShardedInterpreter(object):
+    """A pool of workers processes that evaluate programs over sharded
+    sets of memories.
+
+    If any shard raises, the workers are restarted, since the others
+    would wait for it forever, and the error is raised as a
+    RuntimeError. So is a worker that dies, which is checked for every
+    poll seconds while waiting for the results.
+
+    Inputs read sem.input_domain as it is when run() is called.
+    """
+    def __init__(self, workers: Optional[int] = None, poll: float = 1.0):
+        self.n = workers or multiprocessing.cpu_count()
+        self.poll = poll
+        self.procs: List[multiprocessing.Process] = []
+
+    def _start(self):
+        ctx = multiprocessing.get_context()
+        self.inboxes = [ctx.Queue() for _ in range(self.n)]
+        self.controls = [ctx.Queue() for _ in range(self.n)]
+        self.results = ctx.Queue()
+        self.procs = [ctx.Process(target = _worker, args = (i, self.inboxes, self.controls[i], self.results), daemon = True)
+                      for i in range(self.n)]
+        for p in self.procs: p.start()
+
+    def close(self):
+        for c, p in zip(self.controls, self.procs):
+            if p.is_alive(): c.put(None)
+
+        for p in self.procs: p.join()
+        self.procs = []
+
+    def _kill(self):
+        for p in self.procs: p.terminate()
+        for p in self.procs: p.join()
+        self.procs = []
+
+    def _result(self):
+        while True:
+            try:
+                return self.results.get(timeout = self.poll)
+            except queue.Empty:
+                dead = [(i, p.exitcode) for i, p in enumerate(self.procs) if not p.is_alive()]
+                if len(dead):
+                    self._kill()
+                    raise RuntimeError(f"Worker {dead[0][0]} died with exit code {dead[0][1]}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if len(self.procs): self.close()
+
+    def run(self, C: Cmd, M: List[Memory]) -> List[Memory]:
+        if len(self.procs) == 0: self._start()
+
+        M_set = MemorySet.from_memories(M)
+        shards: List[list] = [[] for _ in range(self.n)]
+        for row in M_set.rows:
+            shards[_owner(row, self.n)].append(row)
+
+        enc = encode_program(C)
+        seed = random.getrandbits(64)
+        for c, rows in zip(self.controls, shards):
+            c.put((enc, M_set.variables, rows, seed, sem.input_domain))
+
+        out = None
+        errors = []
+        for _ in range(self.n):
+            rank, error, variables, rows = self._result()
+            if error is not None:
+                errors.append(error)
+                break
+
+            # shards are disjoint, so this adds every row
+            shard = MemorySet(variables, rows)
+            if out is None: out = shard
+            else: out.update(shard)
+
+        if len(errors):
+            self._kill()
+            raise RuntimeError(errors[0])
+
+        return out.to_memories()
+
+def evaluate_Cmd_sharded(C: Cmd, M: List[Memory], workers: Optional[int] = None) -> List[Memory]:
+    """Like sem.evaluate_Cmd, but on workers processes"""
+    with ShardedInterpreter(workers) as si:
+        return si.run(C, M)
+
+def test_evaluate_Cmd_sharded():
+    import warnings
+    from sem import NonTerminationWarning
+    from sem_np import same_memories
+
+    x = Var('x')
+    y = Var('y')
+    z = Var('z')
+
+    M_in = [{'x': i % 17, 'y': i} for i in range(200)] + [{'x': 3}]
+
+    programs = [Program(Skip()),
+                Program(Assign(x, 9)),
+                Program(sequence([Assign(x, BinOp('*', x, 10)), Assign(y, BinOp('/', x, 3))])),
+                Program(IfThenElse(BoolExpr('>', x, 7),
+                                   Assign(x, 7),
+                                   Assign(z, BinOp('-', 7, x)))),
+                Program(While(BoolExpr('<', x, 7),
+                              Seq(Assign(y, 1),
+                                  Assign(x, BinOp('+', x, 1))))),
+                Program(sequence([Input(z),
+                                  While(BoolExpr('<', x, 20),
+                                        IfThenElse(BoolExpr('>', x, 10),
+                                                   Assign(x, BinOp('+', x, 2)),
+                                                   Assign(x, BinOp('+', x, 1))))]))]
+
+    with ShardedInterpreter(3) as si:
+        for p in programs:
+            random.seed(1)
+            seed = random.getrandbits(64)
+            random.seed(seed)
+            expected = evaluate_Cmd(p, M_in)
+
+            random.seed(1)
+            out = si.run(p, M_in)
+            assert same_memories(out, expected), f"{p}: {len(out)} != {len(expected)}"
+
+        # an error on one shard stops them all, and the next run restarts them
+        try:
+            si.run(Program(Assign(x, BinOp('/', 1, BinOp('-', x, 3)))), M_in)
+            assert False, "Expected RuntimeError"
+        except RuntimeError as e:
+            assert "ZeroDivisionError" in str(e)
+
+        assert same_memories(si.run(programs[1], M_in), evaluate_Cmd(programs[1], M_in))
+
+        # memories that cycle don't hang the workers, and are left out
+        c = Program(While(BoolExpr('<', x, 10),
+                          IfThenElse(BoolExpr('>', x, 5),
+                                     Assign(x, BinOp('-', x, 1)),
+                                     Assign(x, BinOp('+', x, 1)))))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', NonTerminationWarning)
+            assert same_memories(si.run(c, M_in), evaluate_Cmd(c, M_in))
+
+        # Inputs take their values from sem.input_domain in the workers
+        sem.input_domain = [4]
+        try:
+            assert sorted(set([m['z'] for m in si.run(Program(Input(z)), M_in)])) == [4]
+        finally:
+            sem.input_domain = None
+
+        # a worker that dies doesn't hang run()
+        si.procs[0].terminate()
+        try:
+            si.run(programs[1], M_in)
+            assert False, "Expected RuntimeError"
+        except RuntimeError as e:
+            assert "died" in str(e)
+
+        assert same_memories(si.run(programs[1], M_in), evaluate_Cmd(programs[1], M_in))
+
+if __name__ == "__main__":
+    test_evaluate_Cmd_sharded()
@@ -12,7 +12,7 @@
 # copyright and related or neighboring rights to tinyast.py. This work
 # is published from: United States.
 
-from typing import Union
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Union
 from typing_extensions import Literal
 
 BinaryOps = Literal['+', '-', '*', '/']
@@ -22,6 +22,10 @@ class Node(object):
     pass
 
 class Var(Node):
+    # the variable's position in its program's SymbolTable, set by
+    # intern_variables()
+    slot: Optional[int] = None
+
     def __init__(self, name: str):
         self.name = name
 
@@ -69,7 +73,24 @@ class Seq(Cmd):
         self.cmd1 = cmd1
 
     def __str__(self):
-        return f"{str(self.cmd0)}; {str(self.cmd1)}"
+        # iterate down the right spine, which sequence() makes long
+        parts = []
+        c = self
+        while isinstance(c, Seq):
+            parts.append(str(c.cmd0))
+            c = c.cmd1
+
+        parts.append(str(c))
+        return "; ".join(parts)
+
+class Block(Cmd):
+    """A sequence of any number of commands, with no nesting"""
+    def __init__(self, cmds: List[Cmd]):
+        if len(cmds) == 0: raise ValueError("Can't make an empty Block")
+        self.cmds = cmds
+
+    def __str__(self):
+        return "; ".join([str(c) for c in self.cmds])
 
 class Assign(Cmd):
     def __init__(self, left: Var, right: Expr):
@@ -106,6 +127,7 @@ class While(Cmd):
 class Program(Node):
     def __init__(self, cmd: Cmd):
         self.program = cmd
+        self.symbols: Optional['SymbolTable'] = None
 
     def __str__(self):
         return f"{str(self.program)}"
@@ -116,9 +138,152 @@ def sequence(l: list) -> Seq:
 
     if len(l) == 1: return Seq(l[0], Skip())
 
-    if len(l) == 2: return Seq(l[0], l[1])
-
-    return Seq(l[0], sequence(l[1:]))
+    # built from the end, as Seq(l[0], Seq(l[1], ... Seq(l[-2], l[-1])))
+    out = Seq(l[-2], l[-1])
+    for i in range(len(l) - 3, -1, -1):
+        out = Seq(l[i], out)
+
+    return out
+
+def _chain(C: Cmd) -> List[Cmd]:
+    """Returns the commands of a chain of Seqs and Blocks, in order"""
+    out = []
+    stack = [C]
+    while len(stack):
+        c = stack.pop()
+        if isinstance(c, Seq):
+            stack.append(c.cmd1)
+            stack.append(c.cmd0)
+        elif isinstance(c, Block):
+            stack.extend(reversed(c.cmds))
+        else:
+            out.append(c)
+
+    return out
+
+def flatten_blocks(C: Node) -> Node:
+    """Returns C with every chain of Seqs (and Blocks) replaced by a
+    single Block. Subtrees without a Seq are shared with C."""
+    new: Dict[int, Node] = {}
+
+    # children before parents, without recursion
+    stack: list = [(C, None)]
+    while len(stack):
+        n, children = stack.pop()
+        if id(n) in new: continue
+
+        if children is None:
+            if isinstance(n, (Seq, Block)):
+                children = _chain(n)
+            elif isinstance(n, IfThenElse):
+                children = [n.then_, n.else_]
+            elif isinstance(n, While):
+                children = [n.body]
+            elif isinstance(n, Program):
+                children = [n.program]
+            else:
+                new[id(n)] = n
+                continue
+
+            stack.append((n, children))
+            stack.extend([(c, None) for c in children if id(c) not in new])
+            continue
+
+        cs = [new[id(c)] for c in children]
+        if isinstance(n, (Seq, Block)):
+            new[id(n)] = Block(cs)
+        elif all([a is b for a, b in zip(cs, children)]):
+            new[id(n)] = n
+        elif isinstance(n, IfThenElse):
+            new[id(n)] = IfThenElse(n.cond, cs[0], cs[1])
+        elif isinstance(n, While):
+            new[id(n)] = While(n.cond, cs[0])
+        else:
+            new[id(n)] = Program(cs[0])
+            new[id(n)].symbols = n.symbols
+
+    return new[id(C)]
+
+def children(n) -> list:
+    """Returns the nodes (and Scalars) directly inside n, in order of
+    appearance"""
+    if isinstance(n, Program): return [n.program]
+    if isinstance(n, Seq): return [n.cmd0, n.cmd1]
+    if isinstance(n, Block): return list(n.cmds)
+    if isinstance(n, IfThenElse): return [n.cond, n.then_, n.else_]
+    if isinstance(n, While): return [n.cond, n.body]
+    if isinstance(n, Assign): return [n.left, n.right]
+    if isinstance(n, Input): return [n.var]
+    if isinstance(n, BinOp): return [n.left, n.right]
+    if isinstance(n, BoolExpr): return [n.left]
+
+    return []
+
+def walk(C, skip: Callable[[object], bool] = None) -> Iterator:
+    """Yields C and everything inside it, parents first and in order of
+    appearance, without recursion. A node for which skip returns True,
+    called after the node is yielded, is not entered. Shared nodes are
+    yielded every time they appear."""
+    stack = [C]
+    while len(stack):
+        n = stack.pop()
+        yield n
+        if skip is None or not skip(n):
+            stack.extend(reversed(children(n)))
+
+def var_nodes(C: Node) -> Iterator[Var]:
+    """Yields every Var node in C, in order of appearance"""
+    for n in walk(C):
+        if isinstance(n, Var): yield n
+
+class SymbolTable(object):
+    """The variables of a program, each with a dense integer slot, in
+    order of first appearance. Memories laid out by a table can be
+    lists indexed by slot; names are only needed to convert them from
+    and to dicts."""
+    def __init__(self, names: Sequence[str] = ()):
+        self.names: List[str] = []
+        self.slots: Dict[str, int] = {}
+        for x in names: self.add(x)
+
+    def add(self, name: str) -> int:
+        """Returns the slot of name, giving it the next one if it has none"""
+        i = self.slots.get(name)
+        if i is None:
+            i = self.slots[name] = len(self.names)
+            self.names.append(name)
+
+        return i
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.slots
+
+    def to_row(self, m: Dict[str, int]) -> list:
+        """Returns m as a list indexed by slot, with None for undefined variables"""
+        return [m.get(x) for x in self.names]
+
+    def to_memory(self, row: Sequence[Optional[int]]) -> Dict[str, int]:
+        return dict([(x, v) for x, v in zip(self.names, row) if v is not None])
+
+def intern_variables(C: Node, symbols: SymbolTable = None) -> SymbolTable:
+    """Gives every Var in C the slot of its name in symbols (a new table
+    by default), and returns the table. A Program keeps its table in
+    its symbols attribute.
+
+    Slots are stored on the Var nodes, so a node shared between programs
+    has the slot of the last table it was interned in. Readers check
+    that the name at a Var's slot is its own, and look it up by name
+    otherwise (see sem.evaluate_Expr_slots)."""
+    if symbols is None: symbols = SymbolTable()
+
+    for v in var_nodes(C):
+        v.slot = symbols.add(v.name)
+
+    if isinstance(C, Program): C.symbols = symbols
+    return symbols
 
 def test_Program():
     x = Var('x')
@@ -131,6 +296,57 @@ def test_Program():
                 )
     print(t)
 
+def test_flatten_blocks():
+    x = Var('x')
+    y = Var('y')
+
+    loop = While(BoolExpr('<', x, 7), sequence([Assign(x, BinOp('+', x, 1)), Skip(), Input(y)]))
+    t = Program(Seq(sequence([Assign(x, 1), Assign(y, 2)]), Seq(loop, Seq(Block([Skip(), Seq(Input(x), Skip())]), Assign(y, x)))))
+
+    f = flatten_blocks(t)
+    assert str(f) == str(t)
+    assert isinstance(f.program, Block) and len(f.program.cmds) == 7
+    assert isinstance(f.program.cmds[2].body, Block) and f.program.cmds[2].cond is loop.cond
+    assert f.program.cmds[0] is t.program.cmd0.cmd0
+
+    # subtrees without Seqs are unchanged, and long chains don't recurse
+    ite = IfThenElse(BoolExpr('>', x, 7), Assign(y, 1), Skip())
+    assert flatten_blocks(ite) is ite
+    assert len(flatten_blocks(sequence([Assign(x, i) for i in range(20000)])).cmds) == 20000
+
+def test_walk():
+    x = Var('x')
+    loop = While(BoolExpr('<', x, 7), Block([Assign(x, BinOp('+', x, 1)), Input(x)]))
+    p = Program(Seq(IfThenElse(BoolExpr('>', x, 0), Skip(), Assign(x, 2)), loop))
+
+    assert [type(n).__name__ for n in walk(p)] == ['Program', 'Seq', 'IfThenElse', 'BoolExpr', 'Var', 'Skip',
+                                                  'Assign', 'Var', 'int', 'While', 'BoolExpr', 'Var', 'Block',
+                                                  'Assign', 'Var', 'BinOp', 'Var', 'int', 'Input', 'Var']
+    assert [type(n).__name__ for n in walk(p, lambda n: isinstance(n, (IfThenElse, While)))] == \
+        ['Program', 'Seq', 'IfThenElse', 'While']
+    assert children(loop) == [loop.cond, loop.body] and children(x) == []
+
+def test_intern_variables():
+    x = Var('x')
+    y = Var('y')
+
+    p = Program(sequence([Input(y), Assign(x, BinOp('+', Var('y'), 1)),
+                          While(BoolExpr('<', x, 7), Assign(Var('z'), x))]))
+    symbols = intern_variables(p)
+    assert p.symbols is symbols and symbols.names == ['y', 'x', 'z']
+    assert [(v.name, v.slot) for v in var_nodes(p)] == [('y', 0), ('x', 1), ('y', 0), ('x', 1), ('z', 2), ('x', 1)]
+
+    assert symbols.to_row({'x': 3, 'w': 4}) == [None, 3, None]
+    assert symbols.to_memory([None, 3, 5]) == {'x': 3, 'z': 5}
+
+    # interning into an existing table keeps its slots
+    q = Program(Assign(Var('w'), x))
+    assert intern_variables(q, symbols) is symbols and symbols.names == ['y', 'x', 'z', 'w']
+    assert q.program.left.slot == 3 and x.slot == 1
+
 if __name__ == "__main__":
     test_Program()
+    test_flatten_blocks()
+    test_walk()
+    test_intern_variables()
 
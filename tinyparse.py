@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+#
+# tinyparse.py
+#
+# A parser for the concrete syntax of the tiny language, which is the
+# syntax the __str__ methods of tinyast print:
+#
+#   cmds  := cmd (';' cmd)*
+#   cmd   := 'skip' | var ':=' expr | 'input' '(' var ')'
+#          | 'if' '(' cond ')' '{' cmds '}' 'else' '{' cmds '}'
+#          | 'while' '(' cond ')' '{' cmds '}'
+#   expr  := int | var | '(' expr op expr ')'
+#   cond  := var cmp int
+#
+# so that parse(str(p)) is p, up to the nesting of Seqs, which are
+# always built to the right, as tinyast.sequence does.
+#
+# The parser makes a single pass over the tokens and keeps open blocks
+# and parenthesised expressions on explicit stacks, so it takes time
+# linear in the size of the program and does not recurse, however
+# long or deeply nested the program is.
+#
+# To the extent possible under law, the authors have waived all
+# copyright and related or neighboring rights to tinyparse.py. This
+# work is published from: United States.
+
+from typing import Dict, List, Optional, Tuple
+from tinyast import *
+import re
+
+_TOKENS = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<int>\d+)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<punct>:=|<=|>=|==|!=|[-+*/<>(){};])
+  | (?P<error>.)
+""", re.VERBOSE | re.DOTALL)
+
+KEYWORDS = frozenset(['skip', 'input', 'if', 'else', 'while'])
+BINARY_OPS = frozenset(['+', '-', '*', '/'])
+COMPARISON_OPS = frozenset(['<', '>', '==', '<=', '>=', '!='])
+
+_OPEN = object() # an open parenthesis on the expression stack
+
+class ParseError(ValueError):
+    def __init__(self, text: str, pos: int, msg: str):
+        self.line = text.count('\n', 0, pos) + 1
+        self.column = pos - (text.rfind('\n', 0, pos) + 1) + 1
+        self.pos = pos
+
+        super().__init__(f"{self.line}:{self.column}: {msg}")
+
+def tokenize(text: str) -> List[Tuple[str, object, int]]:
+    """Returns the (kind, value, position) tokens of text, ending with an
+    'end' token. Kinds are 'int', 'name' and 'punct', and the value of a
+    'punct' token is its text."""
+    out: List[Tuple[str, object, int]] = []
+    for m in _TOKENS.finditer(text):
+        kind = m.lastgroup
+        if kind == 'space': continue
+        if kind == 'error':
+            raise ParseError(text, m.start(), f"Unexpected character {m.group()!r}")
+
+        out.append((kind, int(m.group()) if kind == 'int' else m.group(), m.start()))
+
+    out.append(('end', None, len(text)))
+    return out
+
+class _Block(object):
+    """A block whose closing brace has not been seen yet"""
+    __slots__ = ['kind', 'cond', 'then_', 'cmds']
+
+    def __init__(self, kind: str, cond: Optional[BoolExpr] = None, then_: Optional[Cmd] = None):
+        self.kind = kind
+        self.cond = cond
+        self.then_ = then_
+        self.cmds: List[Cmd] = []
+
+def _chain(cmds: List[Cmd]) -> Cmd:
+    """Returns cmds as a right-nested Seq, or the only command in cmds"""
+    out = cmds[-1]
+    for i in range(len(cmds) - 2, -1, -1):
+        out = Seq(cmds[i], out)
+
+    return out
+
+class Parser(object):
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.i = 0
+        self.vars: Dict[str, Var] = {} # one Var per name
+
+    def error(self, msg: str):
+        kind, value, pos = self.tokens[self.i]
+        found = "end of input" if kind == 'end' else repr(str(value))
+        raise ParseError(self.text, pos, f"{msg}, found {found}")
+
+    def peek(self):
+        return self.tokens[self.i][1]
+
+    def expect(self, punct: str):
+        kind, value, _ = self.tokens[self.i]
+        if kind != 'punct' or value != punct: self.error(f"Expected {punct!r}")
+        self.i += 1
+
+    def var(self) -> Var:
+        kind, value, _ = self.tokens[self.i]
+        if kind != 'name' or value in KEYWORDS: self.error("Expected a variable")
+        self.i += 1
+
+        v = self.vars.get(value)
+        if v is None:
+            v = self.vars[value] = Var(value)
+
+        return v
+
+    def scalar(self) -> Optional[Scalar]:
+        """Returns the integer literal at the current token, if any"""
+        kind, value, _ = self.tokens[self.i]
+        if kind == 'int':
+            self.i += 1
+            return value
+
+        if value == '-' and self.tokens[self.i + 1][0] == 'int':
+            self.i += 2
+            return -self.tokens[self.i - 1][1]
+
+        return None
+
+    def expr(self) -> Expr:
+        stack: list = [] # _OPEN, left operands and operators
+        while True:
+            if self.peek() == '(':
+                self.i += 1
+                stack.append(_OPEN)
+                continue
+
+            operand = self.scalar()
+            if operand is None:
+                if self.tokens[self.i][0] != 'name': self.error("Expected an expression")
+                operand = self.var()
+
+            # close every parenthesis this operand completes
+            while len(stack) and stack[-1] is not _OPEN:
+                op = stack.pop()
+                left = stack.pop()
+                self.expect(')')
+                stack.pop()
+                operand = BinOp(op, left, operand)
+
+            if len(stack) == 0: return operand
+
+            op = self.peek()
+            if self.tokens[self.i][0] != 'punct' or op not in BINARY_OPS: self.error("Expected an operator")
+            self.i += 1
+            stack.append(operand)
+            stack.append(op)
+
+    def cond(self) -> BoolExpr:
+        self.expect('(')
+        left = self.var()
+
+        op = self.peek()
+        if self.tokens[self.i][0] != 'punct' or op not in COMPARISON_OPS: self.error("Expected a comparison")
+        self.i += 1
+
+        right = self.scalar()
+        if right is None: self.error("Expected an integer")
+        self.expect(')')
+
+        return BoolExpr(op, left, right)
+
+    def program(self) -> Program:
+        blocks = [_Block('program')]
+
+        while True:
+            # a command starts here
+            kind, value, _ = self.tokens[self.i]
+            if kind == 'name' and value == 'skip':
+                self.i += 1
+                cmd: Cmd = Skip()
+            elif kind == 'name' and value == 'input':
+                self.i += 1
+                self.expect('(')
+                cmd = Input(self.var())
+                self.expect(')')
+            elif kind == 'name' and (value == 'if' or value == 'while'):
+                self.i += 1
+                cond = self.cond()
+                self.expect('{')
+                blocks.append(_Block(value, cond))
+                continue
+            elif kind == 'name' and value not in KEYWORDS:
+                left = self.var()
+                self.expect(':=')
+                cmd = Assign(left, self.expr())
+            else:
+                self.error("Expected a command")
+
+            # add cmd to its block, and close the blocks that end after it
+            while True:
+                b = blocks[-1]
+                b.cmds.append(cmd)
+
+                value = self.peek()
+                if value == ';':
+                    self.i += 1
+                    break
+
+                if b.kind == 'program':
+                    if self.tokens[self.i][0] != 'end': self.error("Expected ';' or end of input")
+                    return Program(_chain(b.cmds))
+
+                self.expect('}')
+                blocks.pop()
+                body = _chain(b.cmds)
+
+                if b.kind == 'if':
+                    if self.peek() != 'else': self.error("Expected 'else'")
+                    self.i += 1
+                    self.expect('{')
+                    blocks.append(_Block('else', b.cond, body))
+                    break
+                elif b.kind == 'else':
+                    cmd = IfThenElse(b.cond, b.then_, body)
+                else:
+                    cmd = While(b.cond, body)
+
+def parse(text: str) -> Program:
+    """Returns the Program that text is the concrete syntax of, or raises
+    ParseError. The program's variables are interned."""
+    p = Parser(text).program()
+    intern_variables(p)
+    return p
+
+def test_parse():
+    x = Var('x')
+    y = Var('y')
+    z = Var('z')
+
+    programs = [Program(Skip()),
+                Program(Input(x)),
+                Program(Assign(x, -3)),
+                Program(Assign(x, BinOp('-', x, -3))),
+                Program(sequence([Assign(x, 9)])),
+                Program(sequence([Assign(x, BinOp('*', BinOp('+', x, 1), BinOp('/', y, BinOp('-', 2, z)))),
+                                  Input(y),
+                                  Skip()])),
+                Program(IfThenElse(BoolExpr('>', x, 7),
+                                   Assign(y, BinOp('-', x, 7)),
+                                   Assign(y, BinOp('-', 7, x)))),
+                Program(sequence([Assign(x, 0),
+                                  While(BoolExpr('<=', x, -1),
+                                        sequence([IfThenElse(BoolExpr('!=', x, 50),
+                                                             sequence([Assign(x, 10), Skip()]),
+                                                             While(BoolExpr('==', y, 0), Input(y))),
+                                                  Assign(x, BinOp('+', x, 1))])),
+                                  Assign(z, x)]))]
+
+    for p in programs:
+        q = parse(str(p))
+        assert str(q) == str(p), f"{q} != {p}"
+
+    q = parse("if(x >= 1) {\n  x := (x - 1);\n  y := x\n} else {\n  skip\n}")
+    assert isinstance(q.program, IfThenElse) and isinstance(q.program.then_, Seq)
+    assert q.program.cond.left is q.program.then_.cmd0.left # one Var per name
+
+    for text, where in [("", "1:1"), ("x := ", "1:6"), ("x := 1;", "1:8"), ("x := (1 + 2", "1:12"),
+                        ("if(x > 1) { skip }", "1:19"), ("while(x > y) { skip }", "1:11"),
+                        ("skip;\nskip skip", "2:6"), ("x := 1 $ 2", "1:8"), ("if := 1", "1:4"), ("else := 1", "1:1")]:
+        try:
+            parse(text)
+            assert False, f"Expected a ParseError for {text!r}"
+        except ParseError as e:
+            assert str(e).startswith(where + ":"), f"{text!r}: {e}"
+
+def test_parse_large():
+    # long and deeply nested programs don't recurse
+    p = parse("; ".join([f"x{i % 10} := (x{i % 7} + {i})" for i in range(100000)]))
+    assert isinstance(p.program, Seq) and str(p).endswith("x9 := (x4 + 99999)")
+
+    depth = 5000
+    p = parse("while(x < 1) { " * depth + "skip" + " }" * depth)
+    assert isinstance(p.program, While)
+
+    p = parse("x := " + "(" * depth + "1" + " + 1)" * depth)
+    assert isinstance(p.program.right, BinOp)
+
+if __name__ == "__main__":
+    test_parse()
+    test_parse_large()